@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+# بنچمارک‌های آفلاین پارسر، رندر و مسیر رای؛ اجرا: python -m benchmarks.run
@@ -0,0 +1,87 @@
+# benchmarks/corpus.py
+import random
+from telethon.tl.types import MessageEntityTextUrl, MessageEntityBold
+
+# تولیدکننده پیام‌های مصنوعی 🥞 شبیه کانال منبع، همراه با entityهای تلتون.
+# offsetها مثل تلگرام بر حسب واحد UTF-16 محاسبه می‌شوند.
+
+TOKEN_NAMES = ["JUDICA", "🚀MoonDog", "PEPE CEO", "Baby🐸", "SafeYield", "🔥Inferno", "LUNA2", "Cat In Hat"]
+DEXES = ["PancakeSwap", "PancakeSwap V3", "BiSwap", "ApeSwap"]
+
+
+def _utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _money(rng, low, high):
+    value = rng.uniform(low, high)
+    for suffix, scale in (("B", 1e9), ("M", 1e6), ("K", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.1f}{suffix}"
+    return f"{value:.1f}"
+
+
+def generate_post(rng, th_count=10, th_as_entities=True):
+    """یک پیام 🥞 و entityهایش را برمی‌گرداند: (message_text, entities)"""
+    address = "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40))
+    name = rng.choice(TOKEN_NAMES)
+    symbol = name.strip("🚀🐸🔥").split()[0].upper()[:8]
+    percents = [f"{rng.uniform(0.5, 15):.1f}%" for _ in range(th_count)]
+
+    lines = [
+        f"🥞 {address}",
+        f"┌{name} ({symbol}) (https://t.me/{symbol.lower()}_portal)",
+        f"├USD: ${rng.uniform(0.000001, 2):.7f}",
+        f"├MC: ${_money(rng, 5e3, 5e7)}",
+        f"├Vol: ${_money(rng, 1e3, 5e6)}",
+        f"├Seen: {rng.randint(1, 59)}m ago",
+        f"├Dex: {rng.choice(DEXES)}",
+        f"├Dex Paid: {rng.choice('🟢🔴')}",
+        f"├CA Verified: {rng.choice('🟢🔴')}",
+        f"├Honeypot: {rng.choice(['✅ Safe', '⚠️ Unknown'])}",
+        f"├Holder: Top 10: {rng.choice('🟡🟢')} {rng.randint(10, 90)}%",
+    ]
+    if th_as_entities:
+        th_line = "└TH: " + " | ".join(percents)
+    else:
+        th_line = "└TH: " + "| ".join(f"{p} (https://bscscan.com/address/0x{i:040x})" for i, p in enumerate(percents))
+    lines.append(th_line)
+    lines.append("")
+    lines.append(f"📈 Chart: https://mevx.io/bsc/{address}")
+    lines.append(f"🔥 {rng.randint(1, 40)}x calls in the last hour")
+    text = "\n".join(lines)
+
+    entities = [MessageEntityBold(offset=0, length=_utf16_len(lines[0]))]
+    if th_as_entities:
+        th_offset = _utf16_len("\n".join(lines[:11])) + 1 + _utf16_len("└TH: ")
+        for i, percent in enumerate(percents):
+            entities.append(MessageEntityTextUrl(
+                offset=th_offset, length=_utf16_len(percent),
+                url=f"https://bscscan.com/address/0x{i:040x}"
+            ))
+            th_offset += _utf16_len(percent) + 3
+    return text, entities
+
+
+def generate_corpus(count, seed=1234):
+    """corpus تکرارپذیر؛ حدود یک پنجم پیام‌ها TH را بدون entity (مسیر فال‌بک Regex) دارند."""
+    rng = random.Random(seed)
+    return [generate_post(rng, th_as_entities=rng.random() > 0.2) for _ in range(count)]
+
+
+def generate_digest(posts):
+    """پیام بزرگ ترکیبی (مثل پست‌های خلاصه آینده) با همه entityهای پیام‌های ورودی."""
+    parts = []
+    entities = []
+    offset = 0
+    for text, post_entities in posts:
+        entities.extend(_shifted(entity, offset) for entity in post_entities)
+        parts.append(text)
+        offset += _utf16_len(text) + 2
+    return "\n\n".join(parts), entities
+
+
+def _shifted(entity, delta):
+    if isinstance(entity, MessageEntityTextUrl):
+        return MessageEntityTextUrl(offset=entity.offset + delta, length=entity.length, url=entity.url)
+    return type(entity)(offset=entity.offset + delta, length=entity.length)
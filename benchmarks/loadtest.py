@@ -0,0 +1,351 @@
+# benchmarks/loadtest.py
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telethon import events, utils as telethon_utils
+from telethon.tl.types import Message
+from telegram.error import RetryAfter, TimedOut
+
+from benchmarks.corpus import generate_post
+
+# تست بار آفلاین کل خط لوله بدون سشن تلتون و توکن واقعی ربات.
+# یک منبع رویداد جعلی پیام‌های 🥞 را با نرخ و شکل انفجار دلخواه به new_message_handler می‌دهد،
+# یک Bot جعلی تأخیر شبکه، RetryAfter و TimedOut را شبیه‌سازی می‌کند و رای‌های جعلی به handle_vote می‌رسند.
+# اجرا از ریشه مخزن (config.py لازم است ولی هیچ اتصال شبکه‌ای برقرار نمی‌شود):
+#   python -m benchmarks.loadtest --duration 60 --rate 5 --shape burst --burst-size 20
+#   python -m benchmarks.loadtest --retry-after-prob 0.05 --timeout-prob 0.02 --json result.json
+
+QUEUE_SAMPLE_INTERVAL_SECONDS = 0.25
+
+
+class FakeBot:
+    """جایگزین telegram.Bot برای send_message و edit_message_reply_markup با تأخیر و خطای تصادفی."""
+
+    def __init__(self, rng, latency_ms=80.0, latency_jitter_ms=40.0, retry_after_prob=0.0,
+                 retry_after_seconds=2, timeout_prob=0.0):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.retry_after_prob = retry_after_prob
+        self.retry_after_seconds = retry_after_seconds
+        self.timeout_prob = timeout_prob
+        self._message_ids = itertools.count(1)
+        self.sent_messages = []  # [(chat_id, message_id)]
+        self.calls = 0
+        self.retry_afters = 0
+        self.timeouts = 0
+        self.edits = 0
+
+    async def _api_call(self):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000)
+        roll = self.rng.random()
+        if roll < self.retry_after_prob:
+            self.retry_afters += 1
+            raise RetryAfter(self.retry_after_seconds)
+        if roll < self.retry_after_prob + self.timeout_prob:
+            self.timeouts += 1
+            raise TimedOut()
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None, disable_web_page_preview=None):
+        await self._api_call()
+        message_id = next(self._message_ids)
+        self.sent_messages.append((chat_id, message_id))
+        return SimpleNamespace(message_id=message_id, chat_id=chat_id)
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        await self._api_call()
+        self.edits += 1
+        return True
+
+
+def source_peer(chat_id):
+    """Peer تلتون برای شناسه علامت‌دار یک کانال (-100...)؛ event.chat_id همان شناسه را برمی‌گرداند."""
+    real_id, peer_type = telethon_utils.resolve_id(chat_id)
+    return peer_type(real_id)
+
+
+def _fake_event(message_id, text, entities, source_channel_id):
+    message = Message(
+        id=message_id, peer_id=source_peer(source_channel_id),
+        date=datetime.datetime.now(datetime.timezone.utc), message=text, entities=entities, post=True
+    )
+    return events.NewMessage.Event(message)
+
+
+def _interarrival_delays(rng, shape, rate, burst_size):
+    """فاصله زمانی قبل از هر پیام را برای شکل بار انتخاب‌شده تولید می‌کند (میانگین نرخ rate در ثانیه)."""
+    if shape == "poisson":
+        while True:
+            yield rng.expovariate(rate)
+    elif shape == "burst":
+        while True:
+            yield burst_size / rate
+            for _ in range(burst_size - 1):
+                yield 0.0
+    else:
+        while True:
+            yield 1.0 / rate
+
+
+async def feed_source(bot_module, args, rng, stats):
+    """پیام‌های مصنوعی را تا پایان مدت تست به هندلر تلتون می‌دهد."""
+    deadline = time.monotonic() + args.duration
+    recent_posts = []
+    message_ids = itertools.count(1)
+    sources = bot_module.routing_table.source_chat_ids()
+    for delay in _interarrival_delays(rng, args.shape, args.rate, args.burst_size):
+        if delay:
+            await asyncio.sleep(delay)
+        if time.monotonic() >= deadline:
+            break
+        if recent_posts and rng.random() < args.duplicate_ratio:
+            text, entities = rng.choice(recent_posts)
+        else:
+            text, entities = generate_post(rng)
+            recent_posts = (recent_posts + [(text, entities)])[-50:]
+        stats["offered"] += 1
+        source = sources[0] if len(sources) == 1 else rng.choice(sources)
+        await bot_module.new_message_handler(_fake_event(next(message_ids), text, entities, source))
+
+
+async def feed_votes(handle_vote, fake_bot, args, rng, stats):
+    """رای‌های جعلی روی پیام‌های ارسال‌شده با نرخ votes_per_second."""
+    answers = {}
+
+    async def answer(text=None, **kwargs):
+        answers[text] = answers.get(text, 0) + 1
+
+    context = SimpleNamespace(bot=fake_bot)
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        await asyncio.sleep(rng.expovariate(args.votes_per_second))
+        if not fake_bot.sent_messages:
+            continue
+        chat_id, message_id = rng.choice(fake_bot.sent_messages[-100:])
+        query = SimpleNamespace(
+            from_user=SimpleNamespace(id=rng.randrange(args.voters)),
+            message=SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id)),
+            data=rng.choice(("vote_green", "vote_red")),
+            answer=answer,
+        )
+        stats["votes"] += 1
+        await handle_vote(SimpleNamespace(callback_query=query), context)
+    stats["vote_answers"] = answers
+
+
+async def sample_queues(bot_module, samples):
+    while True:
+        samples.append({
+            "ingest": bot_module.ingest_queue.qsize(),
+            "outbox": bot_module.outbox.qsize(),
+            "main": bot_module.main_sender.queue.qsize(),
+            "secondary": bot_module.secondary_sender.queue.qsize(),
+        })
+        await asyncio.sleep(QUEUE_SAMPLE_INTERVAL_SECONDS)
+
+
+def _queue_summary(samples):
+    summary = {}
+    for name in ("ingest", "outbox", "main", "secondary"):
+        values = [sample[name] for sample in samples] or [0]
+        summary[name] = {"max": max(values), "avg": round(sum(values) / len(values), 2)}
+    return summary
+
+
+async def run_loadtest(args, source=None):
+    """
+    کل خط لوله را با Bot جعلی اجرا و گزارش را برمی‌گرداند.
+    source(bot_module, args, rng, stats) منبع پیام است؛ پیش‌فرض feed_source (پیام‌های مصنوعی).
+    """
+    import database
+    database.DB_NAME = os.path.join(args.tmp_dir, "loadtest.db")
+
+    import bot as bot_module
+    from handlers import handle_vote
+    from utils import MessageRateLimiter, TokenBucketRateLimiter
+    from votes import vote_journal, vote_markup_coalescer
+    from tracing import tracer
+    from windows import window_schedule
+
+    rng = random.Random(args.seed)
+    fake_bot = FakeBot(
+        rng, args.latency_ms, args.latency_jitter_ms, args.retry_after_prob, args.retry_after_seconds, args.timeout_prob
+    )
+
+    # پارامترهای خط لوله برای این اجرا
+    bot_module.message_capture = None  # پیام‌های تست بار ضبط نمی‌شوند
+    await database.init_db(bot_module.SECONDARY_CHANNEL_ID)
+    routes = await bot_module.routing_table.load(bot_module.ROUTE_SPECS)
+    # کارگرهای همه مقصدها از قبل ساخته می‌شوند تا تنظیمات این اجرا روی همه اعمال شود
+    for chat_id in bot_module.routing_table.destination_chat_ids():
+        bot_module.destination_sender(chat_id)
+    senders = list(bot_module.destination_senders.values())
+    if args.receive_per_minute:
+        for route in routes:
+            route.receive_limiter = MessageRateLimiter(args.receive_per_minute, name=f"receive_route_{route.id}")
+    if args.send_per_minute:
+        send_limiter = TokenBucketRateLimiter(args.send_per_minute)
+        for sender in senders:
+            sender.rate_limiter = send_limiter
+        vote_markup_coalescer.rate_limiter = send_limiter
+    if args.no_send_delay:
+        for sender in senders:
+            sender.send_delay_seconds = 0
+            sender.send_delay_jitter = 0
+
+    if args.secondary:
+        await window_schedule.load()
+        await window_schedule.add(bot_module.SECONDARY_CHANNEL_ID, time.time() - 1, 24 * 3600)
+    await bot_module.outbox.start()
+    vote_journal.start()
+    tracer.start()
+
+    stats = {"offered": 0, "votes": 0}
+    samples = []
+    background = [
+        asyncio.create_task(bot_module.ingest_worker()),
+        *(asyncio.create_task(bot_module.skipped_message_drainer(route)) for route in routes),
+        asyncio.create_task(bot_module.message_sender(fake_bot)),
+        asyncio.create_task(sample_queues(bot_module, samples)),
+    ]
+    started = time.monotonic()
+    feeders = [asyncio.create_task((source or feed_source)(bot_module, args, rng, stats))]
+    if args.votes_per_second > 0:
+        feeders.append(asyncio.create_task(feed_votes(handle_vote, fake_bot, args, rng, stats)))
+    await asyncio.gather(*feeders)
+    feed_seconds = time.monotonic() - started
+
+    # تخلیه صف‌ها تا سقف drain_timeout؛ شامل صف زمان‌بند هر مقصد
+    def drained():
+        return (bot_module.ingest_queue.qsize() == 0 and bot_module.outbox.qsize() == 0
+                and not any(route.receive_limiter.skipped_messages for route in routes)
+                and not any(sender.queue.qsize() for sender in bot_module.destination_senders.values()))
+
+    drain_deadline = time.monotonic() + args.drain_timeout
+    while not drained() and time.monotonic() < drain_deadline:
+        await asyncio.sleep(0.1)
+    is_drained = drained()
+    elapsed = time.monotonic() - started
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    trace_count, latency, trace_retries = await tracer.latency_report(elapsed + 60)
+    destinations = {sender.name: sender for sender in senders}
+    # پیام‌های تحویل‌شده به مقصد اصلی هر مسیر
+    main_sent = sum(bot_module.destination_senders[route.destinations[0]].sent for route in routes)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "tmp_dir"},
+        "feed_seconds": round(feed_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "drained": is_drained,
+        "offered": stats["offered"],
+        "sent": {name: sender.sent for name, sender in destinations.items()},
+        "throughput_per_second": round(main_sent / elapsed, 3) if elapsed else 0.0,
+        "drops": {
+            "ingest_queue_full": bot_module.ingest_dropped,
+            "deduplicated": sum(route.recent.hits for route in routes),
+            "receive_backlog": {route.id: route.receive_limiter.skipped_stats() for route in routes},
+            "scheduler": {name: sender.queue.stats() for name, sender in destinations.items()},
+            "send_failed": {name: sender.failed for name, sender in destinations.items()},
+            "undelivered_in_outbox": bot_module.outbox.qsize(),
+        },
+        "queue_depth": _queue_summary(samples),
+        "fake_bot": {
+            "api_calls": fake_bot.calls, "retry_after": fake_bot.retry_afters,
+            "timed_out": fake_bot.timeouts, "edits": fake_bot.edits,
+        },
+        "votes": {"offered": stats["votes"], "answers": stats.get("vote_answers", {}),
+                  "coalescer": vote_markup_coalescer.stats()},
+        "latency": {"traces": trace_count, "retries": trace_retries, "spans": latency},
+    }
+
+    await vote_markup_coalescer.close()
+    await vote_journal.close()
+    await bot_module.outbox.close()
+    await tracer.close()
+    await database.close_db()
+    return report
+
+
+def print_report(report):
+    print(f"offered {report['offered']} posts in {report['feed_seconds']}s, "
+          f"finished after {report['elapsed_seconds']}s")
+    if not report["drained"]:
+        print(f"NOT DRAINED: queues still had work after --drain-timeout {report['config']['drain_timeout']}s; "
+              f"throughput and latency below are incomplete")
+    sent = " ".join(f"{name}={count}" for name, count in report["sent"].items())
+    print(f"sent: {sent} ({report['throughput_per_second']}/s sustained)")
+    print("drops:")
+    for name, value in report["drops"].items():
+        print(f"  {name}: {value}")
+    print("queue depth (max / avg):")
+    for name, value in report["queue_depth"].items():
+        print(f"  {name}: {value['max']} / {value['avg']}")
+    print(f"fake bot: {report['fake_bot']}")
+    print(f"votes: {report['votes']}")
+    latency = report["latency"]
+    print(f"latency over {latency['traces']} deliveries ({latency['retries']} retries), seconds:")
+    print(f"  {'span':<12}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in latency["spans"].items():
+        print(f"  {name:<12}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+
+
+def build_arg_parser(description="Offline load test of the forwarding pipeline"):
+    arg_parser = argparse.ArgumentParser(description=description)
+    arg_parser.add_argument("--duration", type=float, default=30, help="seconds of synthetic source traffic")
+    arg_parser.add_argument("--rate", type=float, default=2.0, help="average source posts per second")
+    arg_parser.add_argument("--shape", choices=("steady", "poisson", "burst"), default="poisson")
+    arg_parser.add_argument("--burst-size", type=int, default=10, help="posts per burst for --shape burst")
+    arg_parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="share of re-posted messages")
+    arg_parser.add_argument("--latency-ms", type=float, default=80.0, help="mean fake Bot API latency")
+    arg_parser.add_argument("--latency-jitter-ms", type=float, default=40.0)
+    arg_parser.add_argument("--retry-after-prob", type=float, default=0.0, help="chance of RetryAfter per API call")
+    arg_parser.add_argument("--retry-after-seconds", type=int, default=2)
+    arg_parser.add_argument("--timeout-prob", type=float, default=0.0, help="chance of TimedOut per API call")
+    arg_parser.add_argument("--votes-per-second", type=float, default=5.0)
+    arg_parser.add_argument("--voters", type=int, default=500)
+    arg_parser.add_argument("--secondary", action="store_true", help="also deliver to the secondary channel")
+    arg_parser.add_argument("--receive-per-minute", type=int, help="override MAX_MESSAGES_PER_MINUTE for receive")
+    arg_parser.add_argument("--send-per-minute", type=int, help="override MAX_MESSAGES_PER_MINUTE for sends")
+    arg_parser.add_argument("--no-send-delay", action="store_true", help="ignore SEND_DELAY_SECONDS/JITTER")
+    arg_parser.add_argument("--drain-timeout", type=float, default=60, help="max seconds to wait for queues to empty")
+    arg_parser.add_argument("--seed", type=int, default=1234)
+    arg_parser.add_argument("--json", help="also write the report to this file")
+    arg_parser.add_argument("--verbose", action="store_true", help="keep pipeline INFO logs")
+    return arg_parser
+
+
+def run_and_report(args, source=None):
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args.tmp_dir = tmp_dir
+        report = asyncio.run(run_loadtest(args, source))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    report = run_and_report(args)
+    return 0 if report["drained"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
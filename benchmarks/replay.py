@@ -0,0 +1,106 @@
+# benchmarks/replay.py
+import asyncio
+import datetime
+import logging
+import sys
+import time
+
+from telethon import events
+from telethon.tl.types import Message
+
+from benchmarks.loadtest import build_arg_parser, run_and_report, source_peer
+from benchmarks.run import _summarize
+
+# بازپخش پیام‌های ضبط‌شده با CAPTURE_DIR (capture.py) برای بازتولید انفجارها و پسرفت‌ها به صورت آفلاین.
+# اجرا از ریشه مخزن:
+#   python -m benchmarks.replay captures/ --parse-only         فقط transform_message و گزارش خطاهای تجزیه
+#   python -m benchmarks.replay captures/ --speed 1            کل خط لوله با همان فاصله‌های زمانی اصلی
+#   python -m benchmarks.replay captures/ --speed 10 --secondary   ده برابر سریع‌تر (0 یعنی بدون مکث)
+# همه گزینه‌های benchmarks.loadtest (Bot جعلی، محدودیت‌ها، رای‌ها) اینجا هم قابل استفاده‌اند.
+
+MAX_PRINTED_FAILURES = 10
+
+
+def load_records(path):
+    from capture import capture_files, read_capture
+    files = capture_files(path)
+    if not files:
+        raise SystemExit(f"No capture files found at {path}")
+    records = list(read_capture(files))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def replay_parser(records):
+    """همه رکوردها را از transform_message عبور می‌دهد و خطاهای تجزیه را گزارش می‌کند."""
+    from parser import transform_message, deserialize_entities
+
+    samples = []
+    failures = []
+    for record in records:
+        text = record["text"]
+        if not text.strip().startswith("🥞") or len(text.strip()) <= 1:
+            continue
+        entities = deserialize_entities(record["entities"])
+        start = time.perf_counter_ns()
+        result = transform_message(text, entities)
+        samples.append(time.perf_counter_ns() - start)
+        if not result[0]:
+            failures.append(record)
+
+    stats = _summarize(samples) if samples else {"ops": 0, "p50_us": 0.0, "p99_us": 0.0}
+    print(f"parsed {stats['ops']} 🥞 posts of {len(records)} captured messages, "
+          f"p50 {stats['p50_us']:.1f}µs p99 {stats['p99_us']:.1f}µs, {len(failures)} failed")
+    for record in failures[:MAX_PRINTED_FAILURES]:
+        received = datetime.datetime.fromtimestamp(record["t"]).isoformat(timespec="seconds")
+        print(f"--- FAILED MESSAGE (id {record['id']}, received {received}) ---\n{record['text']}\n")
+    return 1 if failures else 0
+
+
+def make_replay_source(records, speed):
+    """منبع پیام برای run_loadtest که رکوردها را با فاصله‌های اصلی تقسیم بر speed پخش می‌کند."""
+    from parser import deserialize_entities
+
+    async def replay_source(bot_module, args, rng, stats):
+        first_t = records[0]["t"]
+        started = time.monotonic()
+        for record in records:
+            if speed > 0:
+                delay = (record["t"] - first_t) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # تأخیر اصلی انتشار تا دریافت حفظ می‌شود تا source_lag در trace معنا داشته باشد
+            now = time.time()
+            source_lag = record["t"] - record["date"] if record.get("date") else 0.0
+            message = Message(
+                id=record["id"], peer_id=source_peer(record.get("chat_id") or bot_module.SOURCE_CHANNEL_ID),
+                date=datetime.datetime.fromtimestamp(now - source_lag, datetime.timezone.utc),
+                message=record["text"], entities=deserialize_entities(record["entities"]), post=True
+            )
+            stats["offered"] += 1
+            await bot_module.new_message_handler(events.NewMessage.Event(message))
+    return replay_source
+
+
+def main(argv=None):
+    arg_parser = build_arg_parser("Replay captured source messages through the parser or the full pipeline")
+    arg_parser.add_argument("capture", help="capture directory (CAPTURE_DIR) or a single .jsonl.gz file")
+    arg_parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier; 0 replays without pauses")
+    arg_parser.add_argument("--parse-only", action="store_true", help="only run transform_message and report failures")
+    args = arg_parser.parse_args(argv)
+
+    records = load_records(args.capture)
+    if args.parse_only:
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+        return replay_parser(records)
+
+    span = records[-1]["t"] - records[0]["t"]
+    # رای‌های جعلی در همان مدت بازپخش تولید می‌شوند
+    args.duration = span / args.speed if args.speed > 0 else 0.0
+    print(f"Replaying {len(records)} messages spanning {span:.1f}s at {args.speed or 'max'}x")
+    report = run_and_report(args, make_replay_source(records, args.speed))
+    return 0 if report["drained"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# benchmarks/run.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from benchmarks.corpus import generate_corpus, generate_digest
+
+# بنچمارک آفلاین: پارسر، تبدیل HTML، ساخت کیبورد و مسیر رای روی یک DB موقت.
+# اجرا از ریشه مخزن:
+#   python -m benchmarks.run                  مقایسه با baseline ذخیره‌شده (در صورت وجود)
+#   python -m benchmarks.run --save-baseline  ذخیره نتایج فعلی به عنوان baseline همین ماشین
+#   python -m benchmarks.run --check          در صورت کندتر شدن از حد مجاز، کد خروج 1
+# زمان‌های مطلق به ماشین وابسته‌اند، پس baseline در مخزن نیست (gitignore) و باید روی همان ماشین
+# (مثلاً روی کد شاخه اصلی) با --save-baseline ساخته شود؛ --check بدون آن اجرا نمی‌شود.
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.25  # کندتر شدن p50 بیش از ۲۵٪ پسرفت حساب می‌شود
+
+
+def _percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def _summarize(samples_ns):
+    samples_ns.sort()
+    total_seconds = sum(samples_ns) / 1e9
+    return {
+        "ops": len(samples_ns),
+        "ops_per_sec": len(samples_ns) / total_seconds if total_seconds else 0.0,
+        "p50_us": _percentile(samples_ns, 0.50) / 1e3,
+        "p99_us": _percentile(samples_ns, 0.99) / 1e3,
+    }
+
+
+def _time_calls(func, args_list, rounds):
+    samples = []
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(rounds):
+        for args in args_list:
+            start = perf_counter_ns()
+            func(*args)
+            samples.append(perf_counter_ns() - start)
+    return _summarize(samples)
+
+
+async def _time_async_calls(func, args_list):
+    samples = []
+    perf_counter_ns = time.perf_counter_ns
+    for args in args_list:
+        start = perf_counter_ns()
+        await func(*args)
+        samples.append(perf_counter_ns() - start)
+    return _summarize(samples)
+
+
+def bench_transform_message(corpus, rounds):
+    from parser import transform_message
+    return _time_calls(transform_message, corpus, rounds)
+
+
+def bench_entities_to_html(corpus, rounds):
+    from parser import entities_to_html
+    digest_text, digest_entities = generate_digest(corpus[:50])
+    post_args = [(entities, text) for text, entities in corpus]
+    return {
+        "entities_to_html[post]": _time_calls(entities_to_html, post_args, rounds),
+        "entities_to_html[digest]": _time_calls(entities_to_html, [(digest_entities, digest_text)], rounds * 20),
+    }
+
+
+def _fixture_static_rows():
+    """ردیف‌های ثابت کیبورد با لینک‌های نمونه تا بنچمارک بدون config.py اجرا شود."""
+    from telegram import InlineKeyboardButton
+    gift_row = (InlineKeyboardButton("gift", url="https://example.com/gift"),)
+    links_row = (
+        InlineKeyboardButton("axiom", url="https://example.com/axiom"),
+        InlineKeyboardButton("support", url="https://example.com/support"),
+    )
+    rows = (gift_row, links_row)
+    return lambda: rows
+
+
+def bench_keyboard(corpus, rounds):
+    from parser import transform_message
+    from render import build_post_keyboard
+    addresses = [transform_message(text, entities)[4] for text, entities in corpus]
+    rng = random.Random(7)
+    args = [(address, rng.randint(0, 500), rng.randint(0, 500)) for address in addresses]
+    # _static_rows در ربات کش شده است؛ نسخه fixture هم فقط یک tuple آماده برمی‌گرداند
+    with mock.patch("render._static_rows", _fixture_static_rows()):
+        return _time_calls(build_post_keyboard, args, rounds)
+
+
+async def bench_vote_path(vote_count, message_count=50, user_count=5000):
+    import database
+    from votes import VoteJournal
+
+    rng = random.Random(42)
+    votes = [
+        (rng.randrange(message_count), rng.randrange(user_count), rng.choice(("green", "red")))
+        for _ in range(vote_count)
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        original_db_name = database.DB_NAME
+        database.DB_NAME = os.path.join(tmp_dir, "bench.db")
+        try:
+            await database.init_db(0)
+            for message_id in range(message_count):
+                await database.register_message_in_votes(message_id, -100, f"0x{message_id:040x}")
+            results["database.process_vote"] = await _time_async_calls(database.process_vote, votes)
+
+            journal = VoteJournal()
+            journal.start()
+            shifted = [(message_id + message_count, user_id, vote_type) for message_id, user_id, vote_type in votes]
+            results["VoteJournal.process_vote"] = await _time_async_calls(journal.process_vote, shifted)
+            await journal.close()
+        finally:
+            await database.close_db()
+            database.DB_NAME = original_db_name
+    return results
+
+
+def run_all(args):
+    corpus = generate_corpus(args.messages)
+    results = {
+        "transform_message": bench_transform_message(corpus, args.rounds),
+        "build_post_keyboard": bench_keyboard(corpus, args.rounds),
+    }
+    results.update(bench_entities_to_html(corpus, args.rounds))
+    results.update(asyncio.run(bench_vote_path(args.votes)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """نتایج را چاپ و نام بنچمارک‌هایی را که پسرفت داشته‌اند برمی‌گرداند."""
+    regressions = []
+    print(f"{'benchmark':<28}{'ops/s':>12}{'p50 µs':>10}{'p99 µs':>10}{'vs base p50':>14}")
+    for name, stats in results.items():
+        line = f"{name:<28}{stats['ops_per_sec']:>12.0f}{stats['p50_us']:>10.1f}{stats['p99_us']:>10.1f}"
+        base = baseline.get(name)
+        if base and base.get("p50_us"):
+            ratio = stats["p50_us"] / base["p50_us"]
+            marker = "  REGRESSION" if ratio > 1 + tolerance else ""
+            line += f"{ratio:>13.2f}x{marker}"
+            if marker:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Offline parser/render/vote benchmarks")
+    arg_parser.add_argument("--messages", type=int, default=500, help="size of the synthetic corpus")
+    arg_parser.add_argument("--rounds", type=int, default=5, help="passes over the corpus per benchmark")
+    arg_parser.add_argument("--votes", type=int, default=2000, help="votes for the vote-path benchmarks")
+    arg_parser.add_argument("--baseline", default=BASELINE_FILE)
+    arg_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    arg_parser.add_argument("--save-baseline", action="store_true")
+    arg_parser.add_argument("--check", action="store_true", help="exit with status 1 on regression")
+    args = arg_parser.parse_args(argv)
+    if args.check and not os.path.exists(args.baseline):
+        print(f"No local baseline at {args.baseline}. Run with --save-baseline on this machine first.")
+        return 2
+
+    # لاگ‌های INFO پارسر زمان‌سنجی را خراب می‌کنند
+    logging.disable(logging.CRITICAL)
+    results = run_all(args)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"Regressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,18 +7,32 @@ import traceback
 import os
 from telethon import TelegramClient, events
 from telethon.errors import (
-    FloodWaitError, ChatWriteForbiddenError, UserIsBlockedError,
-    SessionPasswordNeededError, PhoneNumberBannedError, 
-    ChannelInvalidError, ChannelPrivateError, MessageTooLongError
+    ChatWriteForbiddenError, UserIsBlockedError,
+    ChannelInvalidError, ChannelPrivateError, MessageTooLongError, RPCError
 )
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler
-from telegram.error import TelegramError, TimedOut, BadRequest, NetworkError
+from telegram.error import TelegramError, TimedOut, BadRequest, NetworkError, RetryAfter
 from config import *
-from database import init_db, load_settings, register_message_in_votes
-from parser import transform_message, entities_to_html
-from utils import MessageRateLimiter, SendRateLimiter, skipped_messages_lock
-from handlers import set_secondary, stop_secondary, status, handle_vote
+from database import init_db, close_db
+from votes import vote_journal, vote_markup_coalescer
+from render import build_post_keyboard
+from parser import entities_to_html, serialize_entities, deserialize_entities
+from dedup import SentLedger, text_content_key
+from pipeline import DestinationSender, DeliveryJob
+from outbox import Outbox, OUTBOX_REPLAY_GRACE_SECONDS
+from routing import routing_table, DEFAULT_PARSER
+from windows import window_schedule
+from scheduler import SendScheduler, make_priority_func, SEND_DEADLINE_SECONDS, FAVORED_TOKENS, PRIORITY_MIN_MARKET_CAP
+import config
+import metrics
+from tracing import tracer, mark
+from capture import MessageCapture
+from utils import TokenBucketRateLimiter
+from handlers import (
+    set_secondary, stop_secondary, status, add_window, list_windows, remove_window,
+    metrics_command, latency, routes, handle_vote
+)
 
 # لاگر حرفه‌ای مخصوص این ماژول
 logger = logging.getLogger(__name__)
@@ -28,18 +42,40 @@ client = TelegramClient(
     connection_retries=3, retry_delay=8, flood_sleep_threshold=120
 )
 
-# صف پیام‌ها با حداکثر ظرفیت 100
-message_queue = asyncio.Queue(maxsize=100)
+# صف مرحله دریافت بین هندلر تلتون و پردازش پیام؛ هندلر هرگز روی آن منتظر نمی‌ماند
+INGEST_QUEUE_MAX_SIZE = 1000
+ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_MAX_SIZE)
+ingest_dropped = 0
+DESTINATION_QUEUE_MAX_SIZE = 50  # سقف پست‌های در انتظار هر مقصد؛ صف پر کم‌ارزش‌ترین پست همان مقصد را کنار می‌گذارد
+
+# ضبط اختیاری پیام‌های خام منبع برای بازپخش (benchmarks/replay.py)؛ با CAPTURE_DIR در config فعال می‌شود
+CAPTURE_DIR = getattr(config, "CAPTURE_DIR", None)
+message_capture = MessageCapture(CAPTURE_DIR) if CAPTURE_DIR else None
+
+# صف خروجی ماندگار؛ پیام‌های ارسال‌نشده پس از ری‌استارت از دست نمی‌روند
+outbox = Outbox(replay_grace=getattr(config, "OUTBOX_REPLAY_GRACE_SECONDS", OUTBOX_REPLAY_GRACE_SECONDS))
 
-# حافظه موقت برای جلوگیری از پیام‌های تکراری
-recent_messages = {}  # کلید: هش پیام، مقدار: زمان ثبت (monotonic time)
-RECENT_MESSAGE_TIMEOUT = 60  # پیام‌ها تا 60 ثانیه در حافظه نگه داشته می‌شوند
+# دفتر پیام‌های ارسال‌شده؛ محدود در حافظه و ماندگار در SQLite برای جلوگیری از ارسال دوباره پس از ری‌استارت
+sent_ledger = SentLedger()
 
 if not isinstance(MAX_MESSAGES_PER_MINUTE, int) or MAX_MESSAGES_PER_MINUTE <= 0:
     logger.error("MAX_MESSAGES_PER_MINUTE must be a positive integer")
     raise ValueError("Invalid MAX_MESSAGES_PER_MINUTE")
-receive_rate_limiter = MessageRateLimiter(MAX_MESSAGES_PER_MINUTE)
-send_rate_limiter = SendRateLimiter(MAX_MESSAGES_PER_MINUTE)
+send_rate_limiter = TokenBucketRateLimiter(MAX_MESSAGES_PER_MINUTE)
+# edit‌های کیبورد رای از همان بودجه ارسال هر چت مصرف می‌کنند
+vote_markup_coalescer.rate_limiter = send_rate_limiter
+
+# مسیرها؛ جدول routes در هر راه‌اندازی با این مشخصات همگام (بازنویسی) می‌شود.
+# ROUTES اختیاری در config: [{"source": id, "destinations": [id, ...], "rate_per_minute": n, "parser": "pancake", "secondary": bool,
+#   "dedup_ttl_seconds": 60, "dedup_key": "token" | "text", "dedup_bucket_seconds": n | None}]
+# rate_per_minute فقط دریافت از منبع را محدود می‌کند؛ ارسال به هر مقصد با send_rate_limiter (MAX_MESSAGES_PER_MINUTE) است.
+ROUTE_SPECS = getattr(config, "ROUTES", None) or [{
+    "source": SOURCE_CHANNEL_ID,
+    "destinations": [TARGET_CHANNEL_ID],
+    "rate_per_minute": MAX_MESSAGES_PER_MINUTE,
+    "parser": DEFAULT_PARSER,
+    "secondary": True,
+}]
 
 
 async def shutdown():
@@ -48,6 +84,13 @@ async def shutdown():
     try:
         if client.is_connected():
             await client.disconnect()
+        await vote_markup_coalescer.close()
+        await vote_journal.close()
+        await outbox.close()
+        await tracer.close()
+        if message_capture is not None:
+            await message_capture.close()
+        await close_db()
         logger.info("Bot stopped gracefully")
     except Exception as e:
         logger.error(f"Error during shutdown: {e}\n{traceback.format_exc()}")
@@ -103,19 +146,22 @@ async def authenticate():
 
 
 async def check_channel_access():
-    """دسترسی به کانال‌های منبع، مقصد و ثانویه را بررسی می‌کند."""
+    """دسترسی به کانال‌های منبع و مقصد همه مسیرها و کانال ثانویه را بررسی می‌کند."""
     try:
-        source = await client.get_entity(SOURCE_CHANNEL_ID)
-        logger.info(f"Source channel access verified: {SOURCE_CHANNEL_ID}")
-        target = await client.get_entity(TARGET_CHANNEL_ID)
-        logger.info(f"Target channel access verified: {TARGET_CHANNEL_ID}")
-        try:
-            secondary = await client.get_entity(SECONDARY_CHANNEL_ID)
-            logger.info(f"Secondary channel access verified: {SECONDARY_CHANNEL_ID}")
-        except (ChannelInvalidError, ChannelPrivateError) as e:
-            logger.warning(f"Cannot access secondary channel {SECONDARY_CHANNEL_ID}: {e}. Continuing without secondary channel.")
-        except Exception as e:
-            logger.warning(f"Unexpected error accessing secondary channel {SECONDARY_CHANNEL_ID}: {e}\n{traceback.format_exc()}. Continuing without secondary channel.")
+        for source_chat_id in routing_table.source_chat_ids():
+            await client.get_entity(source_chat_id)
+            logger.info(f"Source channel access verified: {source_chat_id}")
+        for target_chat_id in routing_table.destination_chat_ids():
+            await client.get_entity(target_chat_id)
+            logger.info(f"Target channel access verified: {target_chat_id}")
+        for secondary_chat_id in {SECONDARY_CHANNEL_ID} | window_schedule.channel_ids():
+            try:
+                await client.get_entity(secondary_chat_id)
+                logger.info(f"Secondary channel access verified: {secondary_chat_id}")
+            except (ChannelInvalidError, ChannelPrivateError) as e:
+                logger.warning(f"Cannot access secondary channel {secondary_chat_id}: {e}. Continuing without this secondary channel.")
+            except Exception as e:
+                logger.warning(f"Unexpected error accessing secondary channel {secondary_chat_id}: {e}\n{traceback.format_exc()}. Continuing without this secondary channel.")
     except ChannelInvalidError as e:
         logger.error(f"Invalid channel ID: {e}. Check channel IDs")
         raise SystemExit
@@ -127,61 +173,147 @@ async def check_channel_access():
         raise SystemExit
 
 
-@client.on(events.NewMessage(chats=SOURCE_CHANNEL_ID))
 async def new_message_handler(event):
-    """هندلر پیام‌های جدید از کانال منبع تلتون."""
+    """
+    هندلر پیام‌های جدید از کانال‌های منبع تلتون (در run_bot برای منابع جدول مسیریابی ثبت می‌شود).
+    فقط مسیر و زمان دریافت را تعیین و پیام را به مرحله دریافت تحویل می‌دهد تا dispatch تلتون هیچ‌وقت معطل نشود.
+    """
     if not isinstance(event, events.NewMessage.Event):
         logger.debug("Skipped non-message update")
         return
+    route = routing_table.lookup(event.chat_id)
+    if route is None:
+        logger.warning(f"Skipped message from unrouted chat {event.chat_id} (routed sources: {routing_table.source_chat_ids()})")
+        return
+
+    global ingest_dropped
+    metrics.messages_received.inc(route=route.id)
+    received_at = time.time()
+    if message_capture is not None:
+        message_capture.record(event.message, received_at)
+    try:
+        ingest_queue.put_nowait((route, received_at, event.message))
+    except asyncio.QueueFull:
+        ingest_dropped += 1
+        logger.error(f"Ingest queue full ({INGEST_QUEUE_MAX_SIZE}), dropping message (total dropped: {ingest_dropped})")
+
+
+async def resolve_source_chat(source):
+    """
+    منبع مسیر (id یا @username) را به peer id علامت‌دار تلتون تبدیل می‌کند، همان مقداری که event.chat_id دارد.
+    id بدون علامت کانال یا username ناشناخته ValueError می‌دهد.
+    """
+    try:
+        return await client.get_peer_id(await client.get_input_entity(source))
+    except RPCError as e:
+        raise ValueError(str(e)) from e
+
 
-    message = event.message
+async def process_incoming_message(route, message, received_at):
+    """فیلتر، حذف تکراری، محدودیت نرخ دریافت و تبدیل یک پیام منبع طبق مسیر آن."""
     message_text = message.message or ""
     message_media = message.media
     message_entities = message.entities or []
 
-    # تغییر شناساگر به 🥞
-    if not message_text.strip().startswith("🥞") or len(message_text.strip()) <= 1:
-        logger.info("Skipped message: empty or not matching 🥞 trigger")
+    trigger = route.parser.trigger
+    if not message_text.strip().startswith(trigger) or len(message_text.strip()) <= len(trigger):
+        logger.info(f"Skipped message: empty or not matching {trigger} trigger (route {route.id})")
         return
 
-    message_hash = hash(message_text)
-    current_time = time.monotonic()
-    if message_hash in recent_messages:
-        logger.info(f"Skipped duplicate message: {message_text[:30]}...")
+    if route.recent.check_and_add(message_text):
+        metrics.messages_deduped.inc(route=route.id)
+        logger.info(f"Skipped duplicate message: {message_text[:30]}... (dedup stats: {route.recent.stats()})")
         return
 
-    recent_messages[message_hash] = current_time
-    expired_messages = [
-        msg_hash for msg_hash, ts in recent_messages.items()
-        if current_time - ts > RECENT_MESSAGE_TIMEOUT
-    ]
-    for msg_hash in expired_messages:
-        recent_messages.pop(msg_hash, None)
-    logger.debug(f"Cleaned up {len(expired_messages)} expired messages from recent_messages")
-
-    logger.info(f"Received new message: {message_text[:30]}...")
+    logger.info(f"Received new message: {message_text[:30]}... (ingest lag {time.time() - received_at:.3f}s)")
     logger.debug(f"Full message received from source: {message_text}")
     
-    if receive_rate_limiter.can_send():
-        if message_queue.qsize() > 0:
-            delay = QUEUE_DELAY_SECONDS + random.uniform(0, 2)
-            logger.debug(f"Queue is not empty, applying delay: {delay:.2f}s")
-            await asyncio.sleep(delay)
-        
-        # دریافت token_address از تابع تبدیل
-        new_message, new_entities, chart_url, th_pairs, token_address = transform_message(message_text, message_entities)
-        
-        if new_message:
-            # افزودن token_address به صف پیام
-            await message_queue.put((new_message, new_entities, chart_url, th_pairs, token_address))
-            receive_rate_limiter.increment()
-            logger.info(f"Queued message: {new_message[:30]}...")
-        else:
-            # لاگ بسیار مهم: در صورتی که parser نتواند پیام را تجزیه کند
-            logger.warning(f"Parsing FAILED for message. See parser logs for details. Skipping message: {message_text[:50]}...")
+    source_time = message.date.timestamp() if message.date else None
+    trace = tracer.begin(source_time, received_at)
+    if route.receive_limiter.can_send():
+        await parse_and_enqueue(route, message_text, message_entities, trace, received_at)
     else:
-        await receive_rate_limiter.add_skipped((message_text, message_media, message_entities))
-        logger.warning(f"Rate limit reached, message skipped: {message_text[:30]}...")
+        metrics.messages_rate_limited.inc(route=route.id)
+        # زمان دریافت و trace همراه پیام می‌مانند تا مهلت ارسال و تأخیر از دریافت اصلی حساب شود
+        await route.receive_limiter.add_skipped((message_text, message_media, message_entities, trace, received_at))
+        logger.warning(f"Rate limit reached for route {route.id}, message skipped: {message_text[:30]}...")
+
+
+async def ingest_worker():
+    """وظیفه پس‌زمینه مرحله دریافت: پیام‌های تحویل‌شده از هندلر تلتون را به ترتیب پردازش می‌کند."""
+    logger.info("Ingest worker started.")
+    while True:
+        route, received_at, message = await ingest_queue.get()
+        try:
+            await process_incoming_message(route, message, received_at)
+        except asyncio.CancelledError:
+            logger.info("Ingest worker cancelled.")
+            raise
+        except Exception as e:
+            logger.error(f"Error in ingest worker: {e}\n{traceback.format_exc()}")
+        finally:
+            ingest_queue.task_done()
+
+
+async def parse_and_enqueue(route, message_text, message_entities, trace=None, received_at=None):
+    """
+    پیام منبع را با پارسر مسیر تبدیل و در صف خروجی قرار می‌دهد؛ در صورت موفقیت True برمی‌گرداند.
+    received_at زمان دریافت اصلی است و مهلت ارسال از آن حساب می‌شود (پیش‌فرض: اکنون).
+    """
+    if trace is None:
+        trace = tracer.begin()
+    # دریافت token_address و مارکت‌کپ از تابع تبدیل (بدون تجزیه دوباره متن)
+    new_message, new_entities, chart_url, th_pairs, token_address, market_cap = route.parser.transform(
+        message_text, message_entities
+    )
+    mark(trace, "parsed")
+    
+    if new_message:
+        metrics.messages_parsed.inc(route=route.id)
+        # افزودن token_address به صف خروجی؛ put تا ذخیره دسته روی دیسک منتظر می‌ماند
+        mark(trace, "queued")
+        await outbox.put({
+            "route": route.id,
+            "message": new_message,
+            "entities": serialize_entities(new_entities),
+            "chart_url": chart_url,
+            "th_pairs": th_pairs,
+            "token_address": token_address,
+            "market_cap": market_cap,
+            "received_at": received_at if received_at is not None else time.time(),
+            "trace": trace,
+        })
+        metrics.messages_queued.inc(route=route.id)
+        route.receive_limiter.increment()
+        logger.info(f"Queued message for route {route.id}: {new_message[:30]}...")
+        return True
+
+    metrics.messages_parse_failed.inc(route=route.id)
+    # لاگ بسیار مهم: در صورتی که parser نتواند پیام را تجزیه کند
+    logger.warning(f"Parsing FAILED for message. See parser logs for details. Skipping message: {message_text[:50]}...")
+    return False
+
+
+async def skipped_message_drainer(route):
+    """
+    وظیفه پس‌زمینه (یکی برای هر مسیر) که پیام‌های رد شده به خاطر محدودیت نرخ را، وقتی ظرفیت آزاد شد
+    و هنوز تازه هستند، به ترتیب زمان تبدیل و در صف قرار می‌دهد.
+    """
+    logger.info(f"Skipped message drainer started for route {route.id}.")
+    while True:
+        try:
+            message_text, message_media, message_entities, trace, received_at = await route.receive_limiter.next_skipped()
+            logger.info(
+                f"Draining skipped message: {message_text[:30]}... (waited {time.time() - received_at:.1f}s, "
+                f"backlog stats: {route.receive_limiter.skipped_stats()})"
+            )
+            await parse_and_enqueue(route, message_text, message_entities, trace, received_at)
+        except asyncio.CancelledError:
+            logger.info(f"Skipped message drainer cancelled for route {route.id}.")
+            raise
+        except Exception as e:
+            logger.error(f"Error in skipped message drainer: {e}\n{traceback.format_exc()}")
+            await asyncio.sleep(1)
 
 
 async def send_message_to_channel(bot, message, entities, chart_url, th_pairs, chat_id, token_address, channel_name="Unknown"):
@@ -189,15 +321,7 @@ async def send_message_to_channel(bot, message, entities, chart_url, th_pairs, c
     try:
         text, parse_mode = entities_to_html(entities, message)
         
-        keyboard = [
-            [InlineKeyboardButton("📈 مشاهده نمودار (Dex)", url=f"https://dexscreener.com/bsc/{token_address}")],
-            [InlineKeyboardButton("🔍 بررسی در اکسیوم (Axiom)", url=f"https://axiom.app/contract/{token_address}")],
-            [InlineKeyboardButton("💰 ترید کن سولانا هدیه بگیر", url=GIFT)],
-            [InlineKeyboardButton("📚 آموزش آکسیوم", url=AXIOM_LINK), InlineKeyboardButton("❓ سوالتون اینجا بپرسید", url=SUPPORT_LINK)],
-            [InlineKeyboardButton("🟢 (0)", callback_data="vote_green"),
-             InlineKeyboardButton("🔴 (0)", callback_data="vote_red")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = build_post_keyboard(token_address)
 
         sent_message = await bot.send_message(
             chat_id=chat_id,
@@ -209,7 +333,8 @@ async def send_message_to_channel(bot, message, entities, chart_url, th_pairs, c
         logger.info(f"✅ Message sent successfully to {channel_name} channel ({chat_id}). Message ID: {sent_message.message_id}, Text: {text[:30]}...")
 
         # ثبت رای فقط پس از ارسال موفق
-        await register_message_in_votes(sent_message.message_id, chat_id, token_address)
+        await vote_journal.register(sent_message.message_id, chat_id, token_address)
+        vote_markup_coalescer.mark_rendered(chat_id, sent_message.message_id, 0, 0)
         logger.debug(f"Vote DB registration complete for MsgID {sent_message.message_id} in {channel_name} channel.")
 
         return sent_message.message_id
@@ -221,6 +346,11 @@ async def send_message_to_channel(bot, message, entities, chart_url, th_pairs, c
         logger.critical(f"❌ FATAL ERROR (Permissions) sending to {channel_name} channel ({chat_id}): Bot is blocked or lacks permissions. {e}")
         raise  # این خطا را دوباره ارسال کن تا حلقه retry متوقف شود
 
+    # flood control سرور؛ توقف و ارسال دوباره را DestinationSender مدیریت می‌کند
+    except RetryAfter as e:
+        logger.warning(f"⏳ FLOOD CONTROL for {channel_name} channel ({chat_id}): {e}")
+        raise
+
     # خطاهایی که نباید دوباره تلاش شوند (مشکل محتوا)
     except BadRequest as e:
         if "entity" in str(e).lower() or "parsing" in str(e).lower():
@@ -247,117 +377,175 @@ async def send_message_to_channel(bot, message, entities, chart_url, th_pairs, c
         raise # ارسال مجدد برای حلقه retry
 
 
-async def message_sender():
-    """وظیفه پس‌زمینه که پیام‌ها را از صف برداشته، با مدیریت خطای قوی ارسال می‌کند."""
-    bot = Bot(token=BOT_TOKEN)
-    sent_messages = set()
-    while True:
-        try:
-            message, entities, chart_url, th_pairs, token_address = await message_queue.get()
-            message_hash = hash(message)
-            logger.info(f"Processing message from queue: {message[:30]}...")
-
-            if message_hash in sent_messages:
-                logger.debug(f"Message already sent, skipping: {message[:30]}...")
-                message_queue.task_done()
-                continue
-
-            if not send_rate_limiter.can_send():
-                logger.warning(f"Send rate limit reached, re-queuing message: {message[:30]}...")
-                # پیام را به انتهای صف برگردان
-                await message_queue.put((message, entities, chart_url, th_pairs, token_address))
-                await asyncio.sleep(30) # 30 ثانیه صبر کن تا از لود زیاد جلوگیری شود
-                message_queue.task_done()
-                continue # این تکرار را رها کن
-
-            # --- ارسال به کانال اصلی ---
-            main_success = False
-            attempts = 0
-            while attempts < RETRY_ATTEMPTS:
-                try:
-                    delay = SEND_DELAY_SECONDS + random.uniform(0, SEND_DELAY_JITTER) + (message_queue.qsize() * 0.5)
-                    logger.debug(f"Applying send delay: {delay:.2f}s")
-                    await asyncio.sleep(delay)
-                    
-                    message_id = await send_message_to_channel(
-                        bot, message, entities, chart_url, th_pairs, 
-                        TARGET_CHANNEL_ID, token_address, channel_name="Main"
-                    )
-                    send_rate_limiter.increment()
-                    logger.info(f"Message sent to Main channel, hash: {message_hash}, MsgID: {message_id}")
-                    main_success = True
-                    break  # موفقیت، خروج از حلقه retry
-                
-                # خطاهای غیرقابل تلاش مجدد
-                except (ChatWriteForbiddenError, UserIsBlockedError, ChannelInvalidError, ChannelPrivateError, BadRequest, MessageTooLongError) as e:
-                    logger.error(f"NON-RETRYABLE error sending to Main channel. Skipping message. Error: {e}")
-                    break  # خروج از حلقه retry، این پیام قابل ارسال نیست
-                
-                # خطاهای قابل تلاش مجدد
-                except (TimedOut, TelegramError, NetworkError, Exception) as e:
-                    attempts += 1
-                    wait_time = RETRY_DELAY_BASE * attempts + random.uniform(0, 5)
-                    logger.warning(f"Retrying Main channel send attempt {attempts}/{RETRY_ATTEMPTS} after {wait_time:.2f}s due to: {e}")
-                    await asyncio.sleep(wait_time)
-            
-            if not main_success:
-                logger.error(f"Failed to send message to Main channel after {RETRY_ATTEMPTS} attempts. Message discarded: {message[:50]}...")
-                message_queue.task_done()
-                continue  # رفتن به پیام بعدی در صف
-
-            # --- ارسال به کانال دوم (فقط اگر ارسال اصلی موفق بود) ---
-            settings = await load_settings()
-            current_time = int(time.time())
-            if (settings['start_time'] <= current_time <= settings['expiry_time']):
-                logger.info(f"Secondary channel is active. Attempting to send...")
-                sec_attempts = 0
-                while sec_attempts < RETRY_ATTEMPTS: # حلقه retry جداگانه برای کانال دوم
-                    try:
-                        if not send_rate_limiter.can_send():
-                            logger.warning("Send rate limit reached before secondary send. Waiting 30s...")
-                            await asyncio.sleep(30)
-                            continue # بررسی مجدد محدودیت نرخ
-
-                        secondary_message_id = await send_message_to_channel(
-                            bot, message, entities, chart_url, th_pairs, 
-                            settings['secondary_channel_id'], token_address, channel_name="Secondary"
-                        )
-                        send_rate_limiter.increment()
-                        logger.info(f"Message sent to Secondary channel, hash: {message_hash}, MsgID: {secondary_message_id}")
-                        break # موفقیت
-                    
-                    except (ChatWriteForbiddenError, UserIsBlockedError, ChannelInvalidError, ChannelPrivateError, BadRequest, MessageTooLongError) as e:
-                        logger.error(f"NON-RETRYABLE error sending to Secondary channel ({settings['secondary_channel_id']}). Stopping secondary send. Error: {e}")
-                        break # تلاش برای کانال دوم متوقف می‌شود
-
-                    except (TimedOut, TelegramError, NetworkError, Exception) as e:
-                        sec_attempts += 1
-                        wait_time = RETRY_DELAY_BASE * sec_attempts
-                        logger.warning(f"Retrying Secondary channel send attempt {sec_attempts}/{RETRY_ATTEMPTS} after {wait_time:.2f}s due to: {e}")
-                        await asyncio.sleep(wait_time)
-                
-                if sec_attempts >= RETRY_ATTEMPTS:
-                    logger.error(f"Failed to send to Secondary channel after {RETRY_ATTEMPTS} attempts. Main message was successful.")
-
-            sent_messages.add(message_hash) # پیام فقط پس از موفقیت اصلی، به عنوان ارسال شده علامت‌گذاری می‌شود
-            message_queue.task_done()
-            
-        except asyncio.CancelledError:
-            logger.info("Message sender task cancelled.")
-            raise
-        except Exception as e:
-            logger.critical(f"CRITICAL ERROR in message_sender loop: {e}\n{traceback.format_exc()}")
-            message_queue.task_done() # اطمینان از اینکه صف قفل نمی‌شود
-            await asyncio.sleep(10) # جلوگیری از لوپ خطای سریع
+# ترتیب ارسال: اولویت (توکن‌های منتخب، مارکت‌کپ بالا) و سپس تازگی؛ مقادیر در config اختیاری هستند
+send_priority = make_priority_func(
+    getattr(config, "FAVORED_TOKENS", FAVORED_TOKENS),
+    getattr(config, "PRIORITY_MIN_MARKET_CAP", PRIORITY_MIN_MARKET_CAP)
+)
+send_deadline_seconds = getattr(config, "SEND_DEADLINE_SECONDS", SEND_DEADLINE_SECONDS)
+# سقف صف هر مقصد؛ مقصد کند یا گیرکرده فقط پست‌های خودش را از دست می‌دهد و خواندن outbox متوقف نمی‌شود
+destination_queue_max_size = getattr(config, "DESTINATION_QUEUE_MAX_SIZE", DESTINATION_QUEUE_MAX_SIZE)
+
+# یک کارگر ارسال برای هر چت مقصد؛ محدودیت نرخ هر چت در سطل جداگانه خودش اعمال می‌شود
+DESTINATION_NAMES = {TARGET_CHANNEL_ID: "Main", SECONDARY_CHANNEL_ID: "Secondary"}
+destination_senders = {}  # chat_id -> DestinationSender
+
+
+def destination_sender(chat_id):
+    """کارگر ارسال یک چت مقصد را برمی‌گرداند و در اولین استفاده آن را می‌سازد."""
+    sender = destination_senders.get(chat_id)
+    if sender is None:
+        name = DESTINATION_NAMES.get(chat_id, str(chat_id))
+        sender = DestinationSender(
+            name, send_message_to_channel, send_rate_limiter, RETRY_ATTEMPTS, RETRY_DELAY_BASE,
+            SEND_DELAY_SECONDS, SEND_DELAY_JITTER,
+            scheduler=SendScheduler(name, send_deadline_seconds, send_priority, max_size=destination_queue_max_size)
+        )
+        destination_senders[chat_id] = sender
+        metrics.queue_depth.set_function(sender.queue.qsize, queue=name)
+    return sender
+
+
+main_sender = destination_sender(TARGET_CHANNEL_ID)
+secondary_sender = destination_sender(SECONDARY_CHANNEL_ID)
+
+metrics.queue_depth.set_function(ingest_queue.qsize, queue="ingest")
+metrics.queue_depth.set_function(
+    lambda: sum(len(route.receive_limiter.skipped_messages) for route in routing_table.routes()), queue="skipped"
+)
+metrics.queue_depth.set_function(outbox.qsize, queue="outbox")
+
+
+async def message_sender(bot=None):
+    """
+    وظیفه پس‌زمینه که پیام‌ها را از صف برداشته و بین کارگرهای ارسال مقصدهای مسیرشان پخش می‌کند.
+    ارسال به همه مقصدها به صورت موازی و با retry مستقل انجام می‌شود.
+    bot قابل تزریق است (مثلاً Bot جعلی در benchmarks/loadtest.py).
+    """
+    if bot is None:
+        bot = Bot(token=BOT_TOKEN)
+    worker_tasks = {}  # chat_id -> وظیفه کارگر ارسال
+    in_flight = set()  # پیام‌هایی که ارسال به مقصد اصلی‌شان هنوز تمام نشده
+
+    def sender_for(chat_id):
+        """کارگر مقصد؛ وظیفه آن در اولین ارسال به این چت شروع می‌شود."""
+        sender = destination_sender(chat_id)
+        if chat_id not in worker_tasks:
+            worker_tasks[chat_id] = asyncio.create_task(sender.run(bot))
+        return sender
+
+    async def on_primary_complete(job, ledger_key, success):
+        in_flight.discard(ledger_key)
+        if success:
+            await sent_ledger.add(ledger_key) # پیام فقط پس از موفقیت مقصد اصلی، به عنوان ارسال شده علامت‌گذاری می‌شود
+
+    def ack_when_done(entry_id, job_count):
+        """پیام outbox پس از پایان (موفق یا نهایی ناموفق) همه ارسال‌هایش ack می‌شود."""
+        remaining = [job_count]
+
+        async def on_complete(job, success):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                outbox.ack(entry_id)
+        return on_complete
+
+    def on_retry(entry_id):
+        return lambda job: outbox.retry(entry_id)
+
+    try:
+        while True:
+            entry_id = None
+            try:
+                entry_id, item = await outbox.get()
+                message = item["message"]
+                # پیام‌های ذخیره‌شده پیش از جدول مسیریابی به قدیمی‌ترین مسیر تعلق دارند
+                route = routing_table.get(item["route"]) if "route" in item else routing_table.default_route
+                if route is None:
+                    logger.error(f"Route {item.get('route')} no longer exists, dropping outbox entry {entry_id}: {message[:30]}...")
+                    outbox.ack(entry_id)
+                    continue
+                # کلید دفتر برای هر مسیر جداست تا یک پیام مشترک بین دو منبع به هر دو مخاطب برسد
+                ledger_key = f"{route.id}:{text_content_key(message)}"
+                logger.info(f"Processing message from outbox (id {entry_id}, route {route.id}): {message[:30]}...")
+
+                if ledger_key in in_flight or await sent_ledger.contains(ledger_key):
+                    logger.debug(f"Message already sent, skipping: {message[:30]}...")
+                    outbox.ack(entry_id)
+                    continue
+
+                entities = deserialize_entities(item["entities"])
+                chart_url, th_pairs, token_address = item["chart_url"], item["th_pairs"], item["token_address"]
+                created_at, market_cap = item.get("received_at"), item.get("market_cap")
+                if outbox.is_replayed(entry_id):
+                    # پیام اجرای قبلی: مهلت از زمان دریافت اصلی حساب می‌شود و فقط replay_grace اضافه می‌گیرد
+                    logger.info(f"Replayed outbox entry {entry_id} received {time.time() - created_at:.0f}s ago"
+                                if created_at else f"Replayed outbox entry {entry_id} without receive time")
+                    created_at = outbox.deadline_created_at(entry_id, created_at)
+                trace = item.get("trace")
+                mark(trace, "dequeued")
+                destinations = list(route.destinations)
+                if route.use_secondary:
+                    # کانال‌های دوم از ایندکس پنجره‌ها در حافظه (بدون دسترسی به DB)
+                    for secondary_chat_id in window_schedule.active_channels():
+                        if secondary_chat_id not in destinations:
+                            logger.info(f"Secondary channel {secondary_chat_id} is active. Dispatching to its sender...")
+                            destinations.append(secondary_chat_id)
+
+                ack = ack_when_done(entry_id, len(destinations))
+
+                async def on_primary_done(job, success, ack=ack, ledger_key=ledger_key):
+                    await on_primary_complete(job, ledger_key, success)
+                    await ack(job, success)
+
+                in_flight.add(ledger_key)
+                # هر مقصد کارگر و صف خودش را دارد، پس ارسال‌ها همزمان انجام می‌شوند
+                for index, chat_id in enumerate(destinations):
+                    sender_for(chat_id).submit(DeliveryJob(
+                        message, entities, chart_url, th_pairs, token_address,
+                        chat_id, on_complete=on_primary_done if index == 0 else ack, on_retry=on_retry(entry_id),
+                        created_at=created_at, market_cap=market_cap, trace=dict(trace) if trace else None
+                    ))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.critical(f"CRITICAL ERROR in message_sender loop: {e}\n{traceback.format_exc()}")
+                if entry_id is not None:
+                    # payload خراب با هر بار پخش دوباره همین خطا را می‌دهد؛ کنار گذاشته می‌شود
+                    outbox.dead_letter(entry_id)
+                await asyncio.sleep(10) # جلوگیری از لوپ خطای سریع
+    except asyncio.CancelledError:
+        logger.info("Message sender task cancelled.")
+        raise
+    finally:
+        for task in worker_tasks.values():
+            task.cancel()
+        await asyncio.gather(*worker_tasks.values(), return_exceptions=True)
 
 
 async def run_bot():
     """تابع اصلی اجرای ربات، شامل راه‌اندازی کلاینت تلتون و اپلیکیشن PTB."""
     sender_task = None
+    drainer_tasks = []
+    ingest_task = None
+    metrics_server = None
     try:
         await init_db(SECONDARY_CHANNEL_ID)
+        await window_schedule.load()
+        await outbox.start()  # پیام‌های ارسال‌نشده اجرای قبلی دوباره در صف قرار می‌گیرند
+        metrics_port = getattr(config, "METRICS_PORT", metrics.METRICS_PORT)
+        if metrics_port:
+            metrics_server = await metrics.start_metrics_server(metrics_port)
         
         await authenticate()
+        try:
+            await routing_table.load(ROUTE_SPECS, resolve=resolve_source_chat)
+        except ValueError as e:
+            logger.critical(f"{e}. Use a marked chat id (e.g. -100...) or a @username the account can see.")
+            raise SystemExit
+        if not routing_table.routes():
+            logger.critical("No valid routes configured. Check ROUTES in config.")
+            raise SystemExit
         await asyncio.sleep(random.uniform(1, 3))
         logger.info("Step 2: Checking channel access")
         await check_channel_access()
@@ -368,12 +556,24 @@ async def run_bot():
         application.add_handler(CommandHandler("set_secondary", set_secondary))
         application.add_handler(CommandHandler("stop_secondary", stop_secondary))
         application.add_handler(CommandHandler("status", status))
+        application.add_handler(CommandHandler("add_window", add_window))
+        application.add_handler(CommandHandler("list_windows", list_windows))
+        application.add_handler(CommandHandler("remove_window", remove_window))
+        application.add_handler(CommandHandler("metrics", metrics_command))
+        application.add_handler(CommandHandler("latency", latency))
+        application.add_handler(CommandHandler("routes", routes))
         application.add_handler(CallbackQueryHandler(handle_vote, pattern="^vote_"))
         
         logger.info("Step 4: Setting up event handler")
-        client.add_event_handler(new_message_handler)
+        ingest_task = asyncio.create_task(ingest_worker())
+        client.add_event_handler(new_message_handler, events.NewMessage(chats=routing_table.source_chat_ids()))
         logger.info("Step 5: Starting message sender task")
         sender_task = asyncio.create_task(message_sender())
+        drainer_tasks = [asyncio.create_task(skipped_message_drainer(route)) for route in routing_table.routes()]
+        vote_journal.start()
+        tracer.start()
+        if message_capture is not None:
+            message_capture.start()
         
         logger.info("Step 6: Starting application and client")
         loop = asyncio.get_event_loop()
@@ -402,5 +602,12 @@ async def run_bot():
         if sender_task and not sender_task.done():
             logger.info("Cancelling message sender task...")
             sender_task.cancel()
+        for drainer_task in drainer_tasks:
+            if not drainer_task.done():
+                drainer_task.cancel()
+        if ingest_task and not ingest_task.done():
+            ingest_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
         
         await shutdown()
\ No newline at end of file
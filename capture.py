@@ -0,0 +1,138 @@
+# capture.py
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+import traceback
+from parser import serialize_entities
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+CAPTURE_FILE_NAME = "capture.jsonl.gz"  # فایل فعال؛ فایل‌های چرخیده capture-<زمان>.jsonl.gz
+CAPTURE_MAX_BYTES = 20 * 1024 * 1024  # با رسیدن فایل فعال به این اندازه، فایل جدید شروع می‌شود
+CAPTURE_MAX_FILES = 20  # تعداد فایل‌های چرخیده‌ای که نگه داشته می‌شوند
+CAPTURE_FLUSH_INTERVAL_SECONDS = 1.0
+
+
+def capture_record(message, received_at):
+    """رکورد قابل JSON یک پیام خام منبع (متن، entityهای سریال‌شده و زمان‌ها)."""
+    return {
+        "t": received_at,
+        "date": message.date.timestamp() if message.date else None,
+        "chat_id": getattr(message, "chat_id", None),
+        "id": message.id,
+        "text": message.message or "",
+        "entities": serialize_entities(message.entities),
+    }
+
+
+def capture_files(path):
+    """فایل‌های capture یک پوشه را به ترتیب زمان (قدیمی‌ترین اول) برمی‌گرداند؛ path می‌تواند یک فایل باشد."""
+    if os.path.isfile(path):
+        return [path]
+    rotated = sorted(glob.glob(os.path.join(path, "capture-*.jsonl.gz")))
+    active = os.path.join(path, CAPTURE_FILE_NAME)
+    return rotated + ([active] if os.path.exists(active) else [])
+
+
+def read_capture(paths):
+    """رکوردهای capture را به ترتیب می‌خواند؛ انتهای ناقص فایل (مثلاً پس از کرش) نادیده گرفته می‌شود."""
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"Capture file {path} ends with a truncated block: {e}")
+
+
+class MessageCapture:
+    """
+    ضبط append-only پیام‌های خام منبع برای بازپخش آفلاین.
+    record() فقط رکورد را در حافظه اضافه می‌کند؛ یک وظیفه پس‌زمینه هر دسته را به صورت یک عضو gzip
+    مستقل به انتهای فایل اضافه می‌کند (فایل‌های چندعضوی gzip معتبرند و کرش فقط دسته آخر را از دست می‌دهد).
+    با رسیدن به max_bytes فایل فعال چرخانده و قدیمی‌ترین فایل‌های اضافه حذف می‌شوند.
+    """
+
+    def __init__(self, directory, max_bytes=CAPTURE_MAX_BYTES, max_files=CAPTURE_MAX_FILES,
+                 flush_interval=CAPTURE_FLUSH_INTERVAL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.path = os.path.join(directory, CAPTURE_FILE_NAME)
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.records = 0
+        self.rotations = 0
+
+    def record(self, message, received_at):
+        try:
+            self._pending.append(capture_record(message, received_at))
+        except Exception as e:
+            logger.error(f"Could not capture message: {e}")
+
+    def _rotate(self):
+        now = time.time()
+        # نام‌ها با ترتیب الفبایی به ترتیب زمان مرتب می‌شوند؛ شماره چرخش از هم‌نامی دو چرخش در یک میلی‌ثانیه جلوگیری می‌کند
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        self.rotations += 1
+        rotated = os.path.join(self.directory, f"capture-{stamp}-{self.rotations:06d}.jsonl.gz")
+        os.replace(self.path, rotated)
+        old_files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl.gz")))
+        for old_file in old_files[:max(0, len(old_files) - self.max_files)]:
+            os.remove(old_file)
+        logger.info(f"Capture file rotated to {rotated}")
+
+    def _write(self, records):
+        data = "".join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n" for record in records)
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(data.encode("utf-8")))
+            size = f.tell()
+        if size >= self.max_bytes:
+            self._rotate()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            records, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, records)
+                self.records += len(records)
+            except OSError as e:
+                logger.error(f"Error writing capture file {self.path}: {e}. {len(records)} records lost.")
+
+    async def run(self):
+        logger.info(f"Message capture enabled, writing to {self.path}")
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in capture flush loop: {e}\n{traceback.format_exc()}")
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        logger.info(f"Message capture closed ({self.records} records written).")
@@ -1,16 +1,183 @@
 # database.py
+import asyncio
+import time
 import aiosqlite
 import logging  # ایمپورت کردن لاگ
+from contextlib import asynccontextmanager
+from metrics import timed_db_call
 
 # لاگر حرفه‌ای مخصوص این ماژول
 logger = logging.getLogger(__name__)
 
 DB_NAME = 'bot_settings.db'
+STATEMENT_CACHE_SIZE = 256  # تعداد دستورات prepared که sqlite3 روی هر اتصال نگه می‌دارد
+BUSY_TIMEOUT_MS = 5000
+
+# اتصال‌های مشترک: یک writer برای همه نوشتن‌ها و یک reader فقط‌خواندنی.
+# در حالت WAL خواندن‌ها پشت تراکنش‌های نوشتن منتظر نمی‌مانند.
+_writer = None
+_reader = None
+_connect_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+async def _open_connection(read_only=False):
+    """یک اتصال aiosqlite با تنظیمات WAL و کش دستورات باز می‌کند."""
+    db = await aiosqlite.connect(DB_NAME, cached_statements=STATEMENT_CACHE_SIZE)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    if read_only:
+        await db.execute("PRAGMA query_only=ON")
+    return db
+
+async def _get_writer():
+    global _writer
+    if _writer is None:
+        async with _connect_lock:
+            if _writer is None:
+                _writer = await _open_connection()
+                logger.debug(f"Opened shared writer connection to {DB_NAME}")
+    return _writer
+
+async def _get_reader():
+    global _reader
+    if _reader is None:
+        async with _connect_lock:
+            if _reader is None:
+                _reader = await _open_connection(read_only=True)
+                logger.debug(f"Opened shared reader connection to {DB_NAME}")
+    return _reader
+
+@asynccontextmanager
+async def _write_transaction():
+    """
+    اتصال writer را به صورت انحصاری در اختیار می‌گذارد و در پایان commit می‌کند.
+    قفل لازم است چون چند coroutine روی یک اتصال مشترک تراکنش باز می‌کنند.
+    """
+    async with _write_lock:
+        db = await _get_writer()
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+async def close_db():
+    """اتصال‌های مشترک را می‌بندد (قابل فراخوانی چندباره)."""
+    global _writer, _reader
+    async with _connect_lock:
+        for name, db in (("writer", _writer), ("reader", _reader)):
+            if db is None:
+                continue
+            try:
+                await db.close()
+                logger.debug(f"Closed shared {name} connection")
+            except Exception as e:
+                logger.error(f"Error closing {name} connection: {e}")
+        _writer = None
+        _reader = None
+
+
+async def _create_vote_counter_triggers(db):
+    """
+    تریگرهایی می‌سازد که شمارنده‌های token_votes را همراه با هر تغییر
+    user_votes به اندازه ±۱ به‌روز می‌کنند تا نیازی به COUNT(*) نباشد.
+    """
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'user_votes_after_insert'") as cursor:
+        triggers_exist = await cursor.fetchone() is not None
+
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_votes_after_insert
+        AFTER INSERT ON user_votes
+        BEGIN
+            INSERT OR IGNORE INTO token_votes (message_id) VALUES (NEW.message_id);
+            UPDATE token_votes
+            SET green_votes = green_votes + (NEW.vote_type = 'green'),
+                red_votes = red_votes + (NEW.vote_type = 'red')
+            WHERE message_id = NEW.message_id;
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_votes_after_update
+        AFTER UPDATE OF vote_type ON user_votes
+        WHEN OLD.vote_type IS NOT NEW.vote_type
+        BEGIN
+            UPDATE token_votes
+            SET green_votes = green_votes + (NEW.vote_type = 'green') - (OLD.vote_type = 'green'),
+                red_votes = red_votes + (NEW.vote_type = 'red') - (OLD.vote_type = 'red')
+            WHERE message_id = NEW.message_id;
+        END
+    ''')
+
+    if not triggers_exist:
+        # دیتابیس‌های قدیمی: یک بار شمارنده‌ها را از روی user_votes همگام می‌کنیم
+        await db.execute('''
+            UPDATE token_votes SET
+                green_votes = (SELECT COUNT(*) FROM user_votes u WHERE u.message_id = token_votes.message_id AND u.vote_type = 'green'),
+                red_votes = (SELECT COUNT(*) FROM user_votes u WHERE u.message_id = token_votes.message_id AND u.vote_type = 'red')
+        ''')
+        logger.info("Vote counter triggers created and token_votes counters resynced")
+
+async def _create_secondary_windows(db):
+    """
+    جدول پنجره‌های زمانی کانال‌های دوم را می‌سازد.
+    recurrence یکی از once/daily/weekly است؛ برای پنجره‌های تکرارشونده فقط ساعت روز (و روز هفته) start_time مهم است.
+    """
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'secondary_windows'") as cursor:
+        windows_exist = await cursor.fetchone() is not None
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS secondary_windows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER NOT NULL,
+            start_time INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            recurrence TEXT NOT NULL DEFAULT 'once'
+        )
+    ''')
+
+    if not windows_exist:
+        # دیتابیس‌های قدیمی: پنجره تنها ردیف settings (/set_secondary) یک بار منتقل می‌شود
+        await db.execute(
+            "INSERT INTO secondary_windows (channel_id, start_time, duration, recurrence) "
+            "SELECT secondary_channel_id, start_time, expiry_time - start_time, 'once' FROM settings "
+            "WHERE id = 1 AND expiry_time > ? AND expiry_time > start_time",
+            (int(time.time()),)
+        )
+        logger.info("secondary_windows table created (legacy settings window migrated if still pending)")
+
+# ستون‌هایی که بعد از ساخت جدول routes اضافه شده‌اند؛ دیتابیس‌های قدیمی با ALTER TABLE به‌روز می‌شوند
+_ROUTE_DEDUP_COLUMNS = (
+    ("dedup_ttl_seconds", "INTEGER NOT NULL DEFAULT 60"),
+    ("dedup_key", "TEXT NOT NULL DEFAULT 'token'"),
+    ("dedup_bucket_seconds", "INTEGER"),
+)
+
+async def _create_routes(db):
+    """جدول مسیرهای منبع به مقصد را می‌سازد و ستون‌های تنظیم حذف تکراری را در صورت نبود اضافه می‌کند."""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_chat_id INTEGER NOT NULL UNIQUE,
+            parser TEXT NOT NULL,
+            destinations TEXT NOT NULL,
+            rate_per_minute INTEGER NOT NULL,
+            use_secondary INTEGER NOT NULL DEFAULT 0,
+            enabled INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    async with db.execute("PRAGMA table_info(routes)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    for name, definition in _ROUTE_DEDUP_COLUMNS:
+        if name not in columns:
+            await db.execute(f"ALTER TABLE routes ADD COLUMN {name} {definition}")
+            logger.info(f"routes table: added column {name}")
 
 async def init_db(secondary_channel_id):
     """پایگاه داده aiosqlite را راه‌اندازی می‌کند."""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with _write_transaction() as db:
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS settings (
                     id INTEGER PRIMARY KEY,
@@ -41,108 +208,390 @@ async def init_db(secondary_channel_id):
                     PRIMARY KEY (message_id, user_id)
                 )
             ''')
-            await db.commit()
+            await _create_vote_counter_triggers(db)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS sent_messages (
+                    content_key TEXT PRIMARY KEY,
+                    sent_at INTEGER NOT NULL
+                )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_sent_at ON sent_messages (sent_at)")
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at INTEGER NOT NULL,
+                    claimed_at INTEGER
+                )
+            ''')
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS traces (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    retries INTEGER NOT NULL DEFAULT 0,
+                    stages TEXT NOT NULL
+                )
+            ''')
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_traces_finished_at ON traces (finished_at)")
+            await _create_secondary_windows(db)
+            await _create_routes(db)
+        # اتصال reader هم از ابتدا باز می‌شود تا اولین رای هزینه اتصال را ندهد
+        await _get_reader()
         # لاگ‌ها به logger تغییر کردند
         logger.info("Async SQLite database initialized (including vote tables)")
     except aiosqlite.Error as e:
         logger.error(f"Async SQLite error in init_db: {e}")
 
-async def save_settings(secondary_channel_id, start_time, expiry_time):
-    """تنظیمات کانال دوم را به صورت async ذخیره می‌کند."""
-    try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute(
-                "UPDATE settings SET secondary_channel_id = ?, start_time = ?, expiry_time = ? WHERE id = 1",
-                (secondary_channel_id, start_time, expiry_time)
-            )
-            await db.commit()
-        logger.info(f"Async settings saved: start={start_time}, expiry={expiry_time}")
-    except aiosqlite.Error as e:
-        logger.error(f"Async SQLite error in save_settings: {e}")
-
-async def load_settings():
-    """تنظیمات کانال دوم را به صورت async بارگیری می‌کند."""
-    try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute('SELECT secondary_channel_id, start_time, expiry_time FROM settings WHERE id = 1') as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    logger.debug(f"Loaded settings from DB: {result}")
-                    return {'secondary_channel_id': result[0], 'start_time': result[1], 'expiry_time': result[2]}
-                else:
-                    logger.warning("Could not find settings in DB (row id=1 missing).")
-    except aiosqlite.Error as e:
-        logger.error(f"Async SQLite error in load_settings: {e}")
-    
-    # در صورت خطا یا عدم وجود ردیف، مقدار پیش‌فرض را برگردانید
-    logger.warning("Returning default settings.")
-    from config import SECONDARY_CHANNEL_ID
-    return {'secondary_channel_id': SECONDARY_CHANNEL_ID, 'start_time': 0, 'expiry_time': 0}
-
+@timed_db_call
 async def register_message_in_votes(message_id, chat_id, token_address):
     """پیام جدید را برای رای‌گیری در DB ثبت می‌کند."""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with _write_transaction() as db:
+            # اگر رایی زودتر از ثبت رسیده باشد، تریگر ردیف خالی ساخته است؛ آن را تکمیل می‌کنیم
             await db.execute(
-                "INSERT OR IGNORE INTO token_votes (message_id, chat_id, token_address) VALUES (?, ?, ?)",
+                "INSERT INTO token_votes (message_id, chat_id, token_address) VALUES (?, ?, ?) "
+                "ON CONFLICT (message_id) DO UPDATE SET chat_id = excluded.chat_id, token_address = excluded.token_address",
                 (message_id, chat_id, token_address)
             )
-            await db.commit()
         logger.debug(f"Message {message_id} registered in votes DB.")
     except aiosqlite.Error as e:
         logger.error(f"Async SQLite error in register_message_in_votes for Msg {message_id}: {e}")
 
+@timed_db_call
 async def process_vote(message_id, user_id, vote_type):
-    """رای کاربر را پردازش و شمارش جدید را برمی‌گرداند."""
-    try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            # ۱. بررسی رای قبلی
-            async with db.execute("SELECT vote_type FROM user_votes WHERE message_id = ? AND user_id = ?", (message_id, user_id)) as cursor:
-                existing_vote = await cursor.fetchone()
-
-            if existing_vote:
-                if existing_vote[0] == vote_type:
-                    logger.debug(f"User {user_id} voted {vote_type} again for Msg {message_id}. No change.")
-                    return None  # رای تکراری
-                else:
-                    # تغییر رای
-                    await db.execute("UPDATE user_votes SET vote_type = ? WHERE message_id = ? AND user_id = ?", (vote_type, message_id, user_id))
-                    logger.info(f"User {user_id} changed vote to {vote_type} for Msg {message_id}")
-            else:
-                # رای جدید
-                await db.execute("INSERT INTO user_votes (message_id, user_id, vote_type) VALUES (?, ?, ?)", (message_id, user_id, vote_type))
-                logger.info(f"User {user_id} cast new vote {vote_type} for Msg {message_id}")
-            
-            await db.commit()
-
-            # ۲. شمارش مجدد
-            async with db.execute("SELECT COUNT(*) FROM user_votes WHERE message_id = ? AND vote_type = 'green'", (message_id,)) as cursor:
-                green_votes = (await cursor.fetchone())[0]
-            async with db.execute("SELECT COUNT(*) FROM user_votes WHERE message_id = ? AND vote_type = 'red'", (message_id,)) as cursor:
-                red_votes = (await cursor.fetchone())[0]
+    """
+    رای کاربر را در یک تراکنش ثبت و شمارش جدید را برمی‌گرداند.
+    شمارنده‌ها توسط تریگرهای user_votes تنظیم می‌شوند، پس هزینه رای
+    به تعداد رای‌دهندگان پیام بستگی ندارد.
+    """
+    try:
+        async with _write_transaction() as db:
+            # ۱. ثبت یا تغییر رای؛ رای تکراری هیچ ردیفی را تغییر نمی‌دهد
+            cursor = await db.execute(
+                "INSERT INTO user_votes (message_id, user_id, vote_type) VALUES (?, ?, ?) "
+                "ON CONFLICT (message_id, user_id) DO UPDATE SET vote_type = excluded.vote_type "
+                "WHERE vote_type IS NOT excluded.vote_type",
+                (message_id, user_id, vote_type)
+            )
+            changed = cursor.rowcount
+            await cursor.close()
+            if not changed:
+                logger.debug(f"User {user_id} voted {vote_type} again for Msg {message_id}. No change.")
+                return None  # رای تکراری
 
-            # ۳. آپدیت جدول اصلی
-            await db.execute("UPDATE token_votes SET green_votes = ?, red_votes = ? WHERE message_id = ?", (green_votes, red_votes, message_id))
-            await db.commit()
+            # ۲. خواندن شمارنده‌های به‌روزشده در همان تراکنش
+            async with db.execute("SELECT green_votes, red_votes FROM token_votes WHERE message_id = ?", (message_id,)) as cursor:
+                green_votes, red_votes = await cursor.fetchone()
 
-            logger.debug(f"Vote counts updated for Msg {message_id}: G={green_votes}, R={red_votes}")
-            return green_votes, red_votes
+        logger.info(f"User {user_id} voted {vote_type} for Msg {message_id}")
+        logger.debug(f"Vote counts updated for Msg {message_id}: G={green_votes}, R={red_votes}")
+        return green_votes, red_votes
 
     except aiosqlite.Error as e:
         logger.error(f"Async SQLite error in process_vote for Msg {message_id}: {e}")
         return "error"
 
+@timed_db_call
 async def get_token_address_for_message(message_id):
     """آدرس قرارداد را برای بازسازی دکمه‌ها از DB می‌خواند."""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute("SELECT token_address FROM token_votes WHERE message_id = ?", (message_id,)) as cursor:
-                token_row = await cursor.fetchone()
-                if token_row:
-                    return token_row[0]
-                else:
-                    logger.warning(f"No token_address found in DB for Msg {message_id}")
-                    return None
+        db = await _get_reader()
+        async with db.execute("SELECT token_address FROM token_votes WHERE message_id = ?", (message_id,)) as cursor:
+            token_row = await cursor.fetchone()
+            if token_row:
+                return token_row[0]
+            else:
+                logger.warning(f"No token_address found in DB for Msg {message_id}")
+                return None
     except aiosqlite.Error as e:
         logger.error(f"Async SQLite error in get_token_address_for_message for Msg {message_id}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+@timed_db_call
+async def load_message_votes(message_id):
+    """
+    وضعیت کامل رای‌های یک پیام را برای بازسازی حافظه رای‌ها می‌خواند.
+    خروجی: (token_address, green_votes, red_votes, {user_id: vote_type}) یا None در صورت خطا.
+    """
+    try:
+        db = await _get_reader()
+        async with db.execute("SELECT token_address, green_votes, red_votes FROM token_votes WHERE message_id = ?", (message_id,)) as cursor:
+            row = await cursor.fetchone()
+        async with db.execute("SELECT user_id, vote_type FROM user_votes WHERE message_id = ?", (message_id,)) as cursor:
+            user_votes = {user_id: vote_type for user_id, vote_type in await cursor.fetchall()}
+        if row:
+            return row[0], row[1], row[2], user_votes
+        return None, 0, 0, user_votes
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in load_message_votes for Msg {message_id}: {e}")
+        return None
+
+@timed_db_call
+async def flush_votes(votes):
+    """
+    دسته‌ای از رای‌ها [(message_id, user_id, vote_type), ...] را در یک تراکنش ذخیره می‌کند.
+    شمارنده‌های token_votes توسط تریگرها تنظیم می‌شوند.
+    """
+    try:
+        async with _write_transaction() as db:
+            await db.executemany(
+                "INSERT INTO user_votes (message_id, user_id, vote_type) VALUES (?, ?, ?) "
+                "ON CONFLICT (message_id, user_id) DO UPDATE SET vote_type = excluded.vote_type "
+                "WHERE vote_type IS NOT excluded.vote_type",
+                votes
+            )
+        logger.debug(f"Flushed {len(votes)} votes to DB.")
+        return True
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in flush_votes ({len(votes)} votes): {e}")
+        return False
+
+@timed_db_call
+async def load_sent_keys(since, limit):
+    """کلیدهای پیام‌های ارسال‌شده بعد از since را (جدیدترین‌ها، حداکثر limit) برمی‌گرداند."""
+    try:
+        db = await _get_reader()
+        async with db.execute(
+            "SELECT content_key, sent_at FROM sent_messages WHERE sent_at >= ? ORDER BY sent_at DESC LIMIT ?",
+            (since, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in load_sent_keys: {e}")
+        return []
+
+@timed_db_call
+async def record_sent_key(content_key, sent_at, prune_before=None):
+    """کلید پیام ارسال‌شده را ثبت و در صورت نیاز ردیف‌های قدیمی‌تر از prune_before را حذف می‌کند."""
+    try:
+        async with _write_transaction() as db:
+            await db.execute(
+                "INSERT INTO sent_messages (content_key, sent_at) VALUES (?, ?) "
+                "ON CONFLICT (content_key) DO UPDATE SET sent_at = excluded.sent_at",
+                (content_key, sent_at)
+            )
+            if prune_before is not None:
+                await db.execute("DELETE FROM sent_messages WHERE sent_at < ?", (prune_before,))
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in record_sent_key: {e}")
+
+@timed_db_call
+async def outbox_write_batch(inserts, claims, retries, acks, dead=()):
+    """
+    همه تغییرات صف خروجی را در یک تراکنش اعمال می‌کند:
+    inserts: [(payload, created_at)]، claims: [(claimed_at, id)]، retries، acks و dead: [id].
+    ردیف‌های ack‌شده حذف و ردیف‌های dead برای بررسی دستی نگه داشته می‌شوند.
+    خروجی: لیست idهای درج‌شده یا None در صورت خطا.
+    """
+    try:
+        new_ids = []
+        async with _write_transaction() as db:
+            for payload, created_at in inserts:
+                cursor = await db.execute(
+                    "INSERT INTO outbox (payload, status, created_at) VALUES (?, 'pending', ?)",
+                    (payload, created_at)
+                )
+                new_ids.append(cursor.lastrowid)
+                await cursor.close()
+            if claims:
+                await db.executemany("UPDATE outbox SET status = 'claimed', claimed_at = ? WHERE id = ?", claims)
+            if retries:
+                await db.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in retries])
+            if acks:
+                await db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in acks])
+            if dead:
+                await db.executemany("UPDATE outbox SET status = 'dead' WHERE id = ?", [(i,) for i in dead])
+        return new_ids
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in outbox_write_batch: {e}")
+        return None
+
+@timed_db_call
+async def outbox_load(after_id, limit):
+    """ردیف‌های تحویل‌نشده (غیر dead) صف خروجی با id بزرگ‌تر از after_id را به ترتیب id برمی‌گرداند."""
+    try:
+        db = await _get_reader()
+        async with db.execute(
+            "SELECT id, payload, attempts FROM outbox WHERE id > ? AND status != 'dead' ORDER BY id LIMIT ?",
+            (after_id, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in outbox_load: {e}")
+        return []
+
+@timed_db_call
+async def outbox_recover(max_attempts):
+    """
+    هنگام شروع برنامه: پیام‌هایی که در اجرای قبلی claim شده ولی ack نشده بودند (در حال ارسال هنگام
+    توقف یا کرش) یک تلاش حساب و دوباره pending می‌شوند؛ پیام‌هایی که به max_attempts رسیده‌اند dead می‌شوند.
+    خروجی: (تعداد بازگردانده‌شده، تعداد dead‌شده) یا None در صورت خطا.
+    """
+    try:
+        async with _write_transaction() as db:
+            cursor = await db.execute(
+                "UPDATE outbox SET status = 'pending', attempts = attempts + 1, claimed_at = NULL WHERE status = 'claimed'"
+            )
+            recovered = cursor.rowcount
+            await cursor.close()
+            cursor = await db.execute(
+                "UPDATE outbox SET status = 'dead' WHERE status = 'pending' AND attempts >= ?", (max_attempts,)
+            )
+            dead = cursor.rowcount
+            await cursor.close()
+        return recovered, dead
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in outbox_recover: {e}")
+        return None
+
+@timed_db_call
+async def outbox_max_id():
+    """بزرگ‌ترین id صف خروجی (0 برای جدول خالی) یا None در صورت خطا."""
+    try:
+        db = await _get_reader()
+        async with db.execute("SELECT COALESCE(MAX(id), 0) FROM outbox") as cursor:
+            row = await cursor.fetchone()
+            return row[0]
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in outbox_max_id: {e}")
+        return None
+
+@timed_db_call
+async def outbox_count():
+    """تعداد پیام‌های تحویل‌نشده (غیر dead) در صف خروجی."""
+    try:
+        db = await _get_reader()
+        async with db.execute("SELECT COUNT(*) FROM outbox WHERE status != 'dead'") as cursor:
+            return (await cursor.fetchone())[0]
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in outbox_count: {e}")
+        return 0
+
+@timed_db_call
+async def write_traces(rows, prune_before=None):
+    """
+    trace‌های پیام را به صورت دسته‌ای ذخیره می‌کند: rows = [(channel, finished_at, retries, stages_json)].
+    در صورت نیاز trace‌های قدیمی‌تر از prune_before حذف می‌شوند. خروجی: True/False.
+    """
+    try:
+        async with _write_transaction() as db:
+            await db.executemany(
+                "INSERT INTO traces (channel, finished_at, retries, stages) VALUES (?, ?, ?, ?)", rows
+            )
+            if prune_before is not None:
+                await db.execute("DELETE FROM traces WHERE finished_at < ?", (prune_before,))
+        return True
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in write_traces ({len(rows)} rows): {e}")
+        return False
+
+@timed_db_call
+async def load_traces(since):
+    """trace‌های پایان‌یافته بعد از since را برمی‌گرداند: [(channel, finished_at, retries, stages_json)]."""
+    try:
+        db = await _get_reader()
+        async with db.execute(
+            "SELECT channel, finished_at, retries, stages FROM traces WHERE finished_at >= ? ORDER BY finished_at",
+            (since,)
+        ) as cursor:
+            return await cursor.fetchall()
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in load_traces: {e}")
+        return []
+
+@timed_db_call
+async def load_routes():
+    """
+    مسیرهای فعال را برمی‌گرداند: [(id, source_chat_id, parser, destinations_json, rate_per_minute, use_secondary,
+    dedup_ttl_seconds, dedup_key, dedup_bucket_seconds)].
+    در صورت خطا None برمی‌گرداند (تا با جدول خالی اشتباه گرفته نشود).
+    """
+    try:
+        db = await _get_reader()
+        async with db.execute(
+            "SELECT id, source_chat_id, parser, destinations, rate_per_minute, use_secondary, "
+            "dedup_ttl_seconds, dedup_key, dedup_bucket_seconds FROM routes WHERE enabled = 1 ORDER BY id"
+        ) as cursor:
+            return await cursor.fetchall()
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in load_routes: {e}")
+        return None
+
+@timed_db_call
+async def sync_routes(rows):
+    """
+    جدول routes را با مسیرهای داده‌شده همگام می‌کند: rows = [(source_chat_id, parser, destinations_json, rate_per_minute,
+    use_secondary, dedup_ttl_seconds, dedup_key, dedup_bucket_seconds)].
+    مسیر هر منبع موجود به‌روز و فعال می‌شود (id آن ثابت می‌ماند تا پیام‌های outbox به همان مسیر برسند)
+    و مسیر منبع‌هایی که در rows نیستند غیرفعال می‌شود. خروجی: True/False.
+    """
+    try:
+        async with _write_transaction() as db:
+            await db.executemany(
+                "INSERT INTO routes (source_chat_id, parser, destinations, rate_per_minute, use_secondary, "
+                "dedup_ttl_seconds, dedup_key, dedup_bucket_seconds, enabled) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT(source_chat_id) DO UPDATE SET parser = excluded.parser, destinations = excluded.destinations, "
+                "rate_per_minute = excluded.rate_per_minute, use_secondary = excluded.use_secondary, "
+                "dedup_ttl_seconds = excluded.dedup_ttl_seconds, dedup_key = excluded.dedup_key, "
+                "dedup_bucket_seconds = excluded.dedup_bucket_seconds, enabled = 1",
+                rows
+            )
+            placeholders = ", ".join("?" for _ in rows)
+            await db.execute(
+                f"UPDATE routes SET enabled = 0 WHERE enabled = 1 AND source_chat_id NOT IN ({placeholders})",
+                [row[0] for row in rows]
+            )
+        return True
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in sync_routes ({len(rows)} rows): {e}")
+        return False
+
+@timed_db_call
+async def load_windows():
+    """
+    همه پنجره‌های زمانی کانال‌های دوم: [(id, channel_id, start_time, duration, recurrence)].
+    در صورت خطا None برمی‌گرداند.
+    """
+    try:
+        db = await _get_reader()
+        async with db.execute(
+            "SELECT id, channel_id, start_time, duration, recurrence FROM secondary_windows ORDER BY id"
+        ) as cursor:
+            return await cursor.fetchall()
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in load_windows: {e}")
+        return None
+
+@timed_db_call
+async def insert_window(channel_id, start_time, duration, recurrence):
+    """یک پنجره زمانی ثبت و id آن را برمی‌گرداند (None در صورت خطا)."""
+    try:
+        async with _write_transaction() as db:
+            cursor = await db.execute(
+                "INSERT INTO secondary_windows (channel_id, start_time, duration, recurrence) VALUES (?, ?, ?, ?)",
+                (channel_id, start_time, duration, recurrence)
+            )
+            window_id = cursor.lastrowid
+            await cursor.close()
+        logger.info(f"Window {window_id} saved: channel={channel_id}, start={start_time}, duration={duration}, {recurrence}")
+        return window_id
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in insert_window: {e}")
+        return None
+
+@timed_db_call
+async def delete_windows(window_ids):
+    """پنجره‌های داده‌شده را حذف و تعداد ردیف‌های حذف‌شده را برمی‌گرداند (None در صورت خطا)."""
+    try:
+        async with _write_transaction() as db:
+            cursor = await db.executemany("DELETE FROM secondary_windows WHERE id = ?", [(i,) for i in window_ids])
+            deleted = cursor.rowcount
+            await cursor.close()
+        return deleted
+    except aiosqlite.Error as e:
+        logger.error(f"Async SQLite error in delete_windows: {e}")
+        return None
@@ -0,0 +1,166 @@
+# dedup.py
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from database import load_sent_keys, record_sent_key
+from metrics import dedup_hits, dedup_expired, dedup_evicted
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+SENT_LEDGER_TTL_SECONDS = 24 * 3600  # پیام ارسال‌شده تا یک روز دوباره ارسال نمی‌شود
+SENT_LEDGER_MAX_ENTRIES = 5000
+SENT_LEDGER_PRUNE_EVERY = 200  # هر چند ثبت یک بار ردیف‌های منقضی از DB حذف می‌شوند
+
+_TOKEN_ADDRESS_RE = re.compile(r'^0x[a-f0-9]{40}$')
+
+
+# --- توابع کلید محتوا: (message_text, now) -> کلید پایدار ---
+# برخلاف hash() پایتون، این کلیدها بین اجراهای مختلف پروسه ثابت هستند.
+
+def text_content_key(message_text, now=None):
+    """ خلاصه کل متن؛ هر تغییر کوچک کلید جدید می‌سازد """
+    return hashlib.blake2b(message_text.encode('utf-8'), digest_size=16).hexdigest()
+
+def token_content_key(message_text, now=None):
+    """
+    آدرس نرمال‌شده توکن از خط اول 🥞؛ ارسال دوباره همان توکن با MC متفاوت تکراری حساب می‌شود.
+    اگر آدرس معتبر نباشد، به خلاصه کل متن برمی‌گردد.
+    """
+    first_line = message_text.partition('\n')[0]
+    address = first_line.replace('🥞', '').strip().lower()
+    if _TOKEN_ADDRESS_RE.match(address):
+        return address
+    return text_content_key(message_text)
+
+def bucketed_key(key_func, bucket_seconds):
+    """ کلید را با یک سطل زمانی ترکیب می‌کند تا همان محتوا در سطل بعدی دوباره پذیرفته شود """
+    def key(message_text, now):
+        return f"{key_func(message_text, now)}@{int(now // bucket_seconds)}"
+    return key
+
+
+class TTLDeduplicator:
+    """
+    ایندکس حذف تکراری با انقضای زمانی.
+    کلیدها به ترتیب زمان ثبت در OrderedDict نگه داشته می‌شوند، پس انقضا فقط از ابتدای
+    صف انجام می‌شود (O(1) سرشکن) و سقف حافظه با حذف قدیمی‌ترین کلید رعایت می‌شود.
+    hits/expired/evicted با برچسب index=name در metrics هم شمرده می‌شوند.
+    """
+
+    def __init__(self, ttl_seconds, max_entries=10000, key_func=token_content_key, name="dedup"):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.key_func = key_func
+        self.name = name
+        self._entries = OrderedDict()  # key -> زمان ثبت (monotonic)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self, now):
+        entries = self._entries
+        cutoff = now - self.ttl_seconds
+        while entries:
+            key, registered_at = next(iter(entries.items()))
+            if registered_at >= cutoff:
+                break
+            entries.popitem(last=False)
+            self.expired += 1
+            dedup_expired.inc(index=self.name)
+
+    def check_and_add(self, message_text, now=None):
+        """اگر پیام در بازه TTL تکراری باشد True برمی‌گرداند؛ در غیر این صورت آن را ثبت می‌کند."""
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+
+        key = self.key_func(message_text, now)
+        if key in self._entries:
+            self.hits += 1
+            dedup_hits.inc(index=self.name)
+            return True
+
+        self._entries[key] = now
+        self.misses += 1
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+            dedup_evicted.inc(index=self.name)
+        return False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+class SentLedger:
+    """
+    دفتر محدود پیام‌های ارسال‌شده که پس از ری‌استارت هم باقی می‌ماند.
+    در حافظه به ترتیب زمان ارسال نگه داشته می‌شود (انقضای TTL و حذف قدیمی‌ترین در سقف)
+    و پشتوانه آن جدول sent_messages است که در اولین استفاده بارگیری می‌شود.
+    """
+
+    def __init__(self, ttl_seconds=SENT_LEDGER_TTL_SECONDS, max_entries=SENT_LEDGER_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # content_key -> sent_at (ثانیه یونیکس)
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._writes_since_prune = 0
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            rows = await load_sent_keys(int(time.time() - self.ttl_seconds), self.max_entries)
+            for content_key, sent_at in reversed(rows):
+                self._entries.setdefault(content_key, sent_at)
+            self._loaded = True
+            logger.info(f"Sent ledger loaded {len(rows)} keys from DB")
+
+    def _expire(self, now):
+        cutoff = now - self.ttl_seconds
+        entries = self._entries
+        while entries:
+            content_key, sent_at = next(iter(entries.items()))
+            if sent_at >= cutoff:
+                break
+            entries.popitem(last=False)
+
+    async def contains(self, content_key):
+        await self._ensure_loaded()
+        self._expire(time.time())
+        return content_key in self._entries
+
+    async def add(self, content_key):
+        await self._ensure_loaded()
+        now = int(time.time())
+        self._entries.pop(content_key, None)
+        self._entries[content_key] = now
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        self._writes_since_prune += 1
+        prune_before = None
+        if self._writes_since_prune >= SENT_LEDGER_PRUNE_EVERY:
+            self._writes_since_prune = 0
+            prune_before = now - self.ttl_seconds
+        await record_sent_key(content_key, now, prune_before)
+
+    def __len__(self):
+        return len(self._entries)
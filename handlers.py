@@ -1,5 +1,5 @@
 # handlers.py
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import Update
 from telegram.ext import ContextTypes
 from config import *
 import pytz
@@ -8,13 +8,54 @@ from datetime import datetime, timedelta
 import logging  # ایمپورت کردن لاگ
 import traceback
 import time
-from database import save_settings, load_settings, process_vote, get_token_address_for_message
+from windows import window_schedule, RECURRENCE_PERIODS
+from votes import vote_journal, vote_markup_coalescer
+from metrics import REGISTRY, votes_processed
+from tracing import tracer
+from routing import routing_table
 
 # لاگر حرفه‌ای مخصوص این ماژول
 logger = logging.getLogger(__name__)
 
+def _parse_window(duration_str, start_time_str, date_str=None):
+    """
+    مدت (مثل 4h یا 30m)، ساعت شروع HH:MM به UTC و تاریخ اختیاری YYYY-MM-DD را تجزیه می‌کند.
+    بدون تاریخ، اولین نوبت آینده آن ساعت انتخاب می‌شود. خروجی: (start_time، مدت به ثانیه)؛
+    در صورت ورودی نامعتبر ValueError با پیام قابل نمایش به ادمین.
+    """
+    duration_match = re.fullmatch(r'(\d+)(h|m)', duration_str)
+    if not duration_match:
+        raise ValueError("مدت زمان باید به‌صورت عددی با واحد h (ساعت) یا m (دقیقه) باشد. مثال: 4h")
+    duration_value, unit = duration_match.groups()
+    duration_seconds = int(duration_value) * (3600 if unit == 'h' else 60)
+    if duration_seconds <= 0:
+        raise ValueError("مدت زمان باید بیشتر از صفر باشد.")
+
+    time_match = re.match(r'(\d{1,2}):(\d{2})', start_time_str)
+    if not time_match:
+        raise ValueError("ساعت شروع باید به‌صورت HH:MM باشد. مثال: 14:00")
+    hour, minute = map(int, time_match.groups())
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError("ساعت شروع نامعتبر است. باید بین 00:00 و 23:59 باشد.")
+
+    now = datetime.now(pytz.UTC)
+    if date_str:
+        try:
+            day = datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("تاریخ باید به‌صورت YYYY-MM-DD باشد. مثال: 2025-01-31")
+        start_time = now.replace(year=day.year, month=day.month, day=day.day, hour=hour, minute=minute, second=0, microsecond=0)
+    else:
+        start_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if start_time < now:
+            start_time += timedelta(days=1)
+    return start_time, duration_seconds
+
+def _format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, pytz.UTC).strftime('%Y-%m-%d %H:%M')
+
 async def set_secondary(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """دستور ادمین برای تنظیم کانال دوم برای مدت زمان مشخص."""
+    """دستور ادمین برای تنظیم کانال دوم برای مدت زمان مشخص (جایگزین پنجره یک‌باره قبلی آن)."""
     # لاگ‌ها به logger تغییر کردند
     logger.debug(f"Received /set_secondary command from user {update.effective_user.id}")
     user_id = update.effective_user.id
@@ -29,72 +70,230 @@ async def set_secondary(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(args) != 2:
             await update.message.reply_text("لطفاً دستور را به‌صورت: /set_secondary <مدت زمان> <ساعت شروع> وارد کنید\nمثال: /set_secondary 4h 14:00")
             return
-        
-        duration_str, start_time_str = args
-        duration_match = re.match(r'(\d+)(h|m)', duration_str)
-        if not duration_match:
-            await update.message.reply_text("مدت زمان باید به‌صورت عددی با واحد h (ساعت) یا m (دقیقه) باشد. مثال: 4h")
-            return
-        duration_value, unit = duration_match.groups()
-        duration_seconds = int(duration_value) * (3600 if unit == 'h' else 60)
 
-        time_match = re.match(r'(\d{1,2}):(\d{2})', start_time_str)
-        if not time_match:
-            await update.message.reply_text("ساعت شروع باید به‌صورت HH:MM باشد. مثال: 14:00")
-            return
-        hour, minute = map(int, time_match.groups())
-        if not (0 <= hour <= 23 and 0 <= minute <= 59):
-            await update.message.reply_text("ساعت شروع نامعتبر است. باید بین 00:00 و 23:59 باشد.")
+        try:
+            start_time, duration_seconds = _parse_window(*args)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
             return
 
-        now = datetime.now(pytz.UTC)
-        start_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if start_time < now:
-            start_time += timedelta(days=1)
-        start_timestamp = int(start_time.timestamp())
-        expiry_timestamp = start_timestamp + duration_seconds
-
-        await save_settings(SECONDARY_CHANNEL_ID, start_timestamp, expiry_timestamp)
+        await window_schedule.remove_channel(SECONDARY_CHANNEL_ID, recurrence="once")
+        window = await window_schedule.add(SECONDARY_CHANNEL_ID, start_time.timestamp(), duration_seconds)
+        if window is None:
+            await update.message.reply_text("خطا در ذخیره زمان‌بندی. لطفاً دوباره تلاش کنید.")
+            return
         await update.message.reply_text(
             f"کانال دوم فعال شد.\nشروع: {start_time.strftime('%Y-%m-%d %H:%M')}\nپایان: {(start_time + timedelta(seconds=duration_seconds)).strftime('%Y-%m-%d %H:%M')}"
         )
-        logger.info(f"Admin {user_id} set secondary channel: start={start_timestamp}, expiry={expiry_timestamp}")
+        logger.info(f"Admin {user_id} set secondary channel: window {window.id}, start={window.start_time}, duration={window.duration}")
     except Exception as e:
         await update.message.reply_text("خطا در پردازش دستور. لطفاً دوباره تلاش کنید.")
         logger.error(f"Error in set_secondary: {e}\n{traceback.format_exc()}")
 
 async def stop_secondary(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """دستور ادمین برای توقف فوری ارسال به کانال دوم."""
+    """دستور ادمین برای توقف فوری ارسال به کانال دوم (همه پنجره‌های آن حذف می‌شوند)."""
     logger.debug(f"Received /stop_secondary command from user {update.effective_user.id}")
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS:
         logger.warning(f"Unauthorized access attempt by user {user_id}")
         await update.message.reply_text("شما دسترسی به این دستور ندارید.")
         return
-    await save_settings(SECONDARY_CHANNEL_ID, 0, 0)
+    removed = await window_schedule.remove_channel(SECONDARY_CHANNEL_ID)
+    if removed is None:
+        await update.message.reply_text("خطا در حذف زمان‌بندی. لطفاً دوباره تلاش کنید.")
+        return
     await update.message.reply_text("ارسال به کانال دوم متوقف شد.")
-    logger.info(f"Admin {user_id} stopped secondary channel")
+    logger.info(f"Admin {user_id} stopped secondary channel ({len(removed)} windows removed)")
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """دستور ادمین برای بررسی وضعیت فعلی کانال دوم."""
+    """دستور ادمین برای بررسی وضعیت فعلی کانال‌های دوم."""
     logger.debug(f"Received /status command from user {update.effective_user.id}")
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS:
         logger.warning(f"Unauthorized access attempt by user {user_id}")
         await update.message.reply_text("شما دسترسی به این دستور ندارید.")
         return
-    settings = await load_settings()
-    current_time = int(time.time())
-    if settings['start_time'] <= current_time <= settings['expiry_time']:
-        start_time = datetime.fromtimestamp(settings['start_time'], pytz.UTC)
-        expiry_time = datetime.fromtimestamp(settings['expiry_time'], pytz.UTC)
-        await update.message.reply_text(
-            f"کانال دوم فعال است.\nشروع: {start_time.strftime('%Y-%m-%d %H:%M')}\nپایان: {expiry_time.strftime('%Y-%m-%d %H:%M')}"
-        )
+    active_channels = window_schedule.active_channels()
+    if active_channels:
+        lines = ["کانال‌های دوم فعال:"]
+        for window in window_schedule.windows():
+            if window.channel_id not in active_channels:
+                continue
+            occurrence = window_schedule.next_occurrence(window)
+            if occurrence and occurrence[0] <= time.time():
+                lines.append(f"{window.channel_id}: تا {_format_timestamp(occurrence[1])} (پنجره #{window.id})")
+        await update.message.reply_text("\n".join(lines))
     else:
         await update.message.reply_text("کانال دوم غیرفعال است.")
     logger.info(f"Admin {user_id} checked status")
 
+async def add_window(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای افزودن پنجره زمانی یک‌باره یا تکرارشونده برای یک کانال دوم."""
+    logger.debug(f"Received /add_window command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+
+    try:
+        args = context.args
+        logger.debug(f"Arguments for /add_window: {args}")
+        if not 3 <= len(args) <= 5:
+            await update.message.reply_text(
+                "لطفاً دستور را به‌صورت: /add_window <آیدی کانال> <مدت زمان> <ساعت شروع> [once|daily|weekly] [تاریخ] وارد کنید\n"
+                "مثال: /add_window -1001234567890 2h 09:00 daily\n"
+                "ساعت‌ها به وقت UTC هستند. تاریخ (یا بدون آن اولین نوبت آینده) اولین نوبت پنجره است؛\n"
+                "پنجره daily/weekly پیش از آن فعال نمی‌شود و روز هفته weekly هم از آن گرفته می‌شود."
+            )
+            return
+
+        try:
+            channel_id = int(args[0])
+        except ValueError:
+            await update.message.reply_text("آیدی کانال باید عدد باشد. مثال: -1001234567890")
+            return
+        recurrence = args[3].lower() if len(args) >= 4 else "once"
+        if recurrence not in RECURRENCE_PERIODS:
+            await update.message.reply_text(f"نوع تکرار باید یکی از {', '.join(RECURRENCE_PERIODS)} باشد.")
+            return
+        try:
+            start_time, duration_seconds = _parse_window(args[1], args[2], args[4] if len(args) == 5 else None)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return
+        if recurrence == "once" and start_time + timedelta(seconds=duration_seconds) <= datetime.now(pytz.UTC):
+            await update.message.reply_text("این پنجره در گذشته تمام شده است.")
+            return
+
+        window = await window_schedule.add(channel_id, start_time.timestamp(), duration_seconds, recurrence)
+        if window is None:
+            await update.message.reply_text("خطا در ذخیره زمان‌بندی. لطفاً دوباره تلاش کنید.")
+            return
+        await update.message.reply_text(
+            f"پنجره #{window.id} برای کانال {channel_id} ثبت شد ({recurrence}).\n"
+            f"شروع: {start_time.strftime('%Y-%m-%d %H:%M')}\nمدت: {duration_seconds // 60} دقیقه"
+        )
+        logger.info(f"Admin {user_id} added window {window.id}: channel={channel_id}, start={window.start_time}, duration={window.duration}, {recurrence}")
+    except Exception as e:
+        await update.message.reply_text("خطا در پردازش دستور. لطفاً دوباره تلاش کنید.")
+        logger.error(f"Error in add_window: {e}\n{traceback.format_exc()}")
+
+async def list_windows(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای فهرست پنجره‌های زمانی کانال‌های دوم."""
+    logger.debug(f"Received /list_windows command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+    now = time.time()
+    lines = []
+    for window in window_schedule.windows():
+        occurrence = window_schedule.next_occurrence(window, now)
+        if occurrence is None:
+            continue
+        start, end = occurrence
+        state = "فعال" if start <= now else "بعدی"
+        lines.append(
+            f"#{window.id} کانال {window.channel_id} ({window.recurrence}، {window.duration // 60} دقیقه)\n"
+            f"{state}: {_format_timestamp(start)} تا {_format_timestamp(end)}"
+        )
+    if not lines:
+        await update.message.reply_text("هیچ پنجره‌ای ثبت نشده است.")
+        return
+    text = "\n".join(lines)
+    if len(text) > 4000:
+        text = text[:4000] + "\n..."
+    await update.message.reply_text(text)
+    logger.info(f"Admin {user_id} listed windows")
+
+async def remove_window(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای حذف یک یا چند پنجره زمانی با شماره آن‌ها."""
+    logger.debug(f"Received /remove_window command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+    try:
+        window_ids = [int(arg.lstrip('#')) for arg in context.args]
+    except ValueError:
+        window_ids = []
+    if not window_ids:
+        await update.message.reply_text("لطفاً شماره پنجره را وارد کنید. مثال: /remove_window 3")
+        return
+    removed = await window_schedule.remove(window_ids)
+    if removed is None:
+        await update.message.reply_text("خطا در حذف زمان‌بندی. لطفاً دوباره تلاش کنید.")
+        return
+    if not removed:
+        await update.message.reply_text("پنجره‌ای با این شماره پیدا نشد.")
+        return
+    await update.message.reply_text(f"پنجره‌های حذف‌شده: {', '.join(f'#{window_id}' for window_id in removed)}")
+    logger.info(f"Admin {user_id} removed windows {removed}")
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای خلاصه متریک‌های خط لوله."""
+    logger.debug(f"Received /metrics command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+    lines = REGISTRY.summary_lines() or ["هنوز متریکی ثبت نشده است."]
+    text = "\n".join(lines)
+    if len(text) > 4000:
+        text = text[:4000] + "\n..."
+    await update.message.reply_text(text)
+    logger.info(f"Admin {user_id} checked metrics")
+
+async def latency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای گزارش p50/p95/p99 تأخیر هر مرحله در یک ساعت اخیر."""
+    logger.debug(f"Received /latency command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+    trace_count, report, total_retries = await tracer.latency_report(3600)
+    if not report:
+        await update.message.reply_text("در یک ساعت اخیر پیامی ارسال نشده است.")
+        return
+    lines = [f"تأخیر مراحل در یک ساعت اخیر ({trace_count} ارسال، {total_retries} retry)", "stage: p50 / p95 / p99 (s)"]
+    for stage, stats in report.items():
+        lines.append(f"{stage}: {stats['p50']:.2f} / {stats['p95']:.2f} / {stats['p99']:.2f} (n={stats['n']})")
+    await update.message.reply_text("\n".join(lines))
+    logger.info(f"Admin {user_id} checked latency")
+
+async def routes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دستور ادمین برای نمایش جدول مسیریابی منبع به مقصدها."""
+    logger.debug(f"Received /routes command from user {update.effective_user.id}")
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt by user {user_id}")
+        await update.message.reply_text("شما دسترسی به این دستور ندارید.")
+        return
+    route_list = routing_table.routes()
+    if not route_list:
+        await update.message.reply_text("هیچ مسیری تعریف نشده است.")
+        return
+    lines = []
+    for route in route_list:
+        destinations = ", ".join(str(chat_id) for chat_id in route.destinations)
+        lines.append(
+            f"#{route.id}: {route.source_chat_id} -> {destinations}\n"
+            f"پارسر: {route.parser_name}، سقف دریافت: {route.rate_per_minute} پیام در دقیقه، "
+            f"حذف تکراری: {route.recent.ttl_seconds} ثانیه، کانال دوم: {'بله' if route.use_secondary else 'خیر'}"
+        )
+    lines.append(
+        "مسیرها از ROUTES در config خوانده می‌شوند و جدول routes در هر راه‌اندازی با آن بازنویسی می‌شود؛ "
+        "برای تغییر، config را ویرایش و ربات را ری‌استارت کنید. "
+        f"سقف ارسال برای هر کانال مقصد جداگانه {MAX_MESSAGES_PER_MINUTE} پیام در دقیقه است."
+    )
+    await update.message.reply_text("\n".join(lines))
+    logger.info(f"Admin {user_id} checked routes")
+
 async def handle_vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """هندلر بازنویسی شده برای رای‌گیری (Async)."""
     query = update.callback_query
@@ -110,48 +309,34 @@ async def handle_vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug(f"Vote received: User {user_id} voted {vote_type} on Msg {message_id} in Chat {chat_id}")
 
     try:
-        # ۱. پردازش رای در دیتابیس
-        vote_result = await process_vote(message_id, user_id, vote_type)
+        # ۱. پردازش رای در ژورنال حافظه (ذخیره دسته‌ای در DB)
+        vote_result = await vote_journal.process_vote(message_id, user_id, vote_type)
 
         if vote_result is None:
+            votes_processed.inc(result="duplicate")
             await query.answer("شما قبلاً رای خود را ثبت کرده‌اید")
             logger.debug(f"User {user_id} already voted {vote_type} for Msg {message_id}. No change.")
             return
         if vote_result == "error":
+            votes_processed.inc(result="error")
             await query.answer("خطا در ثبت رای.")
             logger.error(f"process_vote returned 'error' for Msg {message_id}")
             return
 
         green_votes, red_votes = vote_result
+        votes_processed.inc(result="accepted")
         logger.info(f"Vote processed for Msg {message_id}. New counts: G={green_votes}, R={red_votes}")
 
         # ۲. بازسازی دکمه‌ها
-        token_address = await get_token_address_for_message(message_id)
+        token_address = await vote_journal.get_token_address(message_id)
         if not token_address:
             logger.warning(f"Could not find token_address for Msg {message_id} during vote update.")
             await query.answer("خطا در بازخوانی اطلاعات.")
             return
 
-        keyboard = [
-            [InlineKeyboardButton("📈 مشاهده نمودار (Dex)", url=f"https://dexscreener.com/bsc/{token_address}")],
-            [InlineKeyboardButton("🔍 بررسی در اکسیوم (Axiom)", url=f"https://axiom.app/contract/{token_address}")],
-            [InlineKeyboardButton("💰 ترید کن سولانا هدیه بگیر", url=GIFT)],
-            [InlineKeyboardButton("📚 آموزش آکسیوم", url=AXIOM_LINK), 
-             InlineKeyboardButton("❓ سوالتون اینجا بپرسید", url=SUPPORT_LINK)],
-            [
-                InlineKeyboardButton(f"🟢 ({green_votes})", callback_data="vote_green"),
-                InlineKeyboardButton(f"🔴 ({red_votes})", callback_data="vote_red")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        # ۳. ویرایش پیام
-        await context.bot.edit_message_reply_markup(
-            chat_id=chat_id,
-            message_id=message_id,
-            reply_markup=reply_markup
-        )
+        # ۳. پاسخ فوری به کاربر؛ ویرایش کیبورد با تجمیع رای‌ها انجام می‌شود
         await query.answer("رای شما ثبت شد!")
+        vote_markup_coalescer.schedule(context.bot, chat_id, message_id, token_address, green_votes, red_votes)
 
     except Exception as e:
         logger.error(f"Error handling vote for Msg {message_id}: {e}\n{traceback.format_exc()}")
@@ -0,0 +1,275 @@
+# metrics.py
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = "127.0.0.1"  # فقط محلی؛ برای Prometheus روی همان سرور
+METRICS_PORT = None  # غیرفعال به طور پیش‌فرض؛ با METRICS_PORT در config (مثلاً 9108) فعال می‌شود
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # tuple(label values) -> مقدار
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label values, extra label, value)] برای خروجی متنی."""
+        return [("", key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """شمارنده فقط‌افزایشی."""
+
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """مقدار لحظه‌ای؛ می‌تواند هنگام خواندن از یک تابع محاسبه شود."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func, **labels):
+        self._functions[self._key(labels)] = func
+
+    def value(self, **labels):
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        values = dict(self._values)
+        for key, func in self._functions.items():
+            try:
+                values[key] = func()
+            except Exception as e:
+                logger.error(f"Error evaluating gauge {self.name}{key}: {e}")
+        return [("", key, None, value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """هیستوگرام با سطل‌های ثابت (تجمعی در خروجی Prometheus)."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [شمارش هر سطل (+Inf آخر)، مجموع، تعداد]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self, **labels):
+        """(تعداد، میانگین) برای یک ترکیب برچسب."""
+        state = self._values.get(self._key(labels))
+        if not state or not state[2]:
+            return 0, 0.0
+        return state[2], state[1] / state[2]
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", key, ("le", _format_value(bound)), cumulative))
+            samples.append(("_sum", key, None, total))
+            samples.append(("_count", key, None, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def metrics(self):
+        return list(self._metrics.values())
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """خلاصه خوانا برای دستور ادمین /metrics."""
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                for key, (counts, total, count) in metric._values.items():
+                    label = _format_labels(metric.labelnames, key)
+                    average_ms = total / count * 1000 if count else 0.0
+                    lines.append(f"{metric.name}{label}: n={count} avg={average_ms:.1f}ms")
+            else:
+                for _, key, _, value in metric.samples():
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)}: {_format_value(value)}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+# --- متریک‌های خط لوله ---
+
+messages_received = Counter("forward_messages_received_total", "Messages received per route", ("route",))
+messages_deduped = Counter("forward_messages_deduped_total", "Messages skipped as duplicates per route", ("route",))
+messages_rate_limited = Counter("forward_messages_rate_limited_total", "Messages deferred by the receive limiter per route", ("route",))
+dedup_hits = Counter("forward_dedup_hits_total", "Duplicate keys found per dedup index", ("index",))
+dedup_expired = Counter("forward_dedup_expired_total", "Keys dropped from a dedup index after their TTL", ("index",))
+dedup_evicted = Counter("forward_dedup_evicted_total", "Keys evicted from a dedup index by its size cap", ("index",))
+receive_backlog_drained = Counter("forward_receive_backlog_drained_total", "Rate-limited messages processed later", ("limiter",))
+receive_backlog_expired = Counter("forward_receive_backlog_expired_total", "Rate-limited messages dropped after their TTL", ("limiter",))
+receive_backlog_dropped = Counter("forward_receive_backlog_dropped_total", "Rate-limited messages dropped at the backlog cap", ("limiter",))
+messages_parsed = Counter("forward_messages_parsed_total", "Messages parsed successfully per route", ("route",))
+messages_parse_failed = Counter("forward_messages_parse_failed_total", "Messages the parser could not handle per route", ("route",))
+messages_queued = Counter("forward_messages_queued_total", "Messages written to the outbox per route", ("route",))
+messages_sent = Counter("forward_messages_sent_total", "Messages delivered per channel", ("channel",))
+messages_send_failed = Counter("forward_messages_send_failed_total", "Messages given up per channel", ("channel",))
+send_retries = Counter("forward_send_retries_total", "Send retries per channel", ("channel",))
+queue_depth = Gauge("forward_queue_depth", "Pending items per pipeline queue", ("queue",))
+limiter_wait_seconds = Histogram("forward_limiter_wait_seconds", "Time spent waiting for the send limiter", ("channel",))
+votes_processed = Counter("forward_votes_total", "Vote callbacks by result", ("result",))
+db_call_seconds = Histogram("forward_db_call_seconds", "Latency of database calls", ("op",))
+
+
+def timed_db_call(func):
+    """دکوراتور: زمان اجرای یک تابع async پایگاه داده را در db_call_seconds ثبت می‌کند."""
+    op = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            db_call_seconds.observe(time.perf_counter() - start, op=op)
+    return wrapper
+
+
+# --- سرور HTTP محلی برای Prometheus ---
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # بقیه هدرها خوانده و نادیده گرفته می‌شوند
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            body = REGISTRY.render_prometheus().encode("utf-8")
+            status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, status, content_type = b"not found\n", "404 Not Found", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logger.error(f"Error serving metrics request: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    سرور متریک را روی host:port اجرا می‌کند و شیء سرور asyncio را برمی‌گرداند.
+    اگر پورت قابل استفاده نباشد خطا لاگ و None برگردانده می‌شود؛ ربات بدون endpoint متریک ادامه می‌دهد.
+    """
+    try:
+        server = await asyncio.start_server(_handle_http, host, port)
+    except OSError as e:
+        logger.error(f"Could not start metrics endpoint on {host}:{port}: {e}. Continuing without it.")
+        return None
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
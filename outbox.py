@@ -0,0 +1,217 @@
+# outbox.py
+import asyncio
+import json
+import logging
+import time
+import traceback
+from collections import deque
+from database import outbox_write_batch, outbox_load, outbox_count, outbox_recover, outbox_max_id
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+OUTBOX_FRONT_BUFFER_SIZE = 200  # حداکثر پیام آماده در حافظه؛ بقیه فقط روی دیسک می‌مانند
+OUTBOX_FLUSH_INTERVAL_SECONDS = 0.2  # حداکثر فاصله ذخیره claim/ack‌ها وقتی پیام جدیدی نمی‌رسد
+OUTBOX_MAX_ATTEMPTS = 20  # پیامی که این تعداد تلاش/ری‌استارت ناموفق داشته dead می‌شود و دیگر پخش نمی‌شود
+OUTBOX_REPLAY_GRACE_SECONDS = 60  # مهلت اضافه (محدود) پیام‌های بازپخش‌شده پس از ری‌استارت برای رسیدن به صف ارسال
+
+
+class Outbox:
+    """
+    صف خروجی ماندگار روی SQLite به جای asyncio.Queue در حافظه.
+    پیام‌ها در یک وظیفه پس‌زمینه به صورت دسته‌ای درج می‌شوند و همراه با claim/retry/ack در یک
+    تراکنش ذخیره می‌شوند؛ put() تا commit همان دسته منتظر می‌ماند، پس پیامی که put آن برگشته
+    پس از کرش از دست نمی‌رود. یک بافر جلویی کوچک در حافظه مسیر داغ را سریع نگه می‌دارد و هر چه
+    در آن جا نشود روی دیسک می‌ماند و بعداً بارگیری می‌شود.
+    پیام‌های ack‌نشده (در صف یا در حال retry) پس از ری‌استارت دوباره پخش می‌شوند؛ هر ری‌استارت
+    برای پیام‌های در حال ارسال یک تلاش حساب می‌شود و پیامی که به max_attempts برسد (مثلاً payload
+    خراب که هر بار کارگر را از کار می‌اندازد) dead می‌شود و برای بررسی دستی در جدول می‌ماند.
+    """
+
+    def __init__(self, front_buffer_size=OUTBOX_FRONT_BUFFER_SIZE, flush_interval=OUTBOX_FLUSH_INTERVAL_SECONDS,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, replay_grace=OUTBOX_REPLAY_GRACE_SECONDS):
+        self.front_buffer_size = front_buffer_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.replay_grace = replay_grace
+        self._inserts = []  # [(item, created_at, future)] در انتظار درج؛ future پس از commit کامل می‌شود
+        self._claims = []  # [(claimed_at, id)]
+        self._retries = []  # [id]
+        self._acks = []  # [id]
+        self._dead = []  # [id]
+        self.dead_lettered = 0
+        self._replayed_max_id = 0  # پیام‌های با id تا این مقدار از اجرای قبلی مانده‌اند
+        self._ready = deque()  # [(id, item)] بافر جلویی آماده تحویل
+        self._spilled = False  # ردیف‌هایی روی دیسک هست که هنوز به بافر جلویی نیامده‌اند
+        self._high_id = 0  # بزرگ‌ترین id بارگیری‌شده در حافظه
+        self._size = 0  # تعداد پیام‌های ack‌نشده
+        self._ready_event = asyncio.Event()
+        self._flush_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def qsize(self):
+        return self._size
+
+    async def put(self, item):
+        """پیام (dict قابل JSON) را در صف می‌گذارد و تا ذخیره آن روی دیسک منتظر می‌ماند؛ خروجی: id پیام."""
+        future = asyncio.get_running_loop().create_future()
+        self._inserts.append((item, int(time.time()), future))
+        self._size += 1
+        if self._task is None or self._task.done():
+            # بدون وظیفه پس‌زمینه (مثلاً در تست‌ها) همین‌جا ذخیره می‌شود
+            await self.flush()
+            while not future.done():
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        else:
+            self._flush_event.set()
+        return await asyncio.shield(future)
+
+    async def get(self):
+        """پیام بعدی را برمی‌گرداند: (entry_id, item)."""
+        while not self._ready:
+            self._ready_event.clear()
+            await self._ready_event.wait()
+        entry_id, item = self._ready.popleft()
+        self._claims.append((int(time.time()), entry_id))
+        if self._spilled and len(self._ready) < self.front_buffer_size // 2:
+            self._flush_event.set()
+        return entry_id, item
+
+    def retry(self, entry_id):
+        """یک تلاش ناموفق ارسال را برای این پیام ثبت می‌کند."""
+        self._retries.append(entry_id)
+
+    def ack(self, entry_id):
+        """پیام تحویل شده است و از صف حذف می‌شود."""
+        self._acks.append(entry_id)
+        self._size -= 1
+
+    def is_replayed(self, entry_id):
+        """آیا این پیام پیش از شروع این اجرا در صف بوده (بازپخش پس از ری‌استارت)؟"""
+        return entry_id <= self._replayed_max_id
+
+    def deadline_created_at(self, entry_id, received_at):
+        """
+        زمان مبنای مهلت ارسال یک پیام: همان زمان دریافت اصلی؛ پیام بازپخش‌شده فقط replay_grace ثانیه
+        مهلت اضافه می‌گیرد، پس پس از قطعی طولانی پست‌های کهنه همچنان منقضی می‌شوند.
+        """
+        if received_at is None or not self.is_replayed(entry_id):
+            return received_at
+        return received_at + self.replay_grace
+
+    def dead_letter(self, entry_id):
+        """پیامی که پردازش آن ممکن نیست از صف خارج و با وضعیت dead روی دیسک نگه داشته می‌شود."""
+        self._dead.append(entry_id)
+        self._size -= 1
+        self.dead_lettered += 1
+        logger.error(f"Outbox entry {entry_id} dead-lettered (total: {self.dead_lettered})")
+
+    def _push_ready(self, entry_id, item):
+        self._ready.append((entry_id, item))
+        self._high_id = max(self._high_id, entry_id)
+        self._ready_event.set()
+
+    async def replay(self):
+        """پیام‌های باقی‌مانده از اجرای قبلی را بارگیری می‌کند (در شروع برنامه)."""
+        recovered = await outbox_recover(self.max_attempts)
+        if recovered:
+            requeued, dead = recovered
+            if requeued:
+                logger.warning(f"Outbox replay: {requeued} message(s) were in flight at shutdown and will be retried")
+            if dead:
+                self.dead_lettered += dead
+                logger.error(f"Outbox replay: {dead} message(s) reached {self.max_attempts} attempts and were dead-lettered")
+        self._size += await outbox_count() or 0
+        self._replayed_max_id = await outbox_max_id() or 0
+        await self._refill()
+        if self._size:
+            logger.info(f"Outbox replay: {self._size} undelivered messages found on disk")
+
+    async def _refill(self):
+        room = self.front_buffer_size - len(self._ready)
+        if room <= 0:
+            return
+        rows = await outbox_load(self._high_id, room)
+        for entry_id, payload, attempts in rows:
+            if attempts >= self.max_attempts:
+                self._high_id = max(self._high_id, entry_id)
+                self.dead_letter(entry_id)
+                continue
+            try:
+                item = json.loads(payload)
+            except ValueError as e:
+                logger.error(f"Outbox entry {entry_id} has an unreadable payload: {e}")
+                self._high_id = max(self._high_id, entry_id)
+                self.dead_letter(entry_id)
+                continue
+            self._push_ready(entry_id, item)
+        # اگر به اندازه جای خالی ردیف آمد، احتمالاً هنوز ردیف دیگری روی دیسک هست
+        self._spilled = len(rows) >= room
+
+    async def flush(self):
+        """تغییرات معوق را در یک تراکنش ذخیره و بافر جلویی را پر می‌کند."""
+        async with self._flush_lock:
+            inserts, claims, retries, acks, dead = self._inserts, self._claims, self._retries, self._acks, self._dead
+            if inserts or claims or retries or acks or dead:
+                self._inserts, self._claims, self._retries, self._acks, self._dead = [], [], [], [], []
+                new_ids = await outbox_write_batch(
+                    [(json.dumps(item, ensure_ascii=False), created_at) for item, created_at, _ in inserts],
+                    claims, retries, acks, dead
+                )
+                if new_ids is None:
+                    # همه چیز برای دور بعد برمی‌گردد؛ put()های منتظر تا ذخیره موفق منتظر می‌مانند
+                    self._inserts[:0] = inserts
+                    self._claims[:0] = claims
+                    self._retries[:0] = retries
+                    self._acks[:0] = acks
+                    self._dead[:0] = dead
+                    return
+                for entry_id, (item, _, future) in zip(new_ids, inserts):
+                    if not future.done():
+                        future.set_result(entry_id)
+                    if self._spilled or len(self._ready) >= self.front_buffer_size:
+                        self._spilled = True
+                    else:
+                        self._push_ready(entry_id, item)
+                if inserts:
+                    logger.debug(f"Outbox flushed: {len(inserts)} inserts, {len(claims)} claims, {len(acks)} acks")
+
+            if self._spilled and len(self._ready) < self.front_buffer_size // 2:
+                await self._refill()
+
+    async def run(self):
+        """وظیفه پس‌زمینه ذخیره دسته‌ای."""
+        logger.info("Outbox flush task started.")
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_event.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in outbox flush loop: {e}\n{traceback.format_exc()}")
+                await asyncio.sleep(1)
+
+    async def start(self):
+        await self.replay()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self):
+        """وظیفه پس‌زمینه را متوقف و تغییرات باقی‌مانده را ذخیره می‌کند."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        logger.info(f"Outbox closed with {self._size} undelivered messages kept on disk.")
@@ -1,24 +1,42 @@
 # parser.py
 import re
+import html
 import logging
-from telethon.tl.types import MessageEntityTextUrl
+from telethon.tl.types import (
+    MessageEntityTextUrl, MessageEntityMentionName, MessageEntityBold, MessageEntityItalic,
+    MessageEntityUnderline, MessageEntityStrike, MessageEntitySpoiler, MessageEntityCode,
+    MessageEntityPre, MessageEntityBlockquote
+)
 import traceback
+from telethon.tl import types as tl_types
+from render import render_post_text
 
 # لاگر حرفه‌ای مخصوص این ماژول
 logger = logging.getLogger(__name__)
 
 
+# --- الگوهای از پیش کامپایل‌شده ---
+
+_TOKEN_ADDRESS_RE = re.compile(r'^(0x[a-fA-F0-9]{40})$')
+_TOKEN_NAME_RE = re.compile(r'┌([^\(]+)\s*\(([^\)]+)\)\s*\((https://[^\)]+)\)')
+_TOKEN_NAME_NO_LINK_RE = re.compile(r'┌([^\(]+)\s*\(([^\)]+)\)')
+_USD_RE = re.compile(r'\$([\d\.]+)')
+_MC_VOL_RE = re.compile(r'\$([\d\.KMB]+)')
+_HOLDER_RE = re.compile(r'Top 10:\s*([🟡🟢])\s*(\d+%)')
+_TH_RE = re.compile(r'([\d\.]+\%?)\s*\((https://[^\)]+)\)')
+_CHART_RE = re.compile(r'(https://mevx\.io/[^\s]+)')
+
 
 def _parse_token_name(line):
     """
     '┌JUDICA (JUDICA) (https://...)' را تجزیه می‌کند
     [اصلاح شده] اکنون URL را نیز برمی‌گرداند.
     """
-    match = re.search(r'┌([^\(]+)\s*\(([^\)]+)\)\s*\((https://[^\)]+)\)', line)
+    match = _TOKEN_NAME_RE.search(line)
     if match:
         return match.group(1).strip(), match.group(2).strip(), match.group(3)
     
-    match_no_link = re.search(r'┌([^\(]+)\s*\(([^\)]+)\)', line)
+    match_no_link = _TOKEN_NAME_NO_LINK_RE.search(line)
     if match_no_link:
         return match_no_link.group(1).strip(), match_no_link.group(2).strip(), None
         
@@ -26,12 +44,12 @@ def _parse_token_name(line):
 
 def _parse_usd(line):
     """ '├USD: $0.0002268' را تجزیه می‌کند """
-    match = re.search(r'\$([\d\.]+)', line)
+    match = _USD_RE.search(line)
     return match.group(1) if match else 'N/A'
 
 def _parse_mc_vol(line):
     """ '├MC: $226.8K' یا '├Vol: $88.2K' را تجزیه می‌کند """
-    match = re.search(r'\$([\d\.KMB]+)', line)
+    match = _MC_VOL_RE.search(line)
     return match.group(1) if match else 'N/A'
 
 def _parse_simple_text(line, prefix):
@@ -46,7 +64,7 @@ def _parse_emoji_status(line):
 
 def _parse_holder(line):
     """ '├Holder: Top 10: 🟡 55%' را تجزیه می‌کند """
-    match = re.search(r'Top 10:\s*([🟡🟢])\s*(\d+%)', line)
+    match = _HOLDER_RE.search(line)
     if match:
         return match.group(1), match.group(2)
     return 'N/A', 'N/A'
@@ -55,20 +73,96 @@ def _parse_th(line):
     """
     [فال‌بک] '└TH: 13.3% (https://...)| 6.3% ...' را با Regex تجزیه می‌کند
     """
-    pairs = re.findall(r'([\d\.]+\%?)\s*\((https://[^\)]+)\)', line)
+    pairs = _TH_RE.findall(line)
     return pairs[:10]
 
 def _parse_chart(line):
     """ '📈 Chart: https://mevx.io/...' را تجزیه می‌کند """
-    match = re.search(r'(https://mevx\.io/[^\s]+)', line)
+    match = _CHART_RE.search(line)
     return match.group(1) if match else None
 
+def _simple_text_parser(prefix):
+    return lambda line: _parse_simple_text(line, prefix)
+
+# --- جدول dispatch بر اساس پیشوند خط ---
+# کلید: پیشوند خط، مقدار: (فیلدهای خروجی، تابع تجزیه). خط‌های └TH: و 🔥 جداگانه مدیریت می‌شوند.
+
+TH_PREFIX = '└TH:'
+X_INFO_PREFIX = '🔥'
+CHART_PREFIX = '📈 Chart:'
+
+_LINE_PARSERS = {
+    '┌': (('token_name', 'token_symbol', 'token_url'), _parse_token_name),
+    '├USD:': (('usd',), _parse_usd),
+    '├MC:': (('mc',), _parse_mc_vol),
+    '├Vol:': (('vol',), _parse_mc_vol),
+    '├Seen:': (('seen',), _simple_text_parser('├Seen:')),
+    '├Dex:': (('dex',), _simple_text_parser('├Dex:')),
+    '├Dex Paid:': (('dex_paid',), _parse_emoji_status),
+    '├CA Verified:': (('ca_verified',), _parse_emoji_status),
+    '├Honeypot:': (('honeypot',), _simple_text_parser('├Honeypot:')),
+    '├Holder:': (('holder_color', 'holder_percentage'), _parse_holder),
+    CHART_PREFIX: (('chart_url',), _parse_chart),
+}
+
+def _line_key(line):
+    """
+    کلید dispatch خط را با یک نگاه به کاراکتر اول پیدا می‌کند.
+    همه پیشوندهای ├/└ به اولین ':' ختم می‌شوند، پس کلید تا همان ':' است.
+    """
+    head = line[0]
+    if head == '├' or head == '└':
+        colon = line.find(':')
+        return line[:colon + 1] if colon != -1 else None
+    if head == '📈':
+        return CHART_PREFIX if line.startswith(CHART_PREFIX) else None
+    return head
+
+# --- نگاشت offset به واحدهای UTF-16 ---
+# تلگرام offset و length را بر حسب واحدهای UTF-16 می‌شمارد، نه code point پایتون؛
+# هر ایموجی خارج از BMP دو واحد حساب می‌شود.
+
+def _utf16_len(text):
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+def _utf16_slice(encoded_line, start, length):
+    """ برش [start, start+length) از متن کدشده با utf-16-le (بر حسب واحد UTF-16) """
+    return encoded_line[2 * start : 2 * (start + length)].decode('utf-16-le', errors='ignore')
+
+def _entities_in_range(entities, index, range_start, range_end):
+    """
+    entityهای مرتب‌شده‌ای را که offsetشان در [range_start, range_end) است برمی‌گرداند.
+    اشاره‌گر index فقط جلو می‌رود، پس کل پیمایش پیام O(n + e) است.
+    خروجی: (entityهای این بازه, اندیس بعدی)
+    """
+    count = len(entities)
+    while index < count and entities[index].offset < range_start:
+        index += 1
+    end = index
+    while end < count and entities[end].offset < range_end:
+        end += 1
+    return entities[index:end], end
+
+def _th_entity_pairs(line, content_start_offset, line_entities):
+    """ جفت‌های (درصد, لینک) خط └TH: را از هایپرلینک‌های همان خط استخراج می‌کند """
+    encoded_line = line.encode('utf-16-le')
+    pairs = []
+    for entity in line_entities:
+        entity_text = _utf16_slice(encoded_line, entity.offset - content_start_offset, entity.length)
+        pairs.append((entity_text, entity.url))
+    return pairs
+
 # --- تابع اصلی تجزیه‌کننده (بازنویسی شده) ---
 
 def transform_message(message_text, message_entities):
     """
     پیام خام ورودی را تجزیه می‌کند، با اولویت‌دهی به 
     هایپرلینک‌ها (Entities) و استفاده از Regex به عنوان فال‌بک.
+    هر خط یک بار با جدول dispatch پیشوندها پردازش می‌شود.
+    خروجی: (new_message, new_entities, chart_url, th_pairs, token_address, market_cap)؛
+    market_cap مقدار عددی خط ├MC: برای اولویت‌بندی ارسال است (یا None).
     """
     logger.debug(f"Starting transformation with entity support...")
     
@@ -81,65 +175,54 @@ def transform_message(message_text, message_entities):
 
         if not lines or not lines[0].startswith("🥞"):
             logger.warning("Message does not start with 🥞 trigger. Skipping.")
-            return None, None, None, None, None
+            return None, None, None, None, None, None
         
         data['token_address'] = lines[0].replace('🥞', '').strip()
-        if not re.match(r'^(0x[a-fA-F0-9]{40})$', data['token_address']):
+        if not _TOKEN_ADDRESS_RE.match(data['token_address']):
              logger.warning(f"Failed to parse Token Address: {lines[0]}")
              data['token_address'] = 'Error'
 
+        # فیلتر و مرتب‌سازی entityها فقط یک بار برای کل پیام
+        text_url_entities = sorted(
+            (e for e in message_entities or () if isinstance(e, MessageEntityTextUrl)),
+            key=lambda e: e.offset
+        )
+        entity_index = 0
+        # offset شروع خط جاری بر حسب UTF-16 هنگام تقسیم خطوط محاسبه می‌شود (بدون جستجوی دوباره در متن)
+        line_utf16_offset = _utf16_len(lines[0]) + 1
+
         for unstripped_line in lines[1:]:
+            line_start_offset = line_utf16_offset
+            line_utf16_offset += _utf16_len(unstripped_line) + 1
             line = unstripped_line.strip()
             if not line:
                 continue
 
             try:
-                if line.startswith('┌'):
-                    data['token_name'], data['token_symbol'], data['token_url'] = _parse_token_name(line)
-                elif line.startswith('├USD:'):
-                    data['usd'] = _parse_usd(line)
-                elif line.startswith('├MC:'):
-                    data['mc'] = _parse_mc_vol(line)
-                elif line.startswith('├Vol:'):
-                    data['vol'] = _parse_mc_vol(line)
-                elif line.startswith('├Seen:'):
-                    data['seen'] = _parse_simple_text(line, '├Seen:')
-                elif line.startswith('├Dex:'):
-                    data['dex'] = _parse_simple_text(line, '├Dex:')
-                elif line.startswith('├Dex Paid:'):
-                    data['dex_paid'] = _parse_emoji_status(line)
-                elif line.startswith('├CA Verified:'):
-                    data['ca_verified'] = _parse_emoji_status(line)
-                elif line.startswith('├Honeypot:'):
-                    data['honeypot'] = _parse_simple_text(line, '├Honeypot:')
-                elif line.startswith('├Holder:'):
-                    data['holder_color'], data['holder_percentage'] = _parse_holder(line)
-                
-                # --- شروع منطق بازنویسی شده برای └TH: ---
-                elif line.startswith('└TH:'):
+                key = _line_key(line)
+                parser_entry = _LINE_PARSERS.get(key)
+                if parser_entry is not None:
+                    fields, parse = parser_entry
+                    result = parse(line)
+                    if len(fields) == 1:
+                        data[fields[0]] = result
+                    else:
+                        data.update(zip(fields, result))
+
+                elif key == TH_PREFIX:
                     try:
-                        line_start_offset = message_text.find(unstripped_line)
-                        if line_start_offset == -1:
-                            logger.warning(f"Could not find offset for TH line: '{unstripped_line}'. Using regex fallback.")
-                            th_values = _parse_th(line)
-                            continue
-
-                        content_start_offset = line_start_offset + (len(unstripped_line) - len(unstripped_line.lstrip()))
-                        content_end_offset = content_start_offset + len(line)
-
-                        logger.debug(f"Found TH line. Parsing entities in message range {content_start_offset}-{content_end_offset}")
-                        
-                        found_entities = False
-                        if message_entities:
-                            for entity in message_entities:
-                                if isinstance(entity, MessageEntityTextUrl):
-                                    if content_start_offset <= entity.offset < content_end_offset:
-                                        entity_text = message_text[entity.offset : entity.offset + entity.length]
-                                        th_values.append((entity_text, entity.url))
-                                        found_entities = True
-                        
-                        if found_entities:
-                             logger.debug(f"Extracted {len(th_values)} TH pairs from entities.")
+                        leading = unstripped_line[:len(unstripped_line) - len(unstripped_line.lstrip())]
+                        content_start_offset = line_start_offset + _utf16_len(leading)
+                        content_end_offset = content_start_offset + _utf16_len(line)
+                        logger.debug(f"Found TH line. Parsing entities in UTF-16 range {content_start_offset}-{content_end_offset}")
+
+                        line_entities, entity_index = _entities_in_range(
+                            text_url_entities, entity_index, content_start_offset, content_end_offset
+                        )
+                        pairs = _th_entity_pairs(line, content_start_offset, line_entities)
+                        if pairs:
+                            th_values.extend(pairs)
+                            logger.debug(f"Extracted {len(th_values)} TH pairs from entities.")
                         else:
                             logger.debug("No entities found for TH line. Trying regex fallback.")
                             th_values = _parse_th(line)
@@ -147,107 +230,155 @@ def transform_message(message_text, message_entities):
                                 logger.debug(f"Extracted {len(th_values)} TH pairs using regex fallback.")
                             else:
                                 logger.warning("Could not parse TH from entities or regex fallback.")
-                                
                     except Exception as e:
                         logger.error(f"Error parsing TH entities: {e}\n{traceback.format_exc()}")
                         th_values = []
-                # --- پایان منطق بازنویسی شده ---
-                
-                elif line.startswith('📈 Chart:'):
-                    data['chart_url'] = _parse_chart(line)
-                elif line.startswith('🔥'):
+
+                elif key == X_INFO_PREFIX:
                     x_info = line
             
             except Exception as e:
                 logger.warning(f"Failed to parse line: '{line}'. Error: {e}")
 
         token_address = data.get('token_address', 'N/A')
-        token_name = data.get('token_name', 'N/A')
-        token_symbol = data.get('token_symbol', '?')
-        token_url = data.get('token_url', '#')
-        
-        if token_url != '#':
-            token_line = f"<a href='{token_url}'>{token_name}</a> ({token_symbol})"
-        else:
-            token_line = f"{token_name} ({token_symbol})"
-
-        th_links = []
-        if th_values:
-            for percent, url in th_values:
-                th_links.append(f"<a href='{url}'>{percent}</a>")
-            th_text = " | ".join(th_links)
-        else:
-            th_text = "N/A"
-        
-        usd = data.get('usd', '?')
-        mc = data.get('mc', '?')
-        vol = data.get('vol', '?')
-        seen = data.get('seen', '?')
-        dex = data.get('dex', '?')
-        dex_paid = data.get('dex_paid', '?')
-        ca_verified = data.get('ca_verified', '?')
-        honeypot = data.get('honeypot', '?')
-        holder_color = data.get('holder_color', '?')
-        holder_percentage = data.get('holder_percentage', '?')
         chart_url = data.get('chart_url')
-
-        new_message = (
-            f"⚡️ <code>{token_address}</code>\n"
-            f"• {token_line}\n"
-            f"• قیمت:      ${usd}\n"
-            f"• مارکت‌کپ:     ${mc}\n"
-            f"• حجم:      ${vol}\n"
-            f"• ساخته شده:      {seen}\n"
-            f"• نقدینگی:      {dex}\n"
-            f"• دکس پرداخت شده؟: {dex_paid}\n"
-            f"• قرارداد تایید شده؟: {ca_verified}\n"
-            f"• هانی‌پات: {honeypot}\n"
-            f"• هولدرها:     Top 10: {holder_color} {holder_percentage}\n"
-            f"• تاپ هولدر:      {th_text}"
-        )
-
-        if x_info:
-            new_message += f"\n\n{x_info.strip()}"
-
-        if len(new_message) > 4096:
-            logger.error(f"Transformed message too long: {len(new_message)} characters. Truncating.")
-            new_message = new_message[:4090] + "..."
+        new_message = render_post_text(data, th_values, x_info)
 
         new_entities = []
         th_pairs = th_values
+        market_cap = market_cap_value(data.get('mc'))
 
         logger.info(f"Message successfully parsed (entity-aware): {token_address}")
         
-        return new_message, new_entities, chart_url, th_pairs, token_address
+        return new_message, new_entities, chart_url, th_pairs, token_address, market_cap
 
     except Exception as e:
         logger.critical(f"CRITICAL error in transform_message: {e}\n{traceback.format_exc()}")
         logger.error(f"--- FAILED MESSAGE (CRITICAL) ---\n{message_text}\n--- END ---")
-        return None, None, None, None, None
-
+        return None, None, None, None, None, None
+
+
+# --- تبدیل entityها به HTML ---
+
+_SIMPLE_ENTITY_TAGS = {
+    MessageEntityBold: ('<b>', '</b>'),
+    MessageEntityItalic: ('<i>', '</i>'),
+    MessageEntityUnderline: ('<u>', '</u>'),
+    MessageEntityStrike: ('<s>', '</s>'),
+    MessageEntitySpoiler: ('<tg-spoiler>', '</tg-spoiler>'),
+    MessageEntityCode: ('<code>', '</code>'),
+    MessageEntityBlockquote: ('<blockquote>', '</blockquote>'),
+}
+
+def _entity_tags(entity):
+    """ تگ‌های باز و بسته HTML یک entity؛ برای انواع پشتیبانی‌نشده None """
+    tags = _SIMPLE_ENTITY_TAGS.get(type(entity))
+    if tags is not None:
+        return tags
+    if isinstance(entity, MessageEntityTextUrl):
+        return f'<a href="{html.escape(entity.url)}">', '</a>'
+    if isinstance(entity, MessageEntityMentionName):
+        return f'<a href="tg://user?id={entity.user_id}">', '</a>'
+    if isinstance(entity, MessageEntityPre):
+        if entity.language:
+            return f'<pre><code class="language-{html.escape(entity.language)}">', '</code></pre>'
+        return '<pre>', '</pre>'
+    return None
 
 def entities_to_html(entities, text):
     """
-    (بدون تغییر)
+    متن ساده تلگرام و entityهای آن را در یک پیمایش به HTML تبدیل می‌کند.
+    offsetها بر حسب UTF-16 تفسیر می‌شوند، متن escape می‌شود و entityهای تو در تو
+    یا هم‌پوشان با بستن و بازکردن دوباره تگ‌ها به HTML معتبر تبدیل می‌شوند.
+    بدون entity، متن دست‌نخورده برمی‌گردد (پیام‌های transform_message از قبل HTML هستند).
     """
     if not entities:
         return text, "HTML"
 
-    html_text = text
-    offset_adjustment = 0
-
-    for entity in sorted(entities, key=lambda e: e.offset):
-        start = entity.offset + offset_adjustment
-        end = start + entity.length
-        entity_text = html_text[start:end]
-
-        if isinstance(entity, MessageEntityTextUrl):
-            html_entity = f'<a href="{entity.url}">{entity_text}</a>'
-            html_text = html_text[:start] + html_entity + html_text[end:]
-            offset_adjustment += len(html_entity) - len(entity_text)
-
-    return html_text, "HTML"
-
-
-
-
+    encoded = text.encode('utf-16-le')
+    text_length = len(encoded) // 2
+
+    # (start, end, open_tag, close_tag) برای entityهای معتبر
+    spans = []
+    for entity in entities:
+        tags = _entity_tags(entity)
+        start = max(0, entity.offset)
+        end = min(text_length, entity.offset + entity.length)
+        if tags is None or start >= end:
+            continue
+        spans.append((start, end, tags[0], tags[1]))
+
+    # در هر نقطه، entity بیرونی (طولانی‌تر) زودتر باز می‌شود
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    boundaries = sorted({0, text_length}.union(*((span[0], span[1]) for span in spans)))
+
+    parts = []
+    stack = []  # spanهای باز به ترتیب باز شدن
+    span_index = 0
+    span_count = len(spans)
+
+    for position, next_position in zip(boundaries, boundaries[1:] + [None]):
+        # بستن entityهایی که در این نقطه تمام می‌شوند؛ entityهای داخلی‌تر که هنوز
+        # ادامه دارند موقتاً بسته و دوباره باز می‌شوند تا تگ‌ها درست تو در تو بمانند
+        ending = sum(1 for span in stack if span[1] == position)
+        reopen = []
+        while ending:
+            span = stack.pop()
+            parts.append(span[3])
+            if span[1] == position:
+                ending -= 1
+            else:
+                reopen.append(span)
+        for span in reversed(reopen):
+            parts.append(span[2])
+            stack.append(span)
+
+        while span_index < span_count and spans[span_index][0] == position:
+            span = spans[span_index]
+            parts.append(span[2])
+            stack.append(span)
+            span_index += 1
+
+        if next_position is not None and next_position > position:
+            segment = encoded[2 * position : 2 * next_position].decode('utf-16-le', errors='ignore')
+            parts.append(html.escape(segment, quote=False))
+
+    return ''.join(parts), "HTML"
+
+
+# --- مقدار عددی مارکت‌کپ برای اولویت‌بندی ارسال ---
+
+_MC_SUFFIXES = {'K': 1e3, 'M': 1e6, 'B': 1e9}
+
+def market_cap_value(mc_text):
+    """ '226.8K' را به 226800.0 تبدیل می‌کند؛ برای مقدار نامعتبر None """
+    if not mc_text:
+        return None
+    multiplier = _MC_SUFFIXES.get(mc_text[-1].upper(), 1)
+    number = mc_text[:-1] if multiplier != 1 else mc_text
+    try:
+        return float(number) * multiplier
+    except ValueError:
+        return None
+
+
+# --- سریال‌سازی entityها برای ذخیره در DB یا فایل ---
+
+def serialize_entities(entities):
+    """ entityهای تلتون را به لیست dictهای قابل JSON تبدیل می‌کند """
+    serialized = []
+    for entity in entities or ():
+        data = entity.to_dict()
+        serialized.append({key: value for key, value in data.items() if value is not None})
+    return serialized
+
+def deserialize_entities(serialized):
+    """ عکس serialize_entities؛ انواع ناشناخته نادیده گرفته می‌شوند """
+    entities = []
+    for data in serialized or ():
+        entity_class = getattr(tl_types, data.get('_', ''), None)
+        if entity_class is None:
+            logger.warning(f"Unknown entity type in serialized data: {data.get('_')}")
+            continue
+        entities.append(entity_class(**{key: value for key, value in data.items() if key != '_'}))
+    return entities
@@ -0,0 +1,142 @@
+# pipeline.py
+import asyncio
+import logging
+import random
+import traceback
+from telethon.errors import (
+    ChatWriteForbiddenError, UserIsBlockedError, ChannelInvalidError,
+    ChannelPrivateError, MessageTooLongError
+)
+from telegram.error import BadRequest, RetryAfter
+from scheduler import SendScheduler
+from utils import retry_after_seconds
+from metrics import messages_sent, messages_send_failed, send_retries, limiter_wait_seconds
+from tracing import tracer, mark
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+# خطاهایی که تلاش مجدد برایشان بی‌فایده است (دسترسی یا محتوا)
+NON_RETRYABLE_ERRORS = (
+    ChatWriteForbiddenError, UserIsBlockedError, ChannelInvalidError,
+    ChannelPrivateError, BadRequest, MessageTooLongError
+)
+
+# سقف توقف‌های flood برای یک job؛ این توقف‌ها جزو تلاش‌های retry حساب نمی‌شوند
+MAX_FLOOD_WAITS_PER_JOB = 5
+
+
+class DeliveryJob:
+    """یک پیام آماده ارسال به یک مقصد مشخص."""
+
+    __slots__ = (
+        "message", "entities", "chart_url", "th_pairs", "token_address", "chat_id",
+        "on_complete", "on_retry", "created_at", "market_cap", "trace"
+    )
+
+    def __init__(self, message, entities, chart_url, th_pairs, token_address, chat_id, on_complete=None, on_retry=None,
+                 created_at=None, market_cap=None, trace=None):
+        self.message = message
+        self.entities = entities
+        self.chart_url = chart_url
+        self.th_pairs = th_pairs
+        self.token_address = token_address
+        self.chat_id = chat_id
+        self.on_complete = on_complete  # coroutine function(job, success)
+        self.on_retry = on_retry  # function(job)، پس از هر تلاش ناموفق قابل تکرار
+        self.created_at = created_at  # زمان دریافت پست از منبع (ثانیه یونیکس)
+        self.market_cap = market_cap  # برای اولویت‌بندی در صف ارسال
+        self.trace = trace  # زمان مراحل مسیر پیام (tracing.STAGES)
+
+
+class DestinationSender:
+    """
+    کارگر ارسال مستقل برای یک مقصد: صف، حلقه retry و محدودیت نرخ خودش را دارد،
+    پس کند یا خراب بودن یک مقصد تأخیری به مقصد دیگر اضافه نمی‌کند.
+    """
+
+    def __init__(self, name, send_func, rate_limiter, retry_attempts, retry_delay_base,
+                 send_delay_seconds=0, send_delay_jitter=0, scheduler=None):
+        self.name = name
+        self.send_func = send_func
+        self.rate_limiter = rate_limiter
+        self.retry_attempts = retry_attempts
+        self.retry_delay_base = retry_delay_base
+        self.send_delay_seconds = send_delay_seconds
+        self.send_delay_jitter = send_delay_jitter
+        self.queue = scheduler or SendScheduler(name)
+        self.sent = 0
+        self.failed = 0
+
+    def submit(self, job):
+        self.queue.put_nowait(job)
+
+    async def run(self, bot):
+        """حلقه اصلی کارگر این مقصد."""
+        logger.info(f"{self.name} sender worker started.")
+        while True:
+            job = await self.queue.get()
+            try:
+                success = await self._deliver(bot, job)
+                if job.on_complete is not None:
+                    await job.on_complete(job, success)
+            except asyncio.CancelledError:
+                logger.info(f"{self.name} sender worker cancelled.")
+                raise
+            except Exception as e:
+                logger.critical(f"CRITICAL ERROR in {self.name} sender worker: {e}\n{traceback.format_exc()}")
+                await asyncio.sleep(10)  # جلوگیری از لوپ خطای سریع
+
+    async def _deliver(self, bot, job):
+        attempts = 0
+        flood_waits = 0
+        while attempts < self.retry_attempts:
+            try:
+                # تأخیر ثابت کوچک؛ سرعت واقعی ارسال را سطل توکن تعیین می‌کند، نه طول صف
+                delay = self.send_delay_seconds + random.uniform(0, self.send_delay_jitter)
+                logger.debug(f"{self.name}: applying send delay: {delay:.2f}s")
+                await asyncio.sleep(delay)
+                # سطل توکن دقیقاً به اندازه لازم صبر می‌کند
+                wait = await self.rate_limiter.acquire(job.chat_id)
+                limiter_wait_seconds.observe(wait, channel=self.name)
+                mark(job.trace, "paced")
+
+                message_id = await self.send_func(
+                    bot, job.message, job.entities, job.chart_url, job.th_pairs,
+                    job.chat_id, job.token_address, channel_name=self.name
+                )
+                self.sent += 1
+                messages_sent.inc(channel=self.name)
+                mark(job.trace, "sent")
+                tracer.finish(job.trace, self.name, attempts)
+                logger.info(f"Message sent to {self.name} channel ({job.chat_id}), MsgID: {message_id}")
+                return True
+
+            # خطاهای غیرقابل تلاش مجدد
+            except NON_RETRYABLE_ERRORS as e:
+                logger.error(f"NON-RETRYABLE error sending to {self.name} channel ({job.chat_id}). Skipping message. Error: {e}")
+                break
+
+            # flood: چت دقیقاً به اندازه درخواست سرور متوقف می‌شود و تلاشی مصرف نمی‌شود
+            except RetryAfter as e:
+                flood_waits += 1
+                self.rate_limiter.on_flood(job.chat_id, retry_after_seconds(e))
+                if flood_waits > MAX_FLOOD_WAITS_PER_JOB:
+                    logger.error(f"{self.name}: too many flood waits for channel ({job.chat_id}). Giving up on message.")
+                    break
+                logger.warning(f"{self.name}: flood control from server ({e}); waiting without using a retry attempt")
+
+            # خطاهای قابل تلاش مجدد
+            except Exception as e:
+                attempts += 1
+                send_retries.inc(channel=self.name)
+                if job.on_retry is not None:
+                    job.on_retry(job)
+                wait_time = self.retry_delay_base * attempts + random.uniform(0, 5)
+                logger.warning(f"Retrying {self.name} channel send attempt {attempts}/{self.retry_attempts} after {wait_time:.2f}s due to: {e}")
+                await asyncio.sleep(wait_time)
+
+        self.failed += 1
+        messages_send_failed.inc(channel=self.name)
+        logger.error(f"Failed to send message to {self.name} channel ({job.chat_id}). Message discarded: {job.message[:50]}...")
+        return False
@@ -0,0 +1,99 @@
+# render.py
+import logging
+from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+# --- قالب متن پست ---
+# قالب متن در یک جا تعریف شده تا render_post_text فقط مقادیر فیلدها را آماده کند.
+
+
+def _post_template(token_address, token_line, usd, mc, vol, seen, dex, dex_paid, ca_verified,
+                   honeypot, holder_color, holder_percentage, th_text):
+    return (
+        f"⚡️ <code>{token_address}</code>\n"
+        f"• {token_line}\n"
+        f"• قیمت:      ${usd}\n"
+        f"• مارکت‌کپ:     ${mc}\n"
+        f"• حجم:      ${vol}\n"
+        f"• ساخته شده:      {seen}\n"
+        f"• نقدینگی:      {dex}\n"
+        f"• دکس پرداخت شده؟: {dex_paid}\n"
+        f"• قرارداد تایید شده؟: {ca_verified}\n"
+        f"• هانی‌پات: {honeypot}\n"
+        f"• هولدرها:     Top 10: {holder_color} {holder_percentage}\n"
+        f"• تاپ هولدر:      {th_text}"
+    )
+
+
+def render_post_text(data, th_values, x_info=None):
+    """متن HTML پست را از فیلدهای تجزیه‌شده با _post_template تولید می‌کند."""
+    get = data.get
+    token_name = get('token_name', 'N/A')
+    token_symbol = get('token_symbol', '?')
+    token_url = get('token_url', '#')
+    if token_url != '#':
+        token_line = f"<a href='{token_url}'>{token_name}</a> ({token_symbol})"
+    else:
+        token_line = f"{token_name} ({token_symbol})"
+
+    if th_values:
+        th_text = " | ".join([f"<a href='{url}'>{percent}</a>" for percent, url in th_values])
+    else:
+        th_text = "N/A"
+
+    text = _post_template(
+        get('token_address', 'N/A'), token_line, get('usd', '?'), get('mc', '?'), get('vol', '?'),
+        get('seen', '?'), get('dex', '?'), get('dex_paid', '?'), get('ca_verified', '?'),
+        get('honeypot', '?'), get('holder_color', '?'), get('holder_percentage', '?'), th_text
+    )
+    if x_info:
+        text += f"\n\n{x_info.strip()}"
+
+    if len(text) > MAX_MESSAGE_LENGTH:
+        logger.error(f"Transformed message too long: {len(text)} characters. Truncating.")
+        text = text[:MAX_MESSAGE_LENGTH - 6] + "..."
+    return text
+
+
+# --- کیبورد پست: ردیف‌های ثابت یک بار ساخته و بین همه پیام‌ها به اشتراک گذاشته می‌شوند ---
+# دکمه‌های PTB پس از ساخت تغییرناپذیرند، پس اشتراک یک نمونه امن است.
+
+
+@lru_cache(maxsize=1)
+def _static_rows():
+    # config در اولین ساخت کیبورد خوانده می‌شود تا parser و بنچمارک‌ها بدون config.py قابل import باشند
+    from config import GIFT, AXIOM_LINK, SUPPORT_LINK
+    gift_row = (InlineKeyboardButton("💰 ترید کن سولانا هدیه بگیر", url=GIFT),)
+    links_row = (
+        InlineKeyboardButton("📚 آموزش آکسیوم", url=AXIOM_LINK),
+        InlineKeyboardButton("❓ سوالتون اینجا بپرسید", url=SUPPORT_LINK),
+    )
+    return gift_row, links_row
+
+
+@lru_cache(maxsize=1024)
+def _token_rows(token_address):
+    return (
+        (InlineKeyboardButton("📈 مشاهده نمودار (Dex)", url=f"https://dexscreener.com/bsc/{token_address}"),),
+        (InlineKeyboardButton("🔍 بررسی در اکسیوم (Axiom)", url=f"https://axiom.app/contract/{token_address}"),),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _vote_row(green_votes, red_votes):
+    return (
+        InlineKeyboardButton(f"🟢 ({green_votes})", callback_data="vote_green"),
+        InlineKeyboardButton(f"🔴 ({red_votes})", callback_data="vote_red"),
+    )
+
+
+def build_post_keyboard(token_address, green_votes=0, red_votes=0):
+    """کیبورد شیشه‌ای پست توکن را با شمارش رای‌ها می‌سازد (مشترک بین ارسال و رای‌گیری)."""
+    dex_row, axiom_row = _token_rows(token_address)
+    gift_row, links_row = _static_rows()
+    return InlineKeyboardMarkup((dex_row, axiom_row, gift_row, links_row, _vote_row(green_votes, red_votes)))
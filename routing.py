@@ -0,0 +1,194 @@
+# routing.py
+import json
+import logging
+from collections import namedtuple
+from database import load_routes, sync_routes
+from dedup import TTLDeduplicator, token_content_key, text_content_key, bucketed_key
+from parser import transform_message
+from utils import MessageRateLimiter
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSER = "pancake"
+ROUTE_DEDUP_TTL_SECONDS = 60  # پیام‌های تکراری هر منبع تا 60 ثانیه رد می‌شوند (پیش‌فرض dedup_ttl_seconds)
+ROUTE_DEDUP_MAX_ENTRIES = 10000  # سقف حافظه ایندکس تکراری‌های هر منبع
+
+# کلید تکراری هر مسیر (dedup_key): آدرس توکن یا خلاصه کل متن.
+# با dedup_bucket_seconds کلید به سطل زمانی هم وابسته می‌شود تا همان محتوا در سطل بعدی دوباره پذیرفته شود.
+DEDUP_KEYS = {
+    "token": token_content_key,
+    "text": text_content_key,
+}
+DEFAULT_DEDUP_KEY = "token"
+
+# پارسر هر منبع: trigger شروع پیام‌های قابل پردازش و تابع تبدیل
+# transform(message_text, message_entities) -> (message, entities, chart_url, th_pairs, token_address, market_cap)
+ParserSpec = namedtuple("ParserSpec", ("trigger", "transform"))
+
+PARSERS = {
+    "pancake": ParserSpec("🥞", transform_message),
+}
+
+
+class Route:
+    """
+    مسیر یک کانال منبع: پارسر، مقصدها و بودجه نرخ دریافت.
+    محدودکننده دریافت و ایندکس تکراری‌ها برای هر منبع جداگانه است، پس پیام‌های یک منبع
+    ظرفیت منبع دیگر را مصرف نمی‌کنند. اولین مقصد، مقصد اصلی است (دفتر ارسال‌شده‌ها با آن به‌روز می‌شود).
+    rate_per_minute فقط دریافت را محدود می‌کند. ارسال برای هر چت مقصد با send_rate_limiter مشترک
+    (MAX_MESSAGES_PER_MINUTE) تنظیم می‌شود، چون محدودیت تلگرام برای هر چت است و چند مسیر می‌توانند
+    یک مقصد مشترک داشته باشند؛ بودجه ارسال جدا برای هر مسیر از آن محدودیت محافظت نمی‌کرد.
+    """
+
+    __slots__ = (
+        "id", "source_chat_id", "parser_name", "parser", "destinations", "rate_per_minute",
+        "use_secondary", "receive_limiter", "recent"
+    )
+
+    def __init__(self, route_id, source_chat_id, parser_name, destinations, rate_per_minute, use_secondary=False,
+                 dedup_ttl_seconds=ROUTE_DEDUP_TTL_SECONDS, dedup_key=DEFAULT_DEDUP_KEY, dedup_bucket_seconds=None):
+        if parser_name not in PARSERS:
+            raise ValueError(f"Unknown parser {parser_name!r} (available: {', '.join(PARSERS)})")
+        if not destinations:
+            raise ValueError("Route needs at least one destination")
+        if not isinstance(rate_per_minute, int) or rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be a positive integer, got {rate_per_minute!r}")
+        if dedup_key not in DEDUP_KEYS:
+            raise ValueError(f"Unknown dedup_key {dedup_key!r} (available: {', '.join(DEDUP_KEYS)})")
+        if not isinstance(dedup_ttl_seconds, (int, float)) or dedup_ttl_seconds <= 0:
+            raise ValueError(f"dedup_ttl_seconds must be a positive number, got {dedup_ttl_seconds!r}")
+        if dedup_bucket_seconds is not None and (not isinstance(dedup_bucket_seconds, int) or dedup_bucket_seconds <= 0):
+            raise ValueError(f"dedup_bucket_seconds must be a positive integer, got {dedup_bucket_seconds!r}")
+        self.id = route_id
+        self.source_chat_id = source_chat_id
+        self.parser_name = parser_name
+        self.parser = PARSERS[parser_name]
+        self.destinations = tuple(destinations)
+        self.rate_per_minute = rate_per_minute
+        self.use_secondary = bool(use_secondary)  # پنجره کانال دوم به مقصدهای این مسیر اضافه می‌شود
+        self.receive_limiter = MessageRateLimiter(rate_per_minute, name=f"receive_route_{route_id}")
+        key_func = DEDUP_KEYS[dedup_key]
+        if dedup_bucket_seconds:
+            key_func = bucketed_key(key_func, dedup_bucket_seconds)
+        self.recent = TTLDeduplicator(
+            dedup_ttl_seconds, ROUTE_DEDUP_MAX_ENTRIES, key_func=key_func, name=f"recent_route_{route_id}"
+        )
+
+
+def _route_row(spec):
+    """مشخصات مسیر از config (dict) به ردیف جدول routes."""
+    return (
+        spec["source"],
+        spec.get("parser", DEFAULT_PARSER),
+        json.dumps(list(spec["destinations"])),
+        spec["rate_per_minute"],
+        int(bool(spec.get("secondary", False))),
+        spec.get("dedup_ttl_seconds", ROUTE_DEDUP_TTL_SECONDS),
+        spec.get("dedup_key", DEFAULT_DEDUP_KEY),
+        spec.get("dedup_bucket_seconds"),
+    )
+
+
+def _log_route_changes(previous_rows, rows):
+    """تفاوت مسیرهای ذخیره‌شده در DB با config را هشدار می‌دهد تا تغییر config بی‌صدا اعمال نشود."""
+    previous = {row[1]: row[2:] for row in previous_rows}
+    current = {row[0]: row[1:] for row in rows}
+    for source_chat_id, values in current.items():
+        if source_chat_id not in previous:
+            logger.warning(f"Route for source {source_chat_id} added from config: {values}")
+        elif previous[source_chat_id] != values:
+            logger.warning(f"Route for source {source_chat_id} changed in config: {previous[source_chat_id]} -> {values}")
+    for source_chat_id in previous.keys() - current.keys():
+        logger.warning(f"Route for source {source_chat_id} removed from config; disabling it")
+
+
+class RoutingTable:
+    """
+    جدول مسیریابی منبع به مقصدها؛ ماندگار در جدول routes و کش‌شده در حافظه.
+    config (ROUTES) تنها مرجع مسیرهاست و جدول routes فقط آینه آن است: load() در هر راه‌اندازی جدول را
+    با config بازنویسی می‌کند و دستور ادمینی برای ویرایش آن وجود ندارد. جدول برای شناسه پایدار هر
+    مسیر (پیام‌های outbox پس از ری‌استارت به همان مسیر می‌رسند) و هشدار تغییرات config نگه داشته می‌شود.
+    پس از load() پیدا کردن مسیر هر رویداد فقط یک lookup در dict است (بدون دسترسی به DB).
+    """
+
+    def __init__(self):
+        self._by_source = {}  # source_chat_id -> Route
+        self._by_id = {}  # route id -> Route
+
+    async def load(self, specs, resolve=None):
+        """
+        جدول routes را با specs همگام و مسیرها را بارگیری می‌کند:
+        specs = [{"source", "destinations", "rate_per_minute", "parser"?, "secondary"?,
+                  "dedup_ttl_seconds"?, "dedup_key"?, "dedup_bucket_seconds"?}]
+        resolve: تابع async اختیاری که منبع (id یا @username) را به peer id علامت‌دار تلتون تبدیل می‌کند؛
+        کلید جدول همان مقداری است که در event.chat_id می‌آید. منبعی که resolve نشود ValueError می‌دهد.
+        """
+        specs = [dict(spec) for spec in specs]
+        if resolve is not None:
+            unresolved = []
+            for spec in specs:
+                try:
+                    peer_id = await resolve(spec["source"])
+                except (ValueError, TypeError) as e:
+                    unresolved.append(f"{spec['source']!r} ({e})")
+                    continue
+                if peer_id != spec["source"]:
+                    logger.info(f"Route source {spec['source']!r} resolved to {peer_id}")
+                spec["source"] = peer_id
+            if unresolved:
+                raise ValueError(f"Cannot resolve route source(s): {', '.join(unresolved)}")
+
+        config_rows = [_route_row(spec) for spec in specs]
+        previous_rows = await load_routes()
+        if previous_rows:
+            _log_route_changes(previous_rows, config_rows)
+        if not await sync_routes(config_rows):
+            logger.error("Could not sync routes table with config.")
+        rows = await load_routes()
+        if rows is None:
+            # بدون DB هم ربات با مسیرهای config کار می‌کند؛ شناسه‌ها به ترتیب config هستند
+            logger.error("Could not load routes from DB. Falling back to routes from config.")
+            rows = [(index, *row) for index, row in enumerate(config_rows, start=1)]
+
+        by_source, by_id = {}, {}
+        for route_id, source_chat_id, parser_name, destinations, rate_per_minute, use_secondary, *dedup in rows:
+            try:
+                route = Route(route_id, source_chat_id, parser_name, json.loads(destinations), rate_per_minute, use_secondary, *dedup)
+            except (ValueError, TypeError) as e:
+                logger.error(f"Skipping invalid route {route_id} (source {source_chat_id}): {e}")
+                continue
+            by_source[source_chat_id] = route
+            by_id[route_id] = route
+        self._by_source, self._by_id = by_source, by_id
+        for route in by_id.values():
+            logger.info(
+                f"Route {route.id}: {route.source_chat_id} -> {list(route.destinations)} "
+                f"(parser={route.parser_name}, rate={route.rate_per_minute}/min, secondary={route.use_secondary}, "
+                f"dedup={route.recent.ttl_seconds}s)"
+            )
+        return self.routes()
+
+    def lookup(self, source_chat_id):
+        """مسیر یک کانال منبع یا None."""
+        return self._by_source.get(source_chat_id)
+
+    def get(self, route_id):
+        return self._by_id.get(route_id)
+
+    @property
+    def default_route(self):
+        """قدیمی‌ترین مسیر؛ برای پیام‌های outbox که پیش از جدول مسیریابی ذخیره شده‌اند."""
+        return self._by_id[min(self._by_id)] if self._by_id else None
+
+    def routes(self):
+        return list(self._by_id.values())
+
+    def source_chat_ids(self):
+        return list(self._by_source)
+
+    def destination_chat_ids(self):
+        return {chat_id for route in self._by_id.values() for chat_id in route.destinations}
+
+
+routing_table = RoutingTable()
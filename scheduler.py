@@ -0,0 +1,137 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+SEND_DEADLINE_SECONDS = 300  # پستی که تا این مدت پس از دریافت ارسال نشده، دیگر ارزش ارسال ندارد
+FAVORED_TOKENS = ()  # آدرس توکن‌هایی که همیشه جلوتر از بقیه ارسال می‌شوند
+PRIORITY_MIN_MARKET_CAP = None  # پست‌های با مارکت‌کپ بالاتر از این مقدار یک رده جلوتر می‌روند
+
+PRIORITY_FAVORED = 2
+PRIORITY_HIGH_MARKET_CAP = 1
+PRIORITY_NORMAL = 0
+
+
+def make_priority_func(favored_tokens=FAVORED_TOKENS, min_market_cap=PRIORITY_MIN_MARKET_CAP):
+    """تابع اولویت job را بر اساس فهرست توکن‌های منتخب و حداقل مارکت‌کپ می‌سازد."""
+    favored = frozenset(address.lower() for address in favored_tokens)
+
+    def priority(job):
+        if job.token_address and job.token_address.lower() in favored:
+            return PRIORITY_FAVORED
+        if min_market_cap is not None and job.market_cap is not None and job.market_cap >= min_market_cap:
+            return PRIORITY_HIGH_MARKET_CAP
+        return PRIORITY_NORMAL
+    return priority
+
+
+class SendScheduler:
+    """
+    صف اولویت‌دار ارسال برای یک مقصد (جایگزین asyncio.Queue در DestinationSender).
+    ترتیب: اول اولویت بالاتر، سپس پست تازه‌تر؛ در هجوم پیام، تماس‌های جدید منتظر صف قدیمی نمی‌مانند.
+    پست‌های قدیمی‌تر از مهلت هنگام برداشتن کنار گذاشته می‌شوند و پست جدید یک توکن، پست در انتظار
+    قبلی همان توکن را جایگزین می‌کند. با max_size، صف پر کم‌ارزش‌ترین job (اولویت کمتر، قدیمی‌تر) را
+    کنار می‌گذارد، پس مقصد کند فقط پست‌های خودش را از دست می‌دهد و تولیدکننده هرگز منتظر نمی‌ماند.
+    برای jobهای کنار گذاشته on_complete(job, False) صدا زده می‌شود.
+    """
+
+    def __init__(self, name, deadline_seconds=SEND_DEADLINE_SECONDS, priority_func=None, collapse_same_token=True,
+                 max_size=None):
+        self.name = name
+        self.max_size = max_size
+        self.deadline_seconds = deadline_seconds
+        self.priority_func = priority_func or make_priority_func()
+        self.collapse_same_token = collapse_same_token
+        self._heap = []  # [(-priority, -created_at, seq, job)]
+        self._counter = itertools.count()
+        self._pending_by_token = {}  # token_address -> job در انتظار
+        self._removed = set()  # id(job)های جایگزین‌شده که هنوز در heap هستند (حذف تنبل)
+        self._discarded = []  # jobهایی که on_complete آن‌ها هنوز صدا زده نشده
+        self._event = asyncio.Event()
+        self._completing = None  # وظیفه تکمیل jobهای کنار گذاشته وقتی مصرف‌کننده get() را صدا نمی‌زند
+        self.expired = 0
+        self.collapsed = 0
+        self.overflowed = 0
+
+    def qsize(self):
+        return len(self._heap) - len(self._removed)
+
+    def put_nowait(self, job):
+        if job.created_at is None:
+            job.created_at = time.time()
+        if self.collapse_same_token and job.token_address:
+            previous = self._pending_by_token.get(job.token_address)
+            if previous is not None:
+                self._removed.add(id(previous))
+                self._discarded.append(previous)
+                self.collapsed += 1
+                logger.info(f"{self.name}: newer post for {job.token_address} replaces the pending one")
+            self._pending_by_token[job.token_address] = job
+        heapq.heappush(self._heap, (-self.priority_func(job), -job.created_at, next(self._counter), job))
+        if self.max_size is not None and self.qsize() > self.max_size:
+            self._evict_lowest()
+        self._event.set()
+
+    def _evict_lowest(self):
+        """کم‌ارزش‌ترین job زنده را کنار می‌گذارد (O(n) روی صفی که حداکثر max_size عضو دارد)."""
+        entry = max(entry for entry in self._heap if id(entry[3]) not in self._removed)
+        job = entry[3]
+        self._removed.add(id(job))
+        if self._pending_by_token.get(job.token_address) is job:
+            del self._pending_by_token[job.token_address]
+        self._discarded.append(job)
+        self.overflowed += 1
+        logger.warning(f"{self.name}: send queue full ({self.max_size}), dropping lowest-priority post: {job.message[:30]}...")
+        # مقصد گیر کرده ممکن است مدتی get() را صدا نزند؛ outbox نباید منتظر ack آن بماند
+        if self._completing is None or self._completing.done():
+            self._completing = asyncio.get_running_loop().create_task(self._complete_discarded())
+
+    def _pop(self):
+        """job زنده بعدی را برمی‌دارد یا None؛ jobهای منقضی به فهرست کنار گذاشته‌ها می‌روند."""
+        cutoff = time.time() - self.deadline_seconds
+        while self._heap:
+            job = heapq.heappop(self._heap)[3]
+            if id(job) in self._removed:
+                self._removed.discard(id(job))
+                continue
+            if self._pending_by_token.get(job.token_address) is job:
+                del self._pending_by_token[job.token_address]
+            if job.created_at < cutoff:
+                self.expired += 1
+                self._discarded.append(job)
+                logger.warning(
+                    f"{self.name}: dropping post older than {self.deadline_seconds}s "
+                    f"(age {time.time() - job.created_at:.0f}s): {job.message[:30]}..."
+                )
+                continue
+            return job
+        return None
+
+    async def _complete_discarded(self):
+        while self._discarded:
+            job = self._discarded.pop(0)
+            if job.on_complete is not None:
+                await job.on_complete(job, False)
+
+    async def get(self):
+        while True:
+            self._event.clear()
+            job = self._pop()
+            await self._complete_discarded()
+            if job is not None:
+                return job
+            await self._event.wait()
+
+    def stats(self):
+        return {
+            "pending": self.qsize(),
+            "expired": self.expired,
+            "collapsed": self.collapsed,
+            "overflowed": self.overflowed,
+        }
+
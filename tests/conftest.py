@@ -0,0 +1,32 @@
+# tests/conftest.py
+import asyncio
+import os
+import sys
+
+import pytest
+
+# ماژول‌های ربات در ریشه مخزن هستند (بدون پکیج)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+SECONDARY_CHANNEL_ID = -1001000000003
+
+
+@pytest.fixture
+def run_db(tmp_path, monkeypatch):
+    """
+    coroutine function تست را روی یک DB موقت تازه اجرا می‌کند:
+    init_db قبل از آن و close_db پس از آن (اتصال‌های مشترک بین تست‌ها به اشتراک گذاشته نمی‌شوند).
+    """
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+
+    def run(coro_func):
+        async def main():
+            await database.init_db(SECONDARY_CHANNEL_ID)
+            try:
+                return await coro_func()
+            finally:
+                await database.close_db()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,43 @@
+# tests/test_capture.py
+import asyncio
+import os
+from types import SimpleNamespace
+
+from capture import MessageCapture, capture_files, read_capture, CAPTURE_FILE_NAME
+
+
+def _message(n):
+    return SimpleNamespace(date=None, chat_id=-100, id=n, message=f"🥞 post {n}", entities=None)
+
+
+def test_capture_rotates_and_keeps_the_newest_files(tmp_path):
+    async def scenario():
+        # هر دسته فایل فعال را از سقف رد می‌کند، پس پس از هر flush چرخش انجام می‌شود
+        capture = MessageCapture(str(tmp_path), max_bytes=1, max_files=2)
+        for n in range(4):
+            capture.record(_message(n), 1000.0 + n)
+            await capture.flush()
+        return capture
+
+    capture = asyncio.run(scenario())
+    files = capture_files(str(tmp_path))
+    assert capture.rotations == 4
+    assert len(files) == 2
+    assert not os.path.exists(os.path.join(tmp_path, CAPTURE_FILE_NAME))
+    # فایل‌های قدیمی حذف شده‌اند و رکوردهای باقی‌مانده به ترتیب خوانده می‌شوند
+    assert [record["id"] for record in read_capture(files)] == [2, 3]
+
+
+def test_capture_appends_to_the_active_file_below_the_cap(tmp_path):
+    async def scenario():
+        capture = MessageCapture(str(tmp_path))
+        for n in range(3):
+            capture.record(_message(n), 1000.0 + n)
+            await capture.flush()
+        return capture
+
+    capture = asyncio.run(scenario())
+    files = capture_files(str(tmp_path))
+    assert files == [os.path.join(tmp_path, CAPTURE_FILE_NAME)]
+    assert [(record["id"], record["t"]) for record in read_capture(files)] == [(0, 1000.0), (1, 1001.0), (2, 1002.0)]
+    assert (capture.records, capture.rotations) == (3, 0)
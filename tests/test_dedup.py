@@ -0,0 +1,95 @@
+# tests/test_dedup.py
+import time
+
+import database
+import metrics
+from dedup import TTLDeduplicator, SentLedger, text_content_key, token_content_key, bucketed_key
+from routing import Route
+
+ADDRESS = "0x" + "ab" * 20
+
+
+def _post(address, market_cap="1M"):
+    return f"🥞 {address}\n├MC: ${market_cap}"
+
+
+def test_duplicates_are_rejected_until_their_ttl_expires():
+    dedup = TTLDeduplicator(60, name="test_ttl")
+    assert not dedup.check_and_add(_post(ADDRESS), now=1000.0)
+    # همان توکن با MC متفاوت تکراری است
+    assert dedup.check_and_add(_post(ADDRESS.upper().replace("0X", "0x"), "2M"), now=1030.0)
+    assert not dedup.check_and_add(_post(ADDRESS), now=1061.0)
+    assert dedup.stats() == {"size": 1, "hits": 1, "misses": 2, "expired": 1, "evicted": 0}
+
+
+def test_oldest_key_is_evicted_at_the_size_cap():
+    dedup = TTLDeduplicator(60, max_entries=2, key_func=text_content_key, name="test_cap")
+    for text in ("a", "b", "c"):
+        dedup.check_and_add(text, now=1000.0)
+    assert len(dedup) == 2
+    assert dedup.evicted == 1
+    assert not dedup.check_and_add("a", now=1001.0)
+    assert dedup.check_and_add("c", now=1001.0)
+
+
+def test_hits_and_evictions_are_exported_as_metrics():
+    dedup = TTLDeduplicator(10, max_entries=1, key_func=text_content_key, name="test_metrics")
+    dedup.check_and_add("a", now=1000.0)
+    dedup.check_and_add("a", now=1001.0)
+    dedup.check_and_add("b", now=1002.0)
+    dedup.check_and_add("c", now=1020.0)
+    assert metrics.dedup_hits.value(index="test_metrics") == 1
+    assert metrics.dedup_evicted.value(index="test_metrics") == 1
+    assert metrics.dedup_expired.value(index="test_metrics") == 1
+
+
+def test_bucketed_key_accepts_same_content_in_the_next_bucket():
+    dedup = TTLDeduplicator(600, key_func=bucketed_key(token_content_key, 100), name="test_bucket")
+    assert not dedup.check_and_add(_post(ADDRESS), now=1000.0)
+    assert dedup.check_and_add(_post(ADDRESS), now=1099.0)
+    assert not dedup.check_and_add(_post(ADDRESS), now=1100.0)
+
+
+def test_route_reads_dedup_ttl_and_key_from_its_spec():
+    route = Route(1, -100, "pancake", [-200], 20, dedup_ttl_seconds=5, dedup_key="text")
+    assert route.recent.ttl_seconds == 5
+    assert not route.recent.check_and_add(_post(ADDRESS, "1M"), now=1000.0)
+    # با کلید text، همان توکن با MC متفاوت پیام جدید است
+    assert not route.recent.check_and_add(_post(ADDRESS, "2M"), now=1001.0)
+    assert Route(2, -101, "pancake", [-200], 20).recent.key_func is token_content_key
+
+
+def test_sent_ledger_is_loaded_lazily_from_db(run_db):
+    async def scenario():
+        await SentLedger().add("first")
+        # ردیف قدیمی‌تر از TTL پس از ری‌استارت بارگیری نمی‌شود
+        await database.record_sent_key("stale", int(time.time()) - 7200)
+        restarted = SentLedger(ttl_seconds=3600)
+        loaded_before_use = restarted._loaded
+        return loaded_before_use, await restarted.contains("first"), await restarted.contains("stale"), len(restarted)
+
+    assert run_db(scenario) == (False, True, False, 1)
+
+
+def test_sent_ledger_expires_keys_after_ttl(run_db, monkeypatch):
+    async def scenario():
+        ledger = SentLedger(ttl_seconds=60)
+        await ledger.add("key")
+        found = await ledger.contains("key")
+        later = time.time() + 61
+        monkeypatch.setattr("dedup.time.time", lambda: later)
+        return found, await ledger.contains("key")
+
+    assert run_db(scenario) == (True, False)
+
+
+def test_sent_ledger_evicts_oldest_key_at_the_cap(run_db):
+    async def scenario():
+        ledger = SentLedger(max_entries=2)
+        for key in ("a", "b", "c"):
+            await ledger.add(key)
+        # سقف فقط حافظه را محدود می‌کند؛ DB همه کلیدها را نگه می‌دارد
+        rows = await database.load_sent_keys(0, 10)
+        return [await ledger.contains(key) for key in ("a", "b", "c")], len(rows)
+
+    assert run_db(scenario) == ([False, True, True], 3)
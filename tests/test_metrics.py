@@ -0,0 +1,84 @@
+# tests/test_metrics.py
+import asyncio
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry, start_metrics_server
+
+
+def test_counter_and_gauge_render_with_labels():
+    registry = Registry()
+    sent = Counter("sent_total", "Sent messages", ("channel",), registry=registry)
+    depth = Gauge("depth", "Queue depth", ("queue",), registry=registry)
+    sent.inc(channel="Main")
+    sent.inc(2, channel="Main")
+    sent.inc(channel='Se"c')
+    depth.set(4, queue="outbox")
+    depth.set_function(lambda: 7, queue="ingest")
+
+    assert sent.value(channel="Main") == 3
+    assert depth.value(queue="ingest") == 7
+    assert registry.render_prometheus().splitlines() == [
+        "# HELP sent_total Sent messages",
+        "# TYPE sent_total counter",
+        'sent_total{channel="Main"} 3',
+        'sent_total{channel="Se\\"c"} 1',
+        "# HELP depth Queue depth",
+        "# TYPE depth gauge",
+        'depth{queue="outbox"} 4',
+        'depth{queue="ingest"} 7',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    assert latency.summary() == (4, pytest.approx(0.9125))
+    assert registry.render_prometheus().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_wrong_labels_and_duplicate_names_are_rejected():
+    registry = Registry()
+    sent = Counter("sent_total", "Sent messages", ("channel",), registry=registry)
+    with pytest.raises(ValueError):
+        sent.inc(route=1)
+    with pytest.raises(ValueError):
+        Counter("sent_total", "Again", registry=registry)
+
+
+def test_summary_lines_for_admin_command():
+    registry = Registry()
+    Counter("sent_total", "Sent messages", ("channel",), registry=registry).inc(channel="Main")
+    Histogram("db_seconds", "DB", ("op",), registry=registry).observe(0.002, op="load")
+    assert registry.summary_lines() == ['sent_total{channel="Main"}: 1', 'db_seconds{op="load"}: n=1 avg=2.0ms']
+
+
+def test_metrics_endpoint_serves_the_registry():
+    async def scenario():
+        server = await start_metrics_server(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            # پورت اشغال: ربات بدون endpoint ادامه می‌دهد
+            busy = await start_metrics_server(port=port)
+        finally:
+            server.close()
+            await server.wait_closed()
+        return response.decode("utf-8"), busy
+
+    response, busy = asyncio.run(scenario())
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE forward_messages_sent_total counter" in response
+    assert busy is None
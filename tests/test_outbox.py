@@ -0,0 +1,131 @@
+# tests/test_outbox.py
+from telethon.tl.types import MessageEntityBold, MessageEntityTextUrl
+
+import database
+from outbox import Outbox
+from parser import serialize_entities, deserialize_entities
+
+
+def test_acked_entries_are_not_replayed(run_db):
+    async def scenario():
+        outbox = Outbox()
+        await outbox.start()
+        ids = [await outbox.put({"n": n}) for n in range(3)]
+        entry_id, item = await outbox.get()
+        outbox.ack(entry_id)
+        await outbox.close()
+
+        replayed = Outbox()
+        await replayed.replay()
+        size = replayed.qsize()
+        entries = [await replayed.get() for _ in range(size)]
+        await replayed.flush()
+        return ids, entry_id, item, size, entries, [replayed.is_replayed(entry_id) for entry_id, _ in entries]
+
+    ids, first_id, first_item, size, entries, replayed_flags = run_db(scenario)
+    assert (first_id, first_item) == (ids[0], {"n": 0})
+    assert size == 2
+    assert entries == [(ids[1], {"n": 1}), (ids[2], {"n": 2})]
+    assert all(replayed_flags)
+
+
+def test_put_is_durable_before_it_returns(run_db):
+    async def scenario():
+        outbox = Outbox()
+        await outbox.start()
+        entry_id = await outbox.put({"n": 1})
+        # بدون close/flush: ردیف باید از قبل commit شده باشد
+        rows = await database.outbox_load(0, 10)
+        await outbox.close()
+        return entry_id, rows
+
+    entry_id, rows = run_db(scenario)
+    assert [row[0] for row in rows] == [entry_id]
+
+
+def test_front_buffer_spills_to_disk_in_order(run_db):
+    async def scenario():
+        outbox = Outbox(front_buffer_size=2)
+        await outbox.start()
+        for n in range(7):
+            await outbox.put({"n": n})
+        items = []
+        for _ in range(7):
+            entry_id, item = await outbox.get()
+            outbox.ack(entry_id)
+            items.append(item["n"])
+        await outbox.close()
+        return items, await database.outbox_count()
+
+    items, remaining = run_db(scenario)
+    assert items == list(range(7))
+    assert remaining == 0
+
+
+def test_entry_claimed_across_restarts_is_dead_lettered(run_db):
+    async def scenario():
+        outbox = Outbox(max_attempts=2)
+        await outbox.start()
+        await outbox.put({"poison": True})
+        await outbox.put({"ok": True})
+        await outbox.get()  # پیام claim شده و پیش از ack برنامه متوقف می‌شود
+        await outbox.close()
+
+        sizes = []
+        for _ in range(2):
+            restarted = Outbox(max_attempts=2)
+            await restarted.replay()
+            sizes.append(restarted.qsize())
+            entry_id, item = await restarted.get()
+            if item.get("ok"):
+                restarted.ack(entry_id)
+            await restarted.flush()
+        return sizes, restarted.dead_lettered, await database.outbox_count()
+
+    sizes, dead_lettered, remaining = run_db(scenario)
+    # اجرای دوم: پیام خراب به سقف تلاش رسیده و dead شده است
+    assert sizes == [2, 1]
+    assert dead_lettered == 1
+    assert remaining == 0
+
+
+def test_dead_letter_removes_entry_from_queue(run_db):
+    async def scenario():
+        outbox = Outbox()
+        await outbox.start()
+        await outbox.put({"n": 1})
+        entry_id, _ = await outbox.get()
+        outbox.dead_letter(entry_id)
+        await outbox.close()
+        replayed = Outbox()
+        await replayed.replay()
+        return outbox.qsize(), replayed.qsize()
+
+    assert run_db(scenario) == (0, 0)
+
+
+def test_entities_round_trip_through_outbox_serialization():
+    entities = [MessageEntityBold(offset=0, length=3), MessageEntityTextUrl(offset=4, length=2, url="https://x")]
+    restored = deserialize_entities(serialize_entities(entities))
+    assert [entity.to_dict() for entity in restored] == [entity.to_dict() for entity in entities]
+
+
+def test_replayed_entries_keep_receive_time_plus_bounded_grace(run_db):
+    async def scenario():
+        outbox = Outbox(replay_grace=60)
+        await outbox.start()
+        old_id = await outbox.put({"n": 1})
+        await outbox.close()
+        replayed = Outbox(replay_grace=60)
+        await replayed.start()
+        new_id = await replayed.put({"n": 2})
+        result = (
+            replayed.deadline_created_at(old_id, 1000.0),
+            replayed.deadline_created_at(new_id, 1000.0),
+            replayed.deadline_created_at(old_id, None),
+        )
+        await replayed.close()
+        return result
+
+    # فقط پیام اجرای قبلی مهلت اضافه می‌گیرد و زمان دریافتش از نو شروع نمی‌شود
+    assert run_db(scenario) == (1060.0, 1000.0, None)
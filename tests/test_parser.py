@@ -0,0 +1,73 @@
+# tests/test_parser.py
+from telethon.tl.types import (
+    MessageEntityBold, MessageEntityItalic, MessageEntityTextUrl, MessageEntityCode
+)
+
+from benchmarks.corpus import generate_corpus
+from parser import transform_message, entities_to_html, market_cap_value, _parse_th, _utf16_len
+
+
+def _line(text, prefix):
+    return next(line for line in text.split("\n") if line.startswith(prefix))
+
+
+def test_transform_matches_source_fields_over_corpus():
+    for text, entities in generate_corpus(60, seed=7):
+        new_message, new_entities, chart_url, th_pairs, token_address, market_cap = transform_message(text, entities)
+        lines = text.split("\n")
+        assert new_message
+        assert new_entities == []
+        assert token_address == lines[0].replace("🥞", "").strip()
+        assert chart_url == _line(text, "📈 Chart:").split()[-1]
+        assert market_cap == market_cap_value(_line(text, "├MC:").split("$")[1])
+
+        th_line = _line(text, "└TH:")
+        if any(isinstance(entity, MessageEntityTextUrl) for entity in entities):
+            percents = th_line[len("└TH: "):].split(" | ")
+            expected = [(percent, f"https://bscscan.com/address/0x{i:040x}") for i, percent in enumerate(percents)]
+        else:
+            expected = _parse_th(th_line)
+        assert [tuple(pair) for pair in th_pairs] == expected
+
+
+def test_th_entities_use_utf16_offsets():
+    # ایموجی‌های خارج از BMP (🥞، 🚀) هر کدام دو واحد UTF-16 هستند؛ offset بر حسب code point اشتباه است
+    address = "0x" + "1" * 40
+    head = f"🥞 {address}\n┌🚀🚀 Rocket (RKT) (https://t.me/rkt)\n├MC: $1.5M\n└TH: "
+    text = head + "12.5% | 3.1%\n📈 Chart: https://mevx.io/bsc/x"
+    first = _utf16_len(head)
+    entities = [
+        MessageEntityTextUrl(offset=first, length=5, url="https://a"),
+        MessageEntityTextUrl(offset=first + 8, length=4, url="https://b"),
+    ]
+    assert _utf16_len(head) == len(head) + 3
+
+    _, _, _, th_pairs, token_address, market_cap = transform_message(text, entities)
+    assert token_address == address
+    assert market_cap == 1.5e6
+    assert th_pairs == [("12.5%", "https://a"), ("3.1%", "https://b")]
+
+
+def test_transform_rejects_message_without_trigger():
+    assert transform_message("hello", []) == (None, None, None, None, None, None)
+
+
+def test_entities_to_html_nests_overlapping_entities():
+    entities = [MessageEntityBold(offset=0, length=4), MessageEntityItalic(offset=2, length=4)]
+    assert entities_to_html(entities, "abcdef") == ("<b>ab<i>cd</i></b><i>ef</i>", "HTML")
+
+
+def test_entities_to_html_outer_entity_opens_first():
+    entities = [MessageEntityBold(offset=0, length=2), MessageEntityTextUrl(offset=0, length=5, url="https://x?a=1&b=2")]
+    html, _ = entities_to_html(entities, "hello")
+    assert html == '<a href="https://x?a=1&amp;b=2"><b>he</b>llo</a>'
+
+
+def test_entities_to_html_utf16_offsets_and_escaping():
+    text = "🚀 <go> & run"
+    entities = [MessageEntityCode(offset=3, length=4), MessageEntityBold(offset=10, length=3)]
+    assert entities_to_html(entities, text) == ("🚀 <code>&lt;go&gt;</code> &amp; <b>run</b>", "HTML")
+
+
+def test_entities_to_html_without_entities_returns_text_unchanged():
+    assert entities_to_html([], "<b>already html</b>") == ("<b>already html</b>", "HTML")
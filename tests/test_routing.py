@@ -0,0 +1,73 @@
+# tests/test_routing.py
+import pytest
+
+import database
+from routing import RoutingTable
+
+
+def _spec(source, destinations=(-200,), **extra):
+    return {"source": source, "destinations": list(destinations), "rate_per_minute": 20, **extra}
+
+
+def test_load_syncs_table_with_config_and_keeps_route_ids(run_db):
+    async def scenario():
+        table = RoutingTable()
+        first = {route.source_chat_id: route.id for route in await table.load([_spec(-1), _spec(-2)])}
+        # مسیر -1 تغییر کرده و -2 از config حذف شده است
+        await table.load([_spec(-1, (-300, -400), dedup_ttl_seconds=5)])
+        changed = table.lookup(-1)
+        removed = table.lookup(-2), len(await database.load_routes())
+        # برگرداندن -2 همان ردیف (و همان id) را دوباره فعال می‌کند
+        await table.load([_spec(-1), _spec(-2)])
+        return first, changed, removed, table.lookup(-2).id
+
+    first, changed, (removed, enabled_rows), readded_id = run_db(scenario)
+    assert changed.id == first[-1]
+    assert (changed.destinations, changed.recent.ttl_seconds) == ((-300, -400), 5)
+    assert (removed, enabled_rows) == (None, 1)
+    assert readded_id == first[-2]
+
+
+def test_invalid_route_is_skipped(run_db):
+    async def scenario():
+        table = RoutingTable()
+        routes = await table.load([_spec(-1, parser="unknown"), _spec(-2), _spec(-3, dedup_key="md5")])
+        return [route.source_chat_id for route in routes]
+
+    assert run_db(scenario) == [-2]
+
+
+def test_load_falls_back_to_config_without_db(run_db, monkeypatch):
+    async def scenario():
+        async def broken_load_routes():
+            return None
+        monkeypatch.setattr("routing.load_routes", broken_load_routes)
+        table = RoutingTable()
+        routes = await table.load([_spec(-1), _spec(-2, secondary=True)])
+        return [(route.id, route.source_chat_id, route.use_secondary) for route in routes], table.default_route.id
+
+    routes, default_id = run_db(scenario)
+    assert routes == [(1, -1, False), (2, -2, True)]
+    assert default_id == 1
+
+
+def test_sources_are_resolved_and_unresolved_ones_rejected(run_db):
+    peers = {"@first": -1001, "@second": -1002}
+
+    async def scenario():
+        async def resolve(source):
+            if source not in peers:
+                raise ValueError("no such channel")
+            return peers[source]
+
+        table = RoutingTable()
+        await table.load([_spec("@first"), _spec("@second")], resolve=resolve)
+        resolved = sorted(table.source_chat_ids())
+        with pytest.raises(ValueError):
+            await table.load([_spec("@first"), _spec("@missing")], resolve=resolve)
+        # بارگیری ناموفق مسیرهای قبلی را دست نمی‌زند
+        return resolved, sorted(table.source_chat_ids())
+
+    resolved, after_error = run_db(scenario)
+    assert resolved == [-1002, -1001]
+    assert after_error == [-1002, -1001]
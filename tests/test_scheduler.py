@@ -0,0 +1,84 @@
+# tests/test_scheduler.py
+import asyncio
+import time
+
+from pipeline import DeliveryJob
+from scheduler import SendScheduler, make_priority_func
+
+FAVORED = "0x" + "f" * 40
+
+
+def _job(name, token_address=None, created_at=None, market_cap=None, completed=None):
+    async def on_complete(job, success):
+        completed.append((job.message, success))
+    return DeliveryJob(
+        name, [], None, [], token_address, -100,
+        on_complete=on_complete if completed is not None else None,
+        created_at=created_at, market_cap=market_cap
+    )
+
+
+def test_priority_then_newest_first():
+    async def scenario():
+        now = time.time()
+        scheduler = SendScheduler("test", priority_func=make_priority_func((FAVORED,), 1e6))
+        scheduler.put_nowait(_job("old", "0x1", now - 20))
+        scheduler.put_nowait(_job("new", "0x2", now - 10))
+        scheduler.put_nowait(_job("big", "0x3", now - 30, market_cap=5e6))
+        scheduler.put_nowait(_job("favored", FAVORED, now - 40))
+        return [(await scheduler.get()).message for _ in range(4)]
+
+    assert asyncio.run(scenario()) == ["favored", "big", "new", "old"]
+
+
+def test_newer_post_collapses_pending_post_of_same_token():
+    async def scenario():
+        completed = []
+        scheduler = SendScheduler("test")
+        scheduler.put_nowait(_job("first", "0x1", completed=completed))
+        scheduler.put_nowait(_job("other", "0x2", completed=completed))
+        scheduler.put_nowait(_job("second", "0x1", completed=completed))
+        size = scheduler.qsize()
+        messages = [(await scheduler.get()).message for _ in range(2)]
+        return size, messages, completed, scheduler.stats()
+
+    size, messages, completed, stats = asyncio.run(scenario())
+    assert size == 2
+    assert sorted(messages) == ["other", "second"]
+    assert completed == [("first", False)]
+    assert stats["collapsed"] == 1
+
+
+def test_expired_posts_are_dropped_and_completed():
+    async def scenario():
+        completed = []
+        # پست منقضی اولویت بالاتری دارد تا قبل از پست تازه برداشته شود
+        scheduler = SendScheduler("test", deadline_seconds=60, priority_func=make_priority_func((FAVORED,)))
+        scheduler.put_nowait(_job("stale", FAVORED, time.time() - 120, completed=completed))
+        scheduler.put_nowait(_job("fresh", "0x2", completed=completed))
+        job = await scheduler.get()
+        return job.message, completed, scheduler.stats()
+
+    message, completed, stats = asyncio.run(scenario())
+    assert message == "fresh"
+    assert completed == [("stale", False)]
+    assert stats == {"pending": 0, "expired": 1, "collapsed": 0, "overflowed": 0}
+
+
+def test_full_queue_drops_lowest_priority_post_without_a_consumer():
+    async def scenario():
+        completed = []
+        now = time.time()
+        scheduler = SendScheduler("test", max_size=2)
+        scheduler.put_nowait(_job("old", "0x1", now - 30, completed=completed))
+        scheduler.put_nowait(_job("mid", "0x2", now - 20, completed=completed))
+        scheduler.put_nowait(_job("new", "0x3", now - 10, completed=completed))
+        # مصرف‌کننده (کارگر مقصد) get() را صدا نمی‌زند، مثل مقصدی که گیر کرده است
+        await asyncio.sleep(0)
+        return scheduler.qsize(), completed, scheduler.stats()["overflowed"], [(await scheduler.get()).message for _ in range(2)]
+
+    size, completed, overflowed, remaining = asyncio.run(scenario())
+    assert size == 2
+    assert completed == [("old", False)]
+    assert overflowed == 1
+    assert remaining == ["new", "mid"]
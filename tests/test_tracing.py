@@ -0,0 +1,43 @@
+# tests/test_tracing.py
+import asyncio
+import time
+
+import pytest
+
+from tracing import Tracer, mark
+
+
+def _finish_traces(tracer, now):
+    # زمان ارسال i صدم ثانیه پس از paced؛ p50/p95/p99 به روش nearest-rank مشخص است
+    for i in range(1, 101):
+        trace = tracer.begin(now - 10, now - 9)
+        mark(trace, "paced", now - 2)
+        mark(trace, "sent", now - 2 + i / 100)
+        tracer.finish(trace, "Main", retries=i % 2)
+
+
+def test_latency_report_percentiles_from_the_ring():
+    async def scenario():
+        tracer = Tracer()
+        tracer._started_at = time.time() - 7200  # حلقه کل بازه را پوشش می‌دهد؛ DB خوانده نمی‌شود
+        _finish_traces(tracer, time.time())
+        return await tracer.latency_report(window_seconds=3600)
+
+    count, report, retries = asyncio.run(scenario())
+    assert (count, retries) == (100, 50)
+    assert report["send"] == {"n": 100, "p50": pytest.approx(0.5), "p95": pytest.approx(0.95), "p99": pytest.approx(0.99)}
+    assert report["source_lag"]["p99"] == pytest.approx(1.0)
+    assert "queue_wait" not in report  # بدون مرحله queued/dequeued
+
+
+def test_latency_report_reads_db_when_ring_does_not_cover_the_window(run_db):
+    async def scenario():
+        tracer = Tracer()
+        _finish_traces(tracer, time.time())
+        await tracer.flush()
+        restarted = Tracer()  # حلقه خالی پس از ری‌استارت
+        return await restarted.latency_report(window_seconds=3600)
+
+    count, report, retries = run_db(scenario)
+    assert (count, retries) == (100, 50)
+    assert (report["send"]["p50"], report["send"]["p95"]) == (pytest.approx(0.5), pytest.approx(0.95))
@@ -0,0 +1,130 @@
+# tests/test_utils.py
+import asyncio
+
+import pytest
+
+import metrics
+from utils import FloodController, TokenBucketRateLimiter, MessageRateLimiter
+
+
+def test_flood_halves_rate_and_recovers_with_time_after_the_pause():
+    flood = FloodController(decrease_factor=0.5, increase_per_second=0.1, min_factor=0.1)
+    flood.pause(2, -100, now=1000.0)
+    assert flood.pause_remaining(-100, now=1000.5) == pytest.approx(1.5)
+    # در طول توقف ضریب ثابت می‌ماند و بازیابی از پایان توقف شروع می‌شود
+    assert flood.factor(-100, now=1001.0) == pytest.approx(0.5)
+    assert flood.factor(-100, now=1004.0) == pytest.approx(0.7)
+    assert flood.factor(-100, now=1007.0) == 1.0
+    assert flood.stats()["throttled"] == 0
+
+
+def test_repeated_floods_are_multiplicative_down_to_the_floor():
+    flood = FloodController(decrease_factor=0.5, increase_per_second=0.1, min_factor=0.2)
+    for _ in range(4):
+        flood.pause(1, -100, now=1000.0)
+    assert flood.factor(-100, now=1001.0) == pytest.approx(0.2)
+    assert flood.floods == 4
+
+
+def test_pause_is_scoped_to_its_chat():
+    flood = FloodController()
+    flood.pause(5, -100, now=1000.0)
+    assert flood.pause_remaining(-200, now=1001.0) == 0.0
+    assert flood.factor(-200, now=1001.0) == 1.0
+
+
+def test_acquire_waits_exactly_for_the_next_chat_token():
+    async def scenario():
+        # ۶۰۰ در دقیقه = یک توکن هر ۰.۱ ثانیه، با انفجار ۲
+        limiter = TokenBucketRateLimiter(600, per_chat_burst=2, flood=FloodController())
+        waits = [await limiter.acquire(-100) for _ in range(3)]
+        other_chat = await limiter.acquire(-200)
+        return waits, other_chat, limiter.stats()
+
+    waits, other_chat, stats = asyncio.run(scenario())
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.02)
+    assert other_chat == 0.0  # سطل هر چت جداست
+    assert (stats["acquired"], stats["waited"]) == (4, 1)
+
+
+def test_global_bucket_limits_all_chats_together():
+    async def scenario():
+        limiter = TokenBucketRateLimiter(600, global_per_second=10, global_burst=2, flood=FloodController())
+        return [await limiter.acquire(chat_id) for chat_id in (-100, -200, -300)]
+
+    waits = asyncio.run(scenario())
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.02)
+
+
+def test_cancelled_acquire_refunds_its_tokens():
+    async def scenario():
+        limiter = TokenBucketRateLimiter(600, per_chat_burst=1, flood=FloodController())
+        await limiter.acquire(-100)
+        task = asyncio.create_task(limiter.acquire(-100))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return limiter._chat_bucket(-100).tokens
+
+    # توکن رزرو‌شده برگشته و موجودی منفی نمانده است
+    assert asyncio.run(scenario()) >= -0.01
+
+
+def test_flood_pauses_acquire_for_that_chat():
+    async def scenario():
+        limiter = TokenBucketRateLimiter(600, flood=FloodController())
+        limiter.on_flood(-100, 0.1)
+        return await limiter.acquire(-100), await limiter.acquire(-200)
+
+    paused, other_chat = asyncio.run(scenario())
+    assert paused >= 0.09
+    assert other_chat == 0.0
+
+
+def test_skipped_backlog_drops_oldest_at_the_cap():
+    async def scenario():
+        limiter = MessageRateLimiter(60, max_skipped=2, name="test_cap")
+        for text in ("a", "b", "c"):
+            await limiter.add_skipped((text, 1000.0))
+        return await limiter.next_skipped(), limiter.skipped_stats()
+
+    message, stats = asyncio.run(scenario())
+    # پیام همان‌طور که ثبت شده (با زمان دریافت اصلی) برمی‌گردد
+    assert message == ("b", 1000.0)
+    assert stats == {"backlog": 1, "drained": 1, "expired": 0, "dropped": 1}
+    assert metrics.receive_backlog_dropped.value(limiter="test_cap") == 1
+    assert metrics.receive_backlog_drained.value(limiter="test_cap") == 1
+
+
+def test_skipped_messages_expire_after_their_ttl():
+    async def scenario():
+        limiter = MessageRateLimiter(60, skipped_ttl_seconds=0.05, name="test_ttl")
+        await limiter.add_skipped(("old",))
+        await asyncio.sleep(0.1)
+        await limiter.add_skipped(("new",))
+        return await limiter.next_skipped(), limiter.skipped_stats()
+
+    message, stats = asyncio.run(scenario())
+    assert message == ("new",)
+    assert (stats["expired"], stats["backlog"]) == (1, 0)
+    assert metrics.receive_backlog_expired.value(limiter="test_ttl") == 1
+
+
+def test_next_skipped_waits_for_receive_capacity():
+    async def scenario():
+        limiter = MessageRateLimiter(600, name="test_wait")
+        while limiter.can_send():
+            limiter.increment()
+        await limiter.add_skipped(("a",))
+        started = asyncio.get_running_loop().time()
+        message = await limiter.next_skipped()
+        return message, asyncio.get_running_loop().time() - started
+
+    message, waited = asyncio.run(scenario())
+    assert message == ("a",)
+    assert 0.05 <= waited < 1.0
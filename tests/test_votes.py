@@ -0,0 +1,181 @@
+# tests/test_votes.py
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter, TimedOut
+
+import database
+from utils import FloodController, TokenBucketRateLimiter
+from votes import VoteJournal, VoteMarkupCoalescer
+
+TOKEN = "0x" + "ab" * 20
+
+
+def test_vote_triggers_keep_counters_in_sync(run_db):
+    async def scenario():
+        await database.register_message_in_votes(1, -100, TOKEN)
+        assert await database.process_vote(1, 10, "green") == (1, 0)
+        assert await database.process_vote(1, 11, "red") == (1, 1)
+        assert await database.process_vote(1, 10, "green") is None  # رای تکراری
+        assert await database.process_vote(1, 10, "red") == (0, 2)  # تغییر رای
+        return await database.load_message_votes(1)
+
+    token_address, green, red, users = run_db(scenario)
+    assert (token_address, green, red) == (TOKEN, 0, 2)
+    assert users == {10: "red", 11: "red"}
+
+
+def test_vote_before_registration_keeps_counts(run_db):
+    async def scenario():
+        assert await database.process_vote(2, 10, "green") == (1, 0)
+        await database.register_message_in_votes(2, -100, TOKEN)
+        return await database.load_message_votes(2)
+
+    assert run_db(scenario)[:3] == (TOKEN, 1, 0)
+
+
+def test_counters_resynced_when_triggers_are_created(run_db):
+    async def scenario():
+        await database.register_message_in_votes(3, -100, TOKEN)
+        await database.flush_votes([(3, 10, "green"), (3, 11, "green"), (3, 12, "red")])
+        # دیتابیس قدیمی: بدون تریگر و با شمارنده‌های نادرست
+        async with database._write_transaction() as db:
+            await db.execute("DROP TRIGGER user_votes_after_insert")
+            await db.execute("DROP TRIGGER user_votes_after_update")
+            await db.execute("UPDATE token_votes SET green_votes = 0, red_votes = 7")
+        await database.close_db()
+        await database.init_db(-1)
+        return await database.load_message_votes(3)
+
+    assert run_db(scenario)[1:3] == (2, 1)
+
+
+def test_journal_flush_and_cold_reload(run_db):
+    async def scenario():
+        journal = VoteJournal()
+        await journal.register(4, -100, TOKEN)
+        assert await journal.process_vote(4, 10, "green") == (1, 0)
+        assert await journal.process_vote(4, 11, "green") == (2, 0)
+        assert await journal.process_vote(4, 10, "red") == (1, 1)
+        assert await journal.process_vote(4, 10, "red") is None
+        await journal.close()
+
+        # journal جدید (مثل پس از ری‌استارت) وضعیت را از DB بازسازی می‌کند
+        reloaded = VoteJournal()
+        result = await reloaded.process_vote(4, 11, "red")
+        token_address = await reloaded.get_token_address(4)
+        await reloaded.close()
+        return result, token_address, await database.load_message_votes(4)
+
+    result, token_address, (_, green, red, users) = run_db(scenario)
+    assert result == (0, 2)
+    assert token_address == TOKEN
+    assert (green, red, users) == (0, 2, {10: "red", 11: "red"})
+
+
+def test_trim_keeps_messages_of_in_flight_flush(run_db, monkeypatch):
+    async def scenario():
+        journal = VoteJournal(max_cached_messages=1)
+        await journal.register(5, -100, TOKEN)
+        await journal.process_vote(5, 10, "green")
+
+        release = asyncio.Event()
+        real_flush_votes = database.flush_votes
+
+        async def slow_flush_votes(votes):
+            await release.wait()
+            return await real_flush_votes(votes)
+
+        monkeypatch.setattr("votes.flush_votes", slow_flush_votes)
+        flush_task = asyncio.create_task(journal.flush())
+        await asyncio.sleep(0)
+        # پیام‌های جدید باعث _trim می‌شوند؛ پیام 5 که در حال ذخیره است نباید حذف شود
+        await journal.register(6, -100, TOKEN)
+        await journal.register(7, -100, TOKEN)
+        kept_during_flush = 5 in journal._messages
+        release.set()
+        await flush_task
+        counts = await journal.process_vote(5, 11, "green")
+        await journal.close()
+        return kept_during_flush, counts
+
+    kept_during_flush, counts = run_db(scenario)
+    assert kept_during_flush
+    assert counts == (2, 0)
+
+
+class _EditBot:
+    """Bot جعلی که خطاهای errors را به ترتیب برای edit‌ها برمی‌گرداند."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.edits = []
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.edits.append((chat_id, message_id, reply_markup))
+
+
+def _coalescer(**kwargs):
+    limiter = TokenBucketRateLimiter(6000, flood=FloodController())
+    return VoteMarkupCoalescer(window=0.01, retry_delay=0.01, rate_limiter=limiter, **kwargs), limiter
+
+
+@pytest.fixture
+def plain_keyboard(monkeypatch):
+    # کیبورد واقعی به لینک‌های config نیاز دارد؛ شمارش کافی است
+    monkeypatch.setattr("votes.build_post_keyboard", lambda token_address, green, red: (green, red))
+
+
+async def _drain(coalescer):
+    while coalescer._tasks:
+        await asyncio.gather(*list(coalescer._tasks.values()), return_exceptions=True)
+
+
+def test_coalescer_merges_votes_and_skips_unchanged_counts(plain_keyboard):
+    async def scenario():
+        coalescer, _ = _coalescer()
+        bot = _EditBot()
+        coalescer.mark_rendered(-100, 1, 0, 0)
+        for green in (1, 2, 3):
+            coalescer.schedule(bot, -100, 1, TOKEN, green, 0)
+        await _drain(coalescer)
+        # شمارش برابر با نسخه نمایش‌داده‌شده edit نمی‌شود
+        coalescer.schedule(bot, -100, 1, TOKEN, 3, 0)
+        await _drain(coalescer)
+        return bot.edits, coalescer.stats()
+
+    edits, stats = asyncio.run(scenario())
+    assert edits == [(-100, 1, (3, 0))]
+    assert (stats["edits_sent"], stats["coalesced"], stats["skipped_unchanged"]) == (1, 2, 1)
+
+
+def test_coalescer_pauses_the_chat_on_retry_after(plain_keyboard):
+    async def scenario():
+        coalescer, limiter = _coalescer()
+        bot = _EditBot([RetryAfter(0.05)])
+        coalescer.schedule(bot, -100, 1, TOKEN, 1, 0)
+        await _drain(coalescer)
+        return bot.edits, coalescer.stats(), limiter.flood.floods, limiter.stats()["acquired"]
+
+    edits, stats, floods, acquired = asyncio.run(scenario())
+    assert edits == [(-100, 1, (1, 0))]
+    assert (stats["failed"], stats["retries"]) == (0, 0)
+    assert floods == 1
+    assert acquired == 2  # هر تلاش edit از سطل ارسال مجوز می‌گیرد
+
+
+def test_coalescer_gives_up_after_bounded_retries(plain_keyboard):
+    async def scenario():
+        coalescer, _ = _coalescer(max_retries=2)
+        bot = _EditBot([TimedOut()] * 5)
+        coalescer.schedule(bot, -100, 1, TOKEN, 1, 0)
+        coalescer.schedule(bot, -100, 1, TOKEN, 2, 0)
+        await _drain(coalescer)
+        return bot.edits, bot.errors, coalescer.stats()
+
+    edits, remaining_errors, stats = asyncio.run(scenario())
+    assert edits == []
+    assert len(remaining_errors) == 2  # یک تلاش اول و دو تلاش مجدد
+    assert (stats["retries"], stats["failed"], stats["pending"]) == (2, 2, 0)
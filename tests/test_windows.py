@@ -0,0 +1,94 @@
+# tests/test_windows.py
+import random
+import time
+
+from windows import WindowSchedule, RECURRENCE_PERIODS, DAY_SECONDS
+
+
+def _brute_force(windows, t):
+    """مرجع ساده: هر پنجره جداگانه بررسی می‌شود."""
+    active = set()
+    for window in windows:
+        period = RECURRENCE_PERIODS[window.recurrence]
+        if period is None:
+            if window.start_time <= t < window.start_time + window.duration:
+                active.add(window.channel_id)
+        elif t >= window.start_time and (t - window.start_time) % period < min(window.duration, period):
+            active.add(window.channel_id)
+    return active
+
+
+def test_index_matches_brute_force(run_db):
+    async def scenario():
+        rng = random.Random(5)
+        schedule = WindowSchedule()
+        await schedule.load()
+        base = time.time()
+        for _ in range(40):
+            await schedule.add(
+                rng.randrange(5), base + rng.uniform(-3 * DAY_SECONDS, 10 * DAY_SECONDS),
+                rng.randrange(60, 3 * DAY_SECONDS), rng.choice(list(RECURRENCE_PERIODS))
+            )
+        windows = schedule.windows()
+        mismatches = []
+        # پرس‌وجوهای تصادفی (جلو و عقب) و یک پیمایش پیوسته که کش را به کار می‌گیرد
+        times = [base + rng.uniform(-DAY_SECONDS, 30 * DAY_SECONDS) for _ in range(3000)]
+        t = base
+        while t < base + 8 * DAY_SECONDS:
+            times.append(t)
+            t += rng.uniform(0, 900)
+        for t in times:
+            if set(schedule.active_channels(t)) != _brute_force(windows, t):
+                mismatches.append(t)
+        return mismatches
+
+    assert run_db(scenario) == []
+
+
+def test_recurring_window_inactive_before_its_start(run_db):
+    async def scenario():
+        schedule = WindowSchedule()
+        start = int(time.time()) + 2 * DAY_SECONDS
+        window = await schedule.add(-1001, start, 3600, "daily")
+        return (
+            schedule.is_active(-1001, start - DAY_SECONDS + 60),  # همان ساعت، یک روز زودتر
+            schedule.is_active(-1001, start + 60),
+            schedule.is_active(-1001, start + DAY_SECONDS + 60),
+            schedule.next_occurrence(window, start - 5 * DAY_SECONDS),
+            start,
+        )
+
+    before, first, second, upcoming, start = run_db(scenario)
+    assert (before, first, second) == (False, True, True)
+    assert upcoming == (start, start + 3600)
+
+
+def test_windows_persist_and_expired_one_offs_are_pruned(run_db):
+    async def scenario():
+        schedule = WindowSchedule()
+        now = time.time()
+        await schedule.add(-1001, now - 7200, 3600, "once")  # تمام‌شده
+        await schedule.add(-1002, now - 60, 3600, "once")
+        await schedule.add(-1003, now - 60, 600, "weekly")
+        reloaded = WindowSchedule()
+        await reloaded.load()
+        return reloaded.active_channels(now), sorted(window.channel_id for window in reloaded.windows())
+
+    active, channel_ids = run_db(scenario)
+    assert active == {-1002, -1003}
+    assert channel_ids == [-1003, -1002]
+
+
+def test_remove_channel(run_db):
+    async def scenario():
+        schedule = WindowSchedule()
+        now = time.time()
+        await schedule.add(-1001, now - 60, 3600, "once")
+        await schedule.add(-1001, now - 60, 3600, "daily")
+        await schedule.add(-1002, now - 60, 3600, "daily")
+        removed = await schedule.remove_channel(-1001, "once")
+        after_once = schedule.is_active(-1001, now)
+        await schedule.remove_channel(-1001)
+        return len(removed), after_once, schedule.active_channels(now)
+
+    assert run_db(scenario) == (1, True, {-1002})
@@ -0,0 +1,161 @@
+# tracing.py
+import asyncio
+import json
+import logging
+import math
+import time
+import traceback
+from collections import deque
+from database import write_traces, load_traces
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+TRACE_RING_SIZE = 5000  # تعداد trace‌های اخیر در حافظه
+TRACE_FLUSH_INTERVAL_SECONDS = 5.0
+TRACE_RETENTION_SECONDS = 7 * 24 * 3600
+TRACE_PRUNE_EVERY = 100  # هر چند ذخیره یک بار trace‌های قدیمی حذف می‌شوند
+
+# مراحل به ترتیب مسیر پیام؛ هر trace یک dict از نام مرحله به زمان یونیکس است
+STAGES = ("source", "received", "parsed", "queued", "dequeued", "paced", "sent")
+
+# بازه‌های گزارش: (نام، مرحله شروع، مرحله پایان)
+SPANS = (
+    ("source_lag", "source", "received"),  # انتشار در کانال منبع تا رسیدن به هندلر
+    ("ingest", "received", "parsed"),  # صف دریافت و تبدیل
+    ("enqueue", "parsed", "queued"),
+    ("queue_wait", "queued", "dequeued"),  # انتظار در outbox
+    ("pacing", "dequeued", "paced"),  # صف مقصد، تأخیر ارسال، محدودیت نرخ و retryها
+    ("send", "paced", "sent"),  # فراخوانی Bot API
+    ("total", "source", "sent"),
+)
+
+
+def _percentile(sorted_values, fraction):
+    # روش nearest-rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def mark(trace, stage, timestamp=None):
+    """زمان رسیدن به یک مرحله را در trace ثبت می‌کند (trace می‌تواند None باشد)."""
+    if trace is not None:
+        trace[stage] = time.time() if timestamp is None else timestamp
+
+
+class Tracer:
+    """
+    جمع‌آوری trace‌های تأخیر پیام از منبع تا تحویل.
+    trace‌های پایان‌یافته در یک بافر حلقوی در حافظه نگه داشته و دسته‌ای در جدول traces ذخیره می‌شوند؛
+    گزارش p50/p95/p99 هر مرحله از بافر (یا اگر بافر کل بازه را پوشش ندهد، از DB) ساخته می‌شود.
+    """
+
+    def __init__(self, ring_size=TRACE_RING_SIZE, flush_interval=TRACE_FLUSH_INTERVAL_SECONDS,
+                 retention_seconds=TRACE_RETENTION_SECONDS):
+        self.flush_interval = flush_interval
+        self.retention_seconds = retention_seconds
+        self._ring = deque(maxlen=ring_size)  # [(channel, finished_at, retries, stages)]
+        self._pending = []
+        self._flushes_since_prune = 0
+        self._started_at = time.time()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def begin(self, source_time=None, received_at=None):
+        """trace جدید با زمان انتشار در منبع (در صورت وجود) و زمان دریافت."""
+        trace = {}
+        if source_time is not None:
+            trace["source"] = source_time
+        mark(trace, "received", received_at)
+        return trace
+
+    def finish(self, trace, channel, retries=0):
+        """trace یک تحویل موفق را ثبت می‌کند."""
+        if trace is None:
+            return
+        finished_at = trace.get("sent") or time.time()
+        entry = (channel, finished_at, retries, trace)
+        self._ring.append(entry)
+        self._pending.append(entry)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            rows = [(channel, finished_at, retries, json.dumps(stages, separators=(',', ':')))
+                    for channel, finished_at, retries, stages in pending]
+            self._flushes_since_prune += 1
+            prune_before = None
+            if self._flushes_since_prune >= TRACE_PRUNE_EVERY:
+                self._flushes_since_prune = 0
+                prune_before = time.time() - self.retention_seconds
+            if not await write_traces(rows, prune_before):
+                # trace فقط برای گزارش است؛ در صورت خطا دور ریخته می‌شود تا حافظه رشد نکند
+                logger.warning(f"Dropped {len(rows)} traces after a DB error")
+
+    async def _entries_since(self, since):
+        ring = self._ring
+        if ring and (ring[0][1] <= since or (len(ring) < ring.maxlen and self._started_at <= since)):
+            return [entry for entry in ring if entry[1] >= since]
+        await self.flush()
+        return [(channel, finished_at, retries, json.loads(stages))
+                for channel, finished_at, retries, stages in await load_traces(since)]
+
+    async def latency_report(self, window_seconds=3600):
+        """
+        برای هر بازه در SPANS: {"n", "p50", "p95", "p99"} به ثانیه، روی trace‌های window_seconds اخیر.
+        خروجی: (تعداد trace، {span: آمار}، تعداد کل retryها)
+        """
+        entries = await self._entries_since(time.time() - window_seconds)
+        durations = {name: [] for name, _, _ in SPANS}
+        total_retries = 0
+        for channel, finished_at, retries, stages in entries:
+            total_retries += retries
+            for name, start_stage, end_stage in SPANS:
+                start, end = stages.get(start_stage), stages.get(end_stage)
+                if start is not None and end is not None:
+                    durations[name].append(max(0.0, end - start))
+
+        report = {}
+        for name, values in durations.items():
+            if not values:
+                continue
+            values.sort()
+            report[name] = {
+                "n": len(values),
+                "p50": _percentile(values, 0.50),
+                "p95": _percentile(values, 0.95),
+                "p99": _percentile(values, 0.99),
+            }
+        return len(entries), report, total_retries
+
+    async def run(self):
+        logger.info("Trace flush task started.")
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in trace flush loop: {e}\n{traceback.format_exc()}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        logger.info("Tracer flushed and closed.")
+
+
+tracer = Tracer()
@@ -2,55 +2,294 @@
 import asyncio
 import logging  # ایمپورت کردن لاگ
 import time
+from collections import deque
+from metrics import receive_backlog_drained, receive_backlog_expired, receive_backlog_dropped
 
 # لاگر حرفه‌ای مخصوص این ماژول
 logger = logging.getLogger(__name__)
 
-skipped_messages_lock = asyncio.Lock()
+# محدودیت‌های تلگرام برای ربات: حدود ۳۰ پیام در ثانیه در کل و حدود ۲۰ پیام در دقیقه برای هر گروه/کانال
+GLOBAL_SENDS_PER_SECOND = 30
+GLOBAL_SEND_BURST = 30
+PER_CHAT_SEND_BURST = 3
+
+# کنترل flood: پس از RetryAfter/FloodWait سرعت نصف و پس از پایان توقف به مرور زمان بیشتر می‌شود (AIMD)
+FLOOD_DECREASE_FACTOR = 0.5
+FLOOD_INCREASE_PER_SECOND = 0.05  # افزایش ضریب سرعت در هر ثانیه پس از پایان توقف؛ از ۰.۵ تا ۱ در ۱۰ ثانیه
+FLOOD_MIN_RATE_FACTOR = 0.1
+
+# پیام‌هایی که به خاطر محدودیت نرخ دریافت رد شده‌اند تا این مدت برای ارسال بعدی نگه داشته می‌شوند
+SKIPPED_MESSAGE_TTL_SECONDS = 300
+SKIPPED_MESSAGES_MAX = 200
+
+
+class TokenBucket:
+    """
+    سطل توکن ساده: rate توکن در ثانیه پر می‌شود و حداکثر capacity توکن نگه می‌دارد.
+    reserve() توکن را حتی در صورت نبود برمی‌دارد (موجودی منفی) و زمان انتظار دقیق را برمی‌گرداند،
+    پس درخواست‌های همزمان به ترتیب رسیدن و بدون انتظار اضافه سرویس می‌گیرند.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def available(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens
+
+    def try_take(self, now=None):
+        if self.available(now) >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
 
 class MessageRateLimiter:
-    def __init__(self, max_messages_per_minute):
+    """
+    محدودیت نرخ دریافت با سطل توکن (بدون انفجار دو برابری در مرز پنجره‌های ثابت).
+    پیام‌های رد شده در یک صف محدود به ترتیب زمان نگه داشته می‌شوند تا وقتی ظرفیت آزاد شد
+    دوباره پردازش شوند؛ پیام‌های قدیمی‌تر از TTL از ابتدای صف حذف می‌شوند.
+    شمارنده‌های drained/expired/dropped با برچسب limiter=name در metrics هم ثبت می‌شوند.
+    """
+
+    def __init__(self, max_messages_per_minute, skipped_ttl_seconds=SKIPPED_MESSAGE_TTL_SECONDS,
+                 max_skipped=SKIPPED_MESSAGES_MAX, name="receive"):
         self.max_messages = max_messages_per_minute
-        self.message_counter = 0
-        self.last_reset_time = time.monotonic()
-        self.skipped_messages = []
+        self.name = name
+        self.bucket = TokenBucket(max_messages_per_minute / 60.0, max_messages_per_minute)
+        self.skipped_ttl_seconds = skipped_ttl_seconds
+        self.max_skipped = max_skipped
+        self.skipped_messages = deque()  # [(message, زمان رد شدن)]
+        self._skipped_lock = asyncio.Lock()
+        self._skipped_event = asyncio.Event()
+        self.drained = 0
+        self.expired = 0
+        self.dropped = 0
 
     def can_send(self):
-        current_time = time.monotonic()
-        if current_time - self.last_reset_time >= 60:
-            self.message_counter = 0
-            self.last_reset_time = current_time
-            logger.debug("Receive rate limiter reset.")
-            return True
-        return self.message_counter < self.max_messages
+        return self.bucket.available() >= 1
 
     def increment(self):
-        self.message_counter += 1
+        self.bucket.try_take()
+
+    def seconds_until_available(self):
+        """زمان تقریبی تا آزاد شدن ظرفیت دریافت پیام بعدی."""
+        missing = 1 - self.bucket.available()
+        return max(0.0, missing / self.bucket.rate)
+
+    def _expire_skipped(self, now):
+        cutoff = now - self.skipped_ttl_seconds
+        skipped = self.skipped_messages
+        while skipped and skipped[0][1] < cutoff:
+            skipped.popleft()
+            self.expired += 1
+            receive_backlog_expired.inc(limiter=self.name)
 
     async def add_skipped(self, message):
-        async with skipped_messages_lock:
-            self.skipped_messages.append((message, time.monotonic()))
+        """message یک tuple است که عنصر اولش متن پیام است و بدون تغییر از next_skipped برمی‌گردد."""
+        async with self._skipped_lock:
+            now = time.monotonic()
+            self._expire_skipped(now)
+            if len(self.skipped_messages) >= self.max_skipped:
+                self.skipped_messages.popleft()
+                self.dropped += 1
+                receive_backlog_dropped.inc(limiter=self.name)
+            self.skipped_messages.append((message, now))
+            self._skipped_event.set()
             # لاگ به logger تغییر کرد
             logger.info(f"Message skipped due to rate limit: {message[0][:30]}...")
 
-    async def get_skipped(self):
-        async with skipped_messages_lock:
-            return [(msg, t) for msg, t in self.skipped_messages if time.monotonic() - t < 300]
+    async def next_skipped(self):
+        """
+        منتظر می‌ماند تا پیام رد شده تازه‌ای باشد و ظرفیت دریافت آزاد شود، سپس قدیمی‌ترین آن را
+        برمی‌گرداند. ظرفیت مصرف نمی‌شود؛ فراخواننده پس از پردازش increment() را صدا می‌زند.
+        """
+        while True:
+            async with self._skipped_lock:
+                self._expire_skipped(time.monotonic())
+                if not self.skipped_messages:
+                    self._skipped_event.clear()
+                elif self.can_send():
+                    self.drained += 1
+                    receive_backlog_drained.inc(limiter=self.name)
+                    return self.skipped_messages.popleft()[0]
+            if not self._skipped_event.is_set():
+                await self._skipped_event.wait()
+            else:
+                await asyncio.sleep(self.seconds_until_available() + 0.05)
 
-class SendRateLimiter:
-    def __init__(self, max_messages_per_minute):
-        self.max_messages = max_messages_per_minute
-        self.message_counter = 0
-        self.last_reset_time = time.monotonic()
+    def skipped_stats(self):
+        return {
+            "backlog": len(self.skipped_messages),
+            "drained": self.drained,
+            "expired": self.expired,
+            "dropped": self.dropped,
+        }
 
-    def can_send(self):
-        current_time = time.monotonic()
-        if current_time - self.last_reset_time >= 60:
-            self.message_counter = 0
-            self.last_reset_time = current_time
-            logger.debug("Send rate limiter reset.")
-            return True
-        return self.message_counter < self.max_messages
 
-    def increment(self):
-        self.message_counter += 1
\ No newline at end of file
+class FloodController:
+    """
+    کنترل flood مشترک بین همه ارسال‌ها و ویرایش‌های یک چت.
+    پس از RetryAfter یا FloodWait، همه درخواست‌های آن چت دقیقاً به اندازه زمان اعلام‌شده سرور
+    متوقف می‌شوند. ضریب سرعت با هر flood ضرب در FLOOD_DECREASE_FACTOR می‌شود و پس از پایان توقف
+    با گذشت زمان (FLOOD_INCREASE_PER_SECOND در ثانیه) دوباره به ۱ می‌رسد؛ سرعت بازیابی به تعداد
+    ارسال‌های موفق یک مقصد کند وابسته نیست.
+    """
+
+    def __init__(self, decrease_factor=FLOOD_DECREASE_FACTOR, increase_per_second=FLOOD_INCREASE_PER_SECOND,
+                 min_factor=FLOOD_MIN_RATE_FACTOR):
+        self.decrease_factor = decrease_factor
+        self.increase_per_second = increase_per_second
+        self.min_factor = min_factor
+        self._paused_until = {}  # chat_id -> زمان پایان توقف (monotonic)
+        self._factors = {}  # chat_id -> (ضریب سرعت پس از آخرین flood، زمان شروع بازیابی)
+        self.floods = 0
+        self.total_pause = 0.0
+
+    def pause(self, seconds, chat_id, now=None):
+        """ارسال به chat_id را seconds ثانیه متوقف و سرعت آن را کم می‌کند."""
+        if now is None:
+            now = time.monotonic()
+        until = max(now + seconds, self._paused_until.get(chat_id, 0.0))
+        self._paused_until[chat_id] = until
+        factor = max(self.min_factor, self.factor(chat_id, now) * self.decrease_factor)
+        # بازیابی از پایان توقف شروع می‌شود
+        self._factors[chat_id] = (factor, until)
+        self.floods += 1
+        self.total_pause += seconds
+        logger.warning(f"Flood control: pausing chat {chat_id} for {seconds:.1f}s, rate factor now {factor:.2f}")
+
+    def pause_remaining(self, chat_id, now=None):
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self._paused_until.get(chat_id, 0.0) - now)
+
+    async def wait(self, chat_id):
+        """تا پایان توقف chat_id صبر می‌کند؛ مدت انتظار را برمی‌گرداند."""
+        waited = 0.0
+        remaining = self.pause_remaining(chat_id)
+        # حلقه برای توقف‌هایی که در حین انتظار تمدید شده‌اند
+        while remaining > 0:
+            await asyncio.sleep(remaining)
+            waited += remaining
+            remaining = self.pause_remaining(chat_id)
+        return waited
+
+    def factor(self, chat_id, now=None):
+        """ضریب سرعت فعلی chat_id (بین min_factor و ۱) با افزایش جمعی بر حسب زمان."""
+        state = self._factors.get(chat_id)
+        if state is None:
+            return 1.0
+        if now is None:
+            now = time.monotonic()
+        factor, recover_from = state
+        factor += self.increase_per_second * max(0.0, now - recover_from)
+        if factor >= 1.0:
+            del self._factors[chat_id]
+            return 1.0
+        return factor
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "floods": self.floods,
+            "total_pause_seconds": round(self.total_pause, 3),
+            "paused": sum(1 for until in self._paused_until.values() if until > now),
+            "throttled": sum(1 for chat_id in list(self._factors) if self.factor(chat_id, now) < 1.0),
+        }
+
+
+flood_controller = FloodController()
+
+
+class TokenBucketRateLimiter:
+    """
+    محدودکننده نرخ ارسال با یک سطل سراسری و یک سطل برای هر چت مقصد.
+    acquire(chat_id) دقیقاً به اندازه لازم صبر می‌کند و آمار زمان انتظار را نگه می‌دارد.
+    توقف‌ها و ضریب سرعت کنترل flood مشترک روی سطل همان چت اعمال می‌شوند.
+    """
+
+    def __init__(self, per_chat_per_minute, global_per_second=GLOBAL_SENDS_PER_SECOND,
+                 per_chat_burst=PER_CHAT_SEND_BURST, global_burst=GLOBAL_SEND_BURST, flood=None):
+        self.per_chat_rate = per_chat_per_minute / 60.0
+        self.per_chat_burst = per_chat_burst
+        self.global_bucket = TokenBucket(global_per_second, global_burst)
+        self.flood = flood or flood_controller
+        self._chat_buckets = {}
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id):
+        """یک مجوز ارسال برای chat_id می‌گیرد و مدت انتظار (ثانیه) را برمی‌گرداند."""
+        flood_wait = await self.flood.wait(chat_id)
+        now = time.monotonic()
+        chat_bucket = self._chat_bucket(chat_id)
+        chat_bucket.rate = self.per_chat_rate * self.flood.factor(chat_id)
+        wait = max(chat_bucket.reserve(now), self.global_bucket.reserve(now))
+
+        self.acquired += 1
+        if wait > 0:
+            self.waited += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            logger.debug(f"Send limiter: waiting {wait:.2f}s for chat {chat_id}")
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # مجوز استفاده نشده را برمی‌گردانیم
+                chat_bucket.refund()
+                self.global_bucket.refund()
+                raise
+        return wait + flood_wait
+
+    def on_flood(self, chat_id, seconds):
+        """RetryAfter دریافت‌شده برای یک چت را به کنترل flood گزارش می‌کند."""
+        self.flood.pause(seconds, chat_id)
+        # پس از توقف، انفجار ارسال‌های انباشته مجاز نیست
+        chat_bucket = self._chat_bucket(chat_id)
+        chat_bucket.tokens = min(chat_bucket.tokens, 0)
+
+    def stats(self):
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "total_wait_seconds": round(self.total_wait, 3),
+            "avg_wait_seconds": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+            "flood": self.flood.stats(),
+        }
+
+
+def retry_after_seconds(error):
+    """مقدار retry_after خطای RetryAfter را (int یا timedelta) به ثانیه تبدیل می‌کند."""
+    retry_after = getattr(error, "retry_after", 0) or 0
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
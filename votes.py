@@ -0,0 +1,341 @@
+# votes.py
+import asyncio
+import logging
+import traceback
+from collections import OrderedDict
+from telegram.error import RetryAfter, BadRequest, NetworkError
+from database import load_message_votes, flush_votes, register_message_in_votes, get_token_address_for_message
+from render import build_post_keyboard
+from utils import retry_after_seconds
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+VOTE_FLUSH_INTERVAL_SECONDS = 0.5  # حداکثر فاصله بین دو ذخیره دسته‌ای
+VOTE_FLUSH_MAX_VOTES = 200  # با رسیدن تعداد رای‌های معوق به این عدد، فوراً ذخیره می‌شود
+MAX_CACHED_MESSAGES = 2000  # تعداد پیام‌هایی که وضعیت رایشان در حافظه می‌ماند
+EDIT_COALESCE_WINDOW_SECONDS = 1.5  # رای‌های رسیده در این پنجره با یک edit نمایش داده می‌شوند
+EDIT_MAX_RETRIES = 3  # تلاش مجدد edit پس از خطای شبکه (TimedOut/NetworkError)
+EDIT_RETRY_DELAY_SECONDS = 2.0  # تأخیر پایه بین تلاش‌های مجدد edit
+EDIT_MAX_FLOOD_WAITS = 5  # سقف توقف‌های RetryAfter برای یک پیام
+
+
+class _MessageVotes:
+    __slots__ = ("token_address", "green", "red", "users")
+
+    def __init__(self, token_address=None, green=0, red=0, users=None):
+        self.token_address = token_address
+        self.green = green
+        self.red = red
+        self.users = users if users is not None else {}
+
+
+class VoteJournal:
+    """
+    ژورنال رای‌ها در حافظه (write-behind).
+    شمارش‌ها و آخرین رای هر کاربر در حافظه نگه داشته می‌شوند و پاسخ فوری برمی‌گردد؛
+    تغییرات هر چند میلی‌ثانیه یا با رسیدن به سقف، در یک تراکنش در DB ذخیره می‌شوند.
+    پیامی که در حافظه نیست (مثلاً پس از ری‌استارت یا کرش) در اولین رای از DB بازسازی می‌شود.
+    """
+
+    def __init__(self, flush_interval=VOTE_FLUSH_INTERVAL_SECONDS, flush_max_votes=VOTE_FLUSH_MAX_VOTES,
+                 max_cached_messages=MAX_CACHED_MESSAGES):
+        self.flush_interval = flush_interval
+        self.flush_max_votes = flush_max_votes
+        self.max_cached_messages = max_cached_messages
+        self._messages = OrderedDict()  # message_id -> _MessageVotes (ترتیب LRU)
+        self._pending = {}  # (message_id, user_id) -> vote_type
+        self._flushing = set()  # message_id‌های دسته‌ای که در حال ذخیره است (تا پایان ذخیره dirty هستند)
+        self._loading = {}  # message_id -> Future بازسازی در حال اجرا
+        self._flush_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    async def _get_state(self, message_id):
+        state = self._messages.get(message_id)
+        if state is not None:
+            self._messages.move_to_end(message_id)
+            return state
+
+        loading = self._loading.get(message_id)
+        if loading is not None:
+            return await loading
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[message_id] = future
+        state = None
+        try:
+            loaded = await load_message_votes(message_id)
+            if loaded is not None:
+                token_address, green, red, users = loaded
+                state = _MessageVotes(token_address, green, red, users)
+                self._messages[message_id] = state
+                self._trim()
+                logger.debug(f"Vote state for Msg {message_id} rebuilt from DB: G={green}, R={red}, users={len(users)}")
+            return state
+        finally:
+            # منتظرهای همزمان در صورت خطا None (یعنی "error") دریافت می‌کنند
+            del self._loading[message_id]
+            future.set_result(state)
+
+    async def register(self, message_id, chat_id, token_address):
+        """پیام ارسال‌شده را در DB ثبت و وضعیت خالی آن را در حافظه ایجاد می‌کند."""
+        await register_message_in_votes(message_id, chat_id, token_address)
+        state = self._messages.get(message_id)
+        if state is None:
+            self._messages[message_id] = _MessageVotes(token_address)
+            self._trim()
+        else:
+            state.token_address = token_address
+
+    async def process_vote(self, message_id, user_id, vote_type):
+        """
+        همان قرارداد database.process_vote: None برای رای تکراری،
+        "error" در صورت خطا و (green, red) برای رای ثبت‌شده.
+        """
+        state = await self._get_state(message_id)
+        if state is None:
+            return "error"
+
+        previous = state.users.get(user_id)
+        if previous == vote_type:
+            logger.debug(f"User {user_id} voted {vote_type} again for Msg {message_id}. No change.")
+            return None
+
+        if previous == 'green':
+            state.green -= 1
+        elif previous == 'red':
+            state.red -= 1
+        if vote_type == 'green':
+            state.green += 1
+        elif vote_type == 'red':
+            state.red += 1
+        state.users[user_id] = vote_type
+
+        self._pending[(message_id, user_id)] = vote_type
+        if len(self._pending) >= self.flush_max_votes:
+            self._flush_event.set()
+
+        logger.info(f"User {user_id} voted {vote_type} for Msg {message_id} (buffered)")
+        return state.green, state.red
+
+    async def get_token_address(self, message_id):
+        """آدرس قرارداد را از حافظه و در صورت نبود، از DB برمی‌گرداند."""
+        state = self._messages.get(message_id)
+        if state is not None and state.token_address:
+            return state.token_address
+        return await get_token_address_for_message(message_id)
+
+    async def flush(self):
+        """رای‌های معوق را در یک تراکنش دسته‌ای ذخیره می‌کند."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            votes = [(message_id, user_id, vote_type) for (message_id, user_id), vote_type in batch.items()]
+            # تا پایان نوشتن، وضعیت این پیام‌ها در حافظه تنها نسخه درست است و نباید حذف شود
+            self._flushing = {message_id for message_id, _ in batch}
+            try:
+                flushed = await flush_votes(votes)
+            finally:
+                self._flushing = set()
+            if not flushed:
+                # رای‌های جدیدتر که در این فاصله رسیده‌اند اولویت دارند
+                for key, vote_type in batch.items():
+                    self._pending.setdefault(key, vote_type)
+                logger.warning(f"Vote flush failed, {len(self._pending)} votes kept in memory for next flush.")
+                return
+            self._trim()
+
+    def _trim(self):
+        if len(self._messages) <= self.max_cached_messages:
+            return
+        dirty = {message_id for message_id, _ in self._pending} | self._flushing
+        for message_id in list(self._messages):
+            if len(self._messages) <= self.max_cached_messages:
+                break
+            if message_id not in dirty:
+                del self._messages[message_id]
+
+    async def run(self):
+        """وظیفه پس‌زمینه ذخیره دوره‌ای رای‌ها."""
+        logger.info("Vote journal flush task started.")
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_event.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in vote journal flush loop: {e}\n{traceback.format_exc()}")
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self):
+        """وظیفه پس‌زمینه را متوقف و رای‌های باقی‌مانده را ذخیره می‌کند."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        logger.info("Vote journal flushed and closed.")
+
+
+class VoteMarkupCoalescer:
+    """
+    ویرایش‌های کیبورد رای را برای هر پیام در یک پنجره زمانی تجمیع می‌کند.
+    چند رای در یک پنجره فقط یک edit با آخرین شمارش تولید می‌کنند؛ اگر شمارش
+    با آخرین نسخه نمایش‌داده‌شده یکی باشد edit انجام نمی‌شود و RetryAfter رعایت می‌شود.
+    هر edit از rate_limiter (همان TokenBucketRateLimiter ارسال‌ها، در bot.py تنظیم می‌شود) مجوز می‌گیرد.
+    """
+
+    def __init__(self, window=EDIT_COALESCE_WINDOW_SECONDS, max_tracked_messages=MAX_CACHED_MESSAGES,
+                 max_retries=EDIT_MAX_RETRIES, retry_delay=EDIT_RETRY_DELAY_SECONDS, max_flood_waits=EDIT_MAX_FLOOD_WAITS,
+                 rate_limiter=None):
+        self.window = window
+        self.rate_limiter = rate_limiter
+        self.max_tracked_messages = max_tracked_messages
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_flood_waits = max_flood_waits
+        self._latest = {}  # (chat_id, message_id) -> (bot, token_address, green, red)
+        self._waiting = {}  # (chat_id, message_id) -> تعداد درخواست‌هایی که هنوز به edit نرسیده‌اند
+        self._rendered = OrderedDict()  # (chat_id, message_id) -> (green, red) نمایش‌داده‌شده
+        self._tasks = {}
+        self.requested = 0
+        self.edits_sent = 0
+        self.coalesced = 0  # درخواست‌هایی که در edit یک درخواست جدیدتر نمایش داده شدند
+        self.skipped_unchanged = 0  # درخواست‌هایی که شمارششان همان نسخه نمایش‌داده‌شده بود
+        self.failed = 0  # درخواست‌هایی که نمایش داده نشدند (خطا پس از سقف تلاش یا لغو)
+        self.retries = 0
+
+    @property
+    def edits_saved(self):
+        return self.coalesced + self.skipped_unchanged
+
+    def stats(self):
+        return {"requested": self.requested, "edits_sent": self.edits_sent, "edits_saved": self.edits_saved,
+                "coalesced": self.coalesced, "skipped_unchanged": self.skipped_unchanged,
+                "failed": self.failed, "retries": self.retries, "pending": len(self._latest)}
+
+    def mark_rendered(self, chat_id, message_id, green_votes, red_votes):
+        key = (chat_id, message_id)
+        self._rendered[key] = (green_votes, red_votes)
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_tracked_messages:
+            self._rendered.popitem(last=False)
+
+    def schedule(self, bot, chat_id, message_id, token_address, green_votes, red_votes):
+        """درخواست edit را ثبت می‌کند؛ ارسال واقعی پس از پایان پنجره انجام می‌شود."""
+        key = (chat_id, message_id)
+        self.requested += 1
+        self._latest[key] = (bot, token_address, green_votes, red_votes)
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key):
+        chat_id, message_id = key
+        retries = 0
+        flood_waits = 0
+        failed = False
+        try:
+            await asyncio.sleep(self.window)
+            while True:
+                bot, token_address, green_votes, red_votes = self._latest[key]
+                counts = (green_votes, red_votes)
+                requests = self._waiting.pop(key, 0)
+                if self._rendered.get(key) == counts:
+                    self.skipped_unchanged += requests
+                    logger.debug(f"Skipped keyboard edit for Msg {message_id}: counts unchanged {counts}")
+                    break
+                try:
+                    # edit‌ها از همان سطل توکن و توقف flood ارسال‌ها مجوز می‌گیرند
+                    await self.rate_limiter.acquire(chat_id)
+                    await bot.edit_message_reply_markup(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        reply_markup=build_post_keyboard(token_address, green_votes, red_votes)
+                    )
+                    self.edits_sent += 1
+                    self.coalesced += requests - 1
+                    retries = 0
+                    self.mark_rendered(chat_id, message_id, green_votes, red_votes)
+                except RetryAfter as e:
+                    # درخواست‌ها برای دور بعد (با آخرین شمارش) برمی‌گردند
+                    self._waiting[key] = self._waiting.get(key, 0) + requests
+                    flood_waits += 1
+                    wait_time = retry_after_seconds(e)
+                    self.rate_limiter.on_flood(chat_id, wait_time)
+                    if flood_waits > self.max_flood_waits:
+                        logger.error(f"Too many flood waits editing keyboard for Msg {message_id}. Giving up.")
+                        failed = True
+                        break
+                    logger.warning(f"Flood control on keyboard edit for Msg {message_id}. Waiting {wait_time:.1f}s")
+                    continue
+                except BadRequest as e:
+                    if "not modified" in str(e).lower():
+                        self.skipped_unchanged += requests
+                        self.mark_rendered(chat_id, message_id, green_votes, red_votes)
+                    else:
+                        logger.error(f"BadRequest editing keyboard for Msg {message_id}: {e}")
+                        self.failed += requests
+                        failed = True
+                        break
+                except NetworkError as e:
+                    # TimedOut هم زیرکلاس NetworkError است؛ خطای گذرا، با سقف تلاش دوباره می‌فرستیم
+                    self._waiting[key] = self._waiting.get(key, 0) + requests
+                    retries += 1
+                    if retries > self.max_retries:
+                        logger.error(f"Giving up keyboard edit for Msg {message_id} after {self.max_retries} retries: {e}")
+                        failed = True
+                        break
+                    self.retries += 1
+                    wait_time = self.retry_delay * retries
+                    logger.warning(f"Network error editing keyboard for Msg {message_id} ({e}). Retry {retries}/{self.max_retries} in {wait_time:.1f}s")
+                    await asyncio.sleep(wait_time)
+                    continue
+
+                # اگر در حین edit رای جدیدی رسیده، یک پنجره دیگر صبر و دوباره تلاش می‌کنیم
+                if self._latest[key][2:] == counts:
+                    break
+                await asyncio.sleep(self.window)
+        except asyncio.CancelledError:
+            failed = True
+            raise
+        except Exception as e:
+            failed = True
+            logger.error(f"Error editing keyboard for Msg {message_id}: {e}\n{traceback.format_exc()}")
+        finally:
+            self._tasks.pop(key, None)
+            self._latest.pop(key, None)
+            # درخواست‌های باقی‌مانده یا همان شمارش نمایش‌داده‌شده را دارند یا با خطا رها شده‌اند
+            leftover = self._waiting.pop(key, 0)
+            if failed:
+                self.failed += leftover
+            else:
+                self.skipped_unchanged += leftover
+
+    async def close(self):
+        """edit‌های در انتظار را لغو می‌کند."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"Vote markup coalescer closed. Stats: {self.stats()}")
+
+
+vote_journal = VoteJournal()
+vote_markup_coalescer = VoteMarkupCoalescer()
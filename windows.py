@@ -0,0 +1,219 @@
+# windows.py
+import bisect
+import logging
+import time
+from collections import Counter, namedtuple
+from database import load_windows, insert_window, delete_windows
+
+# لاگر حرفه‌ای مخصوص این ماژول
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 3600
+WEEK_SECONDS = 7 * DAY_SECONDS
+# دوره تکرار هر نوع پنجره؛ once دوره ندارد. همه دوره‌ها باید WEEK_SECONDS را بشمارند (چرخه مشترک)
+RECURRENCE_PERIODS = {"once": None, "daily": DAY_SECONDS, "weekly": WEEK_SECONDS}
+
+_EMPTY = frozenset()
+
+Window = namedtuple("Window", ("id", "channel_id", "start_time", "duration", "recurrence"))
+
+
+class _SegmentIndex:
+    """
+    ایندکس بازه‌ای ثابت: مرزهای مرتب همه بازه‌ها و مجموعه کانال‌های فعال در هر قطعه میان دو مرز.
+    ساخت O(n log n) فقط هنگام تغییر پنجره‌ها؛ هر پرس‌وجو یک bisect است (O(log n)).
+    """
+
+    def __init__(self, intervals, lower=None, upper=None):
+        """intervals: [(start, end, channel_id)] نیم‌باز [start, end)؛ lower و upper مرزهای اختیاری دامنه."""
+        events = {}
+        for start, end, channel_id in intervals:
+            if end > start:
+                events.setdefault(start, []).append((channel_id, 1))
+                events.setdefault(end, []).append((channel_id, -1))
+        for bound in (lower, upper):
+            if bound is not None:
+                events.setdefault(bound, [])
+
+        self.boundaries = sorted(events)
+        self.segments = []  # segments[i]: کانال‌های فعال در [boundaries[i], boundaries[i + 1])
+        active = Counter()
+        for boundary in self.boundaries:
+            for channel_id, delta in events[boundary]:
+                active[channel_id] += delta
+            self.segments.append(frozenset(channel_id for channel_id, count in active.items() if count > 0))
+
+    def lookup(self, t):
+        """(کانال‌های فعال در لحظه t، شروع قطعه، پایان قطعه)؛ بیرون از مرزها مجموعه خالی است."""
+        boundaries = self.boundaries
+        index = bisect.bisect_right(boundaries, t) - 1
+        segment_end = boundaries[index + 1] if index + 1 < len(boundaries) else float("inf")
+        if index < 0:
+            return _EMPTY, float("-inf"), segment_end
+        return self.segments[index], boundaries[index], segment_end
+
+
+class WindowSchedule:
+    """
+    پنجره‌های زمانی ارسال به کانال‌های دوم؛ ماندگار در جدول secondary_windows و ایندکس‌شده در حافظه.
+    پنجره‌های تکرارشونده (روزانه/هفتگی) روی یک چرخه هفتگی و پنجره‌های یک‌باره روی محور زمان مطلق
+    ایندکس می‌شوند. start_time پنجره تکرارشونده اولین نوبت آن است: پیش از آن پنجره در ایندکس هفتگی
+    نیست و ایندکس در اولین start_time آینده دوباره ساخته می‌شود. active_channels() بدون دسترسی به DB
+    با دو bisect جواب می‌دهد و نتیجه را تا مرز بعدی کش می‌کند، پس مسیر ارسال در بیشتر پیام‌ها فقط
+    یک مقایسه زمان انجام می‌دهد.
+    """
+
+    def __init__(self):
+        self._windows = {}  # id -> Window
+        self._recurring = _SegmentIndex([], 0, WEEK_SECONDS)
+        self._once = _SegmentIndex([])
+        # بازه‌ای از زمان مطلق که مجموعه پنجره‌های تکرارشونده شروع‌شده در آن ثابت است
+        self._recurring_span = (float("-inf"), float("inf"))
+        self._cache = (_EMPTY, 0.0, 0.0)  # (کانال‌ها، معتبر از، معتبر تا)
+
+    def _rebuild(self, now=None):
+        """ایندکس‌ها را می‌سازد؛ فقط پنجره‌های تکرارشونده‌ای که تا now شروع شده‌اند در چرخه هفتگی می‌آیند."""
+        if now is None:
+            now = time.time()
+        recurring, once = [], []
+        started_since, next_start = float("-inf"), float("inf")
+        for window in self._windows.values():
+            period = RECURRENCE_PERIODS[window.recurrence]
+            if period is None:
+                once.append((window.start_time, window.start_time + window.duration, window.channel_id))
+                continue
+            if window.start_time > now:
+                next_start = min(next_start, window.start_time)
+                continue
+            started_since = max(started_since, window.start_time)
+            # هر نوبت در فاز هفته؛ نوبتی که از انتهای هفته رد شود به دو تکه تقسیم می‌شود
+            duration = min(window.duration, period)
+            for k in range(WEEK_SECONDS // period):
+                start = window.start_time % period + k * period
+                end = start + duration
+                if end <= WEEK_SECONDS:
+                    recurring.append((start, end, window.channel_id))
+                else:
+                    recurring.append((start, WEEK_SECONDS, window.channel_id))
+                    recurring.append((0, end - WEEK_SECONDS, window.channel_id))
+        self._recurring = _SegmentIndex(recurring, 0, WEEK_SECONDS)
+        self._once = _SegmentIndex(once)
+        self._recurring_span = (started_since, next_start)
+        self._cache = (_EMPTY, 0.0, 0.0)
+
+    def _expired_once_ids(self, now):
+        return [window.id for window in self._windows.values()
+                if window.recurrence == "once" and window.start_time + window.duration <= now]
+
+    async def _prune(self, now):
+        """پنجره‌های یک‌باره تمام‌شده را از DB و حافظه حذف می‌کند."""
+        expired = self._expired_once_ids(now)
+        if expired and await delete_windows(expired) is not None:
+            for window_id in expired:
+                self._windows.pop(window_id, None)
+            logger.info(f"Pruned {len(expired)} expired one-off window(s)")
+
+    async def load(self):
+        """پنجره‌ها را یک بار از DB بارگیری و ایندکس را می‌سازد."""
+        rows = await load_windows()
+        if rows is None:
+            logger.error("Could not load secondary windows from DB. No secondary channel is scheduled.")
+            rows = []
+        windows = {}
+        for row in rows:
+            window = Window(*row)
+            if window.recurrence not in RECURRENCE_PERIODS or window.duration <= 0:
+                logger.error(f"Skipping invalid secondary window {window}")
+                continue
+            windows[window.id] = window
+        self._windows = windows
+        await self._prune(time.time())
+        self._rebuild()
+        logger.info(f"Loaded {len(self._windows)} secondary window(s) for {len(self.channel_ids())} channel(s)")
+        return self.windows()
+
+    async def add(self, channel_id, start_time, duration, recurrence="once"):
+        """پنجره جدید را ذخیره و ایندکس را به‌روز می‌کند؛ در صورت خطای DB None برمی‌گرداند."""
+        if recurrence not in RECURRENCE_PERIODS:
+            raise ValueError(f"Unknown recurrence {recurrence!r} (expected one of {', '.join(RECURRENCE_PERIODS)})")
+        if duration <= 0:
+            raise ValueError("Window duration must be positive")
+        window_id = await insert_window(channel_id, int(start_time), int(duration), recurrence)
+        if window_id is None:
+            return None
+        window = Window(window_id, channel_id, int(start_time), int(duration), recurrence)
+        self._windows[window_id] = window
+        await self._prune(time.time())
+        self._rebuild()
+        return window
+
+    async def remove(self, window_ids):
+        """پنجره‌ها را حذف می‌کند؛ خروجی: idهای حذف‌شده یا None در صورت خطای DB."""
+        window_ids = [window_id for window_id in window_ids if window_id in self._windows]
+        if not window_ids:
+            return []
+        if await delete_windows(window_ids) is None:
+            return None
+        for window_id in window_ids:
+            del self._windows[window_id]
+        self._rebuild()
+        return window_ids
+
+    async def remove_channel(self, channel_id, recurrence=None):
+        """همه پنجره‌های یک کانال (یا فقط یک نوع تکرار) را حذف می‌کند."""
+        return await self.remove([
+            window.id for window in self._windows.values()
+            if window.channel_id == channel_id and (recurrence is None or window.recurrence == recurrence)
+        ])
+
+    def windows(self):
+        return sorted(self._windows.values(), key=lambda window: window.id)
+
+    def channel_ids(self):
+        return {window.channel_id for window in self._windows.values()}
+
+    def active_channels(self, now=None):
+        """کانال‌هایی که اکنون (یا در لحظه now) حداقل یک پنجره فعال دارند."""
+        if now is None:
+            now = time.time()
+        channels, valid_from, valid_until = self._cache
+        if valid_from <= now < valid_until:
+            return channels
+
+        span_start, span_end = self._recurring_span
+        if not span_start <= now < span_end:
+            # یک پنجره تکرارشونده به اولین نوبتش رسیده (یا لحظه‌ای پیش از شروع یکی پرسیده شده)
+            self._rebuild(now)
+            span_start, span_end = self._recurring_span
+        phase = now % WEEK_SECONDS
+        recurring, phase_start, phase_end = self._recurring.lookup(phase)
+        once, once_start, once_end = self._once.lookup(now)
+        channels = recurring | once if once else recurring
+        # نتیجه تا اولین مرز بعدی در هر دو ایندکس معتبر است
+        valid_from = max(now - (phase - phase_start), once_start, span_start)
+        valid_until = min(now + (phase_end - phase), once_end, span_end)
+        self._cache = (channels, valid_from, valid_until)
+        return channels
+
+    def is_active(self, channel_id, now=None):
+        return channel_id in self.active_channels(now)
+
+    def next_occurrence(self, window, now=None):
+        """(شروع، پایان) نوبت فعلی یا بعدی یک پنجره؛ برای پنجره یک‌باره تمام‌شده None."""
+        if now is None:
+            now = time.time()
+        period = RECURRENCE_PERIODS[window.recurrence]
+        if period is None:
+            end = window.start_time + window.duration
+            return (window.start_time, end) if end > now else None
+        duration = min(window.duration, period)
+        if now < window.start_time:
+            return window.start_time, window.start_time + duration
+        # آخرین نوبتی که پیش از now شروع شده؛ اگر تمام شده باشد نوبت بعدی
+        start = now - (now - window.start_time) % period
+        if start + duration <= now:
+            start += period
+        return start, start + duration
+
+
+window_schedule = WindowSchedule()